@@ -3,6 +3,7 @@
 import argparse
 import logging
 import os
+import signal
 import threading
 
 from . import config
@@ -13,6 +14,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Seconds to wait for the bots' shutdown sequences after a stop signal
+SHUTDOWN_TIMEOUT = 30
+
 
 def main():
     """Main entry point for the ccc command."""
@@ -44,8 +48,7 @@ def main():
         config_path = os.path.join(os.getcwd(), "config.yaml")
         if not os.path.exists(config_path):
             # Try looking relative to package
-            config_path = os.path.join(os.path.dirname(__file__), "..", "config.yaml")
-            config_path = os.path.abspath(config_path)
+            config_path = config.DEFAULT_CONFIG_PATH
 
     # Load configuration
     config.load_config(config_path)
@@ -54,8 +57,11 @@ def main():
     # Default: run all available bots if neither flag is specified
     run_telegram = args.telegram or (not args.telegram and not args.lark)
     run_lark = args.lark or (not args.telegram and not args.lark)
+    lark_enabled = run_lark and bool(config.LARK_APP_ID)
 
     threads = []
+    # Bot modules whose stop() runs their shutdown sequence
+    stoppable = []
 
     # Start Telegram bot if configured
     if run_telegram and config.TELEGRAM_BOT_TOKEN:
@@ -63,15 +69,16 @@ def main():
         from ccc.telegram import bot as tg_bot
 
         def run_telegram_bot():
-            tg_bot.run(config_path)
+            tg_bot.run(config_path, only_bot=not lark_enabled)
 
         telegram_thread = threading.Thread(target=run_telegram_bot, daemon=True, name="TelegramBot")
         threads.append(telegram_thread)
+        stoppable.append((tg_bot, telegram_thread))
     elif run_telegram:
         logger.warning("--telegram specified but no telegram_bot_token in config")
 
     # Start Lark bot if configured
-    if run_lark and config.LARK_APP_ID:
+    if lark_enabled:
         logger.info("Lark app_id found, starting Lark bot...")
         from ccc.lark import bot as lark_bot
 
@@ -94,12 +101,26 @@ def main():
 
     logger.info(f"Started {len(threads)} bot(s)")
 
-    # Wait for all threads
-    try:
-        for thread in threads:
-            thread.join()
-    except KeyboardInterrupt:
-        logger.info("Shutting down...")
+    # The bots run in threads, where asyncio cannot install signal handlers,
+    # so the main thread catches SIGINT/SIGTERM and asks them to stop
+    stop_requested = threading.Event()
+
+    def request_stop(signum, frame):
+        stop_requested.set()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    # Wait until a signal arrives or every bot has exited
+    while not stop_requested.wait(1):
+        if not any(thread.is_alive() for thread in threads):
+            return
+
+    logger.info("Shutting down...")
+    for bot, thread in stoppable:
+        bot.stop()
+    for bot, thread in stoppable:
+        thread.join(SHUTDOWN_TIMEOUT)
 
 
 if __name__ == "__main__":
@@ -1,9 +1,11 @@
 """Claude SDK operations for ccc bot."""
 
 import asyncio
+import itertools
 import logging
 import os
 import subprocess
+import threading
 import uuid
 from datetime import datetime
 from typing import Any
@@ -19,6 +21,8 @@ from claude_agent_sdk import (
     ToolResultBlock
 )
 
+from . import config
+from . import process
 from .messenger import Messenger
 
 logger = logging.getLogger(__name__)
@@ -27,8 +31,11 @@ logger = logging.getLogger(__name__)
 # Session storage for conversation continuity: {project_name: session_id}
 PROJECT_SESSIONS = {}
 
-# Running queries storage: {project_name: {query_id: {"task": Task, "command": str, "prompt": str, "started_at": datetime, "worktree_path": str, "project_workdir": str}}}
+# Running queries storage: {project_name: {query_id: {"task": Task, "command": str, "prompt": str, "started_at": datetime, "queued": bool, "worktree_path": str, "project_workdir": str}}}
+# "queued" is True while the query waits for a concurrency slot; started_at is reset when it gets one
 RUNNING_QUERIES = {}
+# Guards RUNNING_QUERIES; Telegram and Lark register queries from different threads
+_RUNNING_QUERIES_LOCK = threading.Lock()
 
 # Completed jobs storage for feedback: {query_id: {"session_id": str, "worktree_path": str, "project_workdir": str, "project_name": str, "command": str, "completed_at": datetime}}
 COMPLETED_JOBS = {}
@@ -37,8 +44,181 @@ COMPLETED_JOBS = {}
 # thread_key format: "telegram:{chat_id}:{thread_id}" or "lark:{chat_id}:{root_id}"
 THREAD_WORKTREES = {}
 
+# Secondary index of THREAD_WORKTREES: {project_name: {thread_key, ...}}
+_THREADS_BY_PROJECT = {}
 
-async def run_claude_query(prompt: str, system_prompt: str, cwd: str, resume: str = None, project_name: str = None, command: str = None, user_prompt: str = None, worktree_path: str = None, project_workdir: str = None, query_id: str = None, keep_worktree: bool = False) -> tuple:
+# In-flight query counts per limit key ("*" for the global limit, "platform:chat_id" per chat).
+# Guarded by a thread lock because the Telegram and Lark bots run separate event loops.
+_QUERY_SLOTS = {}
+_QUERY_SLOTS_LOCK = threading.Lock()
+_QUERY_SLOT_POLL_INTERVAL = 1.0  # Seconds between attempts while waiting for a free slot
+
+# Queries waiting for a slot, in arrival order: {ticket: slots}. Guarded by _QUERY_SLOTS_LOCK.
+_QUERY_SLOT_WAITERS = {}
+_QUERY_SLOT_TICKETS = itertools.count()
+
+# Slots taken by reserve_query_slot for the task's upcoming run_claude_query: {task: slots}.
+# Guarded by _QUERY_SLOTS_LOCK.
+_RESERVED_QUERY_SLOTS = {}
+
+# Project workdirs already cloned with CLAUDE.md in place during this process lifetime
+INITIALIZED_PROJECTS = set()
+
+
+def _try_acquire_query_slots(slots: list, ticket: int = None) -> bool:
+    """Take one unit of every (key, limit) slot, or none if any limit is reached.
+
+    Waiters are served in ticket order: a key is off limits while an older
+    waiter is blocked on it, or needs it and could take it now. Keys an older
+    waiter does not need (another chat's limit) stay available.
+
+    Args:
+        slots: (key, limit) pairs to take
+        ticket: The caller's waiter ticket, or None if it is not waiting yet
+            (then every registered waiter is older)
+    """
+    with _QUERY_SLOTS_LOCK:
+        reserved = set()
+        for waiter_ticket, waiter_slots in _QUERY_SLOT_WAITERS.items():
+            if waiter_ticket == ticket:
+                break
+            full = {key for key, limit in waiter_slots if _QUERY_SLOTS.get(key, 0) >= limit}
+            reserved |= full or {key for key, _ in waiter_slots}
+
+        if any(key in reserved or _QUERY_SLOTS.get(key, 0) >= limit for key, limit in slots):
+            return False
+        for key, _ in slots:
+            _QUERY_SLOTS[key] = _QUERY_SLOTS.get(key, 0) + 1
+        if ticket is not None:
+            del _QUERY_SLOT_WAITERS[ticket]
+        return True
+
+
+def _release_query_slots(slots: list):
+    """Give back slots taken by _try_acquire_query_slots."""
+    with _QUERY_SLOTS_LOCK:
+        for key, _ in slots:
+            _QUERY_SLOTS[key] -= 1
+            if not _QUERY_SLOTS[key]:
+                del _QUERY_SLOTS[key]
+
+
+async def _acquire_query_slots(query_id: str, thread_key: str = None, info: dict = None, on_queued=None) -> list:
+    """Wait until the global and per-chat query limits allow another query.
+
+    Polls instead of using asyncio primitives so the wait works from any event
+    loop and stays cancellable via /cancel. Waiting queries take a ticket so
+    they get slots in the order they arrived.
+
+    Args:
+        query_id: Query ID, for logging
+        thread_key: Thread the query was issued from, for the per-chat limit
+        info: The query's RUNNING_QUERIES entry, marked queued while waiting
+        on_queued: Optional coroutine function awaited once if the query has to wait
+
+    Returns:
+        List of (key, limit) slots held, to be passed to _release_query_slots
+    """
+    slots = []
+    if config.MAX_CONCURRENT_QUERIES > 0:
+        slots.append(("*", config.MAX_CONCURRENT_QUERIES))
+    if thread_key and config.MAX_QUERIES_PER_CHAT > 0:
+        chat_key = thread_key.rsplit(":", 1)[0]
+        slots.append((chat_key, config.MAX_QUERIES_PER_CHAT))
+
+    if slots and not _try_acquire_query_slots(slots):
+        with _QUERY_SLOTS_LOCK:
+            ticket = next(_QUERY_SLOT_TICKETS)
+            _QUERY_SLOT_WAITERS[ticket] = slots
+        logger.info("Query %s waiting for a free slot", query_id)
+        if info is not None:
+            info["queued"] = True
+        try:
+            if on_queued is not None:
+                await on_queued()
+            while not _try_acquire_query_slots(slots, ticket):
+                await asyncio.sleep(_QUERY_SLOT_POLL_INTERVAL)
+        finally:
+            # Cancelled while waiting: stop holding up the waiters behind us
+            with _QUERY_SLOTS_LOCK:
+                _QUERY_SLOT_WAITERS.pop(ticket, None)
+        if info is not None:
+            info["started_at"] = datetime.now()
+            info["queued"] = False
+        logger.info("Query %s acquired a slot", query_id)
+
+    return slots
+
+
+def _release_reserved_query_slots(task: asyncio.Task):
+    """Give back slots reserved by a task whose query never ran."""
+    with _QUERY_SLOTS_LOCK:
+        slots = _RESERVED_QUERY_SLOTS.pop(task, None)
+    if slots:
+        _release_query_slots(slots)
+
+
+async def reserve_query_slot(messenger: Messenger, context: Any, query_id: str, thread_key: str = None, project_name: str = None, command: str = None, user_prompt: str = None) -> bool:
+    """Wait for a query slot before creating the query's worktree.
+
+    Queued queries then don't hold a worktree on disk while they wait. The slot
+    is handed to the next run_claude_query call in the same task, or released
+    when the task finishes without one.
+
+    Args:
+        messenger: Platform-specific messenger for sending replies
+        context: Platform-specific context
+        query_id: Query ID
+        thread_key: Thread the query was issued from, for the per-chat limit
+        project_name: Project name, to list the query in RUNNING_QUERIES while it waits
+        command: Command type, for the RUNNING_QUERIES entry
+        user_prompt: Original user prompt, for the RUNNING_QUERIES entry
+
+    Returns:
+        True once the slot is held, False if the query was cancelled while waiting
+    """
+    task = asyncio.current_task()
+
+    # Listed while waiting so /status shows it and /cancel can reach it
+    info = None
+    if project_name:
+        info = {
+            "task": task,
+            "command": command or "query",
+            "prompt": user_prompt,
+            "started_at": datetime.now(),
+            "queued": False,
+            "worktree_path": None,
+            "project_workdir": None
+        }
+        with _RUNNING_QUERIES_LOCK:
+            RUNNING_QUERIES.setdefault(project_name, {})[query_id] = info
+
+    async def notify_queued():
+        await messenger.reply(context, f"Query {query_id} is queued until a query slot frees up...")
+
+    try:
+        slots = await _acquire_query_slots(query_id, thread_key, info, notify_queued)
+    except asyncio.CancelledError:
+        logger.info("Query %s cancelled while queued", query_id)
+        return False
+    finally:
+        if info is not None:
+            with _RUNNING_QUERIES_LOCK:
+                queries = RUNNING_QUERIES.get(project_name)
+                if queries is not None and queries.get(query_id) is info:
+                    del queries[query_id]
+                    if not queries:
+                        del RUNNING_QUERIES[project_name]
+
+    if slots:
+        with _QUERY_SLOTS_LOCK:
+            _RESERVED_QUERY_SLOTS[task] = slots
+        task.add_done_callback(_release_reserved_query_slots)
+    return True
+
+
+async def run_claude_query(prompt: str, system_prompt: str, cwd: str, resume: str = None, project_name: str = None, command: str = None, user_prompt: str = None, worktree_path: str = None, project_workdir: str = None, query_id: str = None, keep_worktree: bool = False, thread_key: str = None) -> tuple:
     """Execute Claude query using SDK and return (duration_minutes, session_id).
 
     Args:
@@ -53,10 +233,12 @@ async def run_claude_query(prompt: str, system_prompt: str, cwd: str, resume: st
         project_workdir: Original project workdir (for worktree cleanup)
         query_id: Optional query ID (generated if not provided)
         keep_worktree: If True, don't cleanup worktree after completion (for feedback)
+        thread_key: Thread the query was issued from, used for the per-chat concurrency limit
+            (unless reserve_query_slot already took a slot for this task)
     """
     start_time = datetime.now()
     if not query_id:
-        query_id = str(uuid.uuid4())[:8]  # Short ID for easier reference
+        query_id = new_query_id()
 
     options = ClaudeAgentOptions(
         model='opus',
@@ -67,26 +249,31 @@ async def run_claude_query(prompt: str, system_prompt: str, cwd: str, resume: st
         resume=resume
     )
 
-    logger.info(f"Starting Claude query in {cwd}" + (f" (resuming session {resume})" if resume else ""))
+    logger.info("Starting Claude query in %s%s", cwd, f" (resuming session {resume})" if resume else "")
 
     # Track the current task if project_name is provided
+    info = None
     if project_name:
-        if project_name not in RUNNING_QUERIES:
-            RUNNING_QUERIES[project_name] = {}
-
-        RUNNING_QUERIES[project_name][query_id] = {
+        info = {
             "task": asyncio.current_task(),
             "command": command or "query",
             "prompt": user_prompt or prompt[:100],
             "started_at": start_time,
+            "queued": False,
             "worktree_path": worktree_path,
             "project_workdir": project_workdir
         }
-        logger.info(f"Tracking query {query_id} for project {project_name}")
+        with _RUNNING_QUERIES_LOCK:
+            RUNNING_QUERIES.setdefault(project_name, {})[query_id] = info
+        logger.info("Tracking query %s for project %s", query_id, project_name)
 
     session_id = None
     was_cancelled = False
+    slots = []
     try:
+        with _QUERY_SLOTS_LOCK:
+            reserved = _RESERVED_QUERY_SLOTS.pop(asyncio.current_task(), None)
+        slots = reserved if reserved is not None else await _acquire_query_slots(query_id, thread_key, info)
         async for message in query(prompt=prompt, options=options):
             if isinstance(message, AssistantMessage):
                 # Process each content block in the message
@@ -102,37 +289,41 @@ async def run_claude_query(prompt: str, system_prompt: str, cwd: str, resume: st
                         print(f"\n[Tool Result] {result_preview}{'...' if len(str(block.content or '')) > 500 else ''}")
             elif isinstance(message, ResultMessage):
                 session_id = message.session_id
-                logger.info(f"Query completed: {message.subtype}, turns: {message.num_turns}, session_id: {session_id}")
+                logger.info("Query completed: %s, turns: %s, session_id: %s", message.subtype, message.num_turns, session_id)
                 print(f"\n[Completed] Turns: {message.num_turns}, Session: {session_id}")
                 if message.is_error:
-                    logger.error(f"Query error: {message.result}")
+                    logger.error("Query error: %s", message.result)
                     print(f"[Error] {message.result}")
     except asyncio.CancelledError:
-        logger.info(f"Query {query_id} cancelled for project {project_name}")
+        logger.info("Query %s cancelled for project %s", query_id, project_name)
         was_cancelled = True
     except Exception as e:
         # Catch stream-related exceptions that may occur during cancellation
         if "WouldBlock" in str(type(e).__name__) or "Cancelled" in str(e):
-            logger.info(f"Query {query_id} stream interrupted for project {project_name}: {type(e).__name__}")
+            logger.info("Query %s stream interrupted for project %s: %s", query_id, project_name, type(e).__name__)
             was_cancelled = True
         else:
             raise
     finally:
+        _release_query_slots(slots)
+
         # Remove from running queries
-        if project_name and project_name in RUNNING_QUERIES:
-            if query_id in RUNNING_QUERIES[project_name]:
-                del RUNNING_QUERIES[project_name][query_id]
-            # Clean up empty project entries
-            if not RUNNING_QUERIES[project_name]:
-                del RUNNING_QUERIES[project_name]
+        if project_name:
+            with _RUNNING_QUERIES_LOCK:
+                queries = RUNNING_QUERIES.get(project_name)
+                if queries is not None:
+                    queries.pop(query_id, None)
+                    # Clean up empty project entries
+                    if not queries:
+                        del RUNNING_QUERIES[project_name]
 
         # Handle worktree cleanup or preservation
         if worktree_path and project_workdir:
             if was_cancelled:
                 # Always cleanup on cancellation
                 from . import git
-                logger.info(f"Cleaning up worktree for cancelled query {query_id}")
-                git.cleanup_worktree(project_workdir, worktree_path)
+                logger.info("Cleaning up worktree for cancelled query %s", query_id)
+                await git.cleanup_worktree_async(project_workdir, worktree_path)
             elif keep_worktree and session_id:
                 # Store for potential feedback
                 COMPLETED_JOBS[query_id] = {
@@ -143,21 +334,21 @@ async def run_claude_query(prompt: str, system_prompt: str, cwd: str, resume: st
                     "command": command,
                     "completed_at": datetime.now()
                 }
-                logger.info(f"Keeping worktree for job {query_id} for potential feedback")
+                logger.info("Keeping worktree for job %s for potential feedback", query_id)
             else:
                 # Clean up worktree
                 from . import git
-                logger.info(f"Cleaning up worktree for query {query_id}")
-                git.cleanup_worktree(project_workdir, worktree_path)
+                logger.info("Cleaning up worktree for query %s", query_id)
+                await git.cleanup_worktree_async(project_workdir, worktree_path)
 
     end_time = datetime.now()
     duration_minutes = (end_time - start_time).total_seconds() / 60
 
     if was_cancelled:
-        logger.info(f"Query was cancelled after {duration_minutes:.2f} minutes")
+        logger.info("Query was cancelled after %.2f minutes", duration_minutes)
         raise asyncio.CancelledError(f"Query cancelled for {project_name}")
 
-    logger.info(f"Duration: {duration_minutes:.2f} minutes")
+    logger.info("Duration: %.2f minutes", duration_minutes)
 
     return duration_minutes, session_id
 
@@ -168,15 +359,11 @@ def get_running_queries_for_project(project_name: str) -> dict:
     Returns:
         Dict of {query_id: query_info} for the project
     """
-    if project_name not in RUNNING_QUERIES:
-        return {}
+    with _RUNNING_QUERIES_LOCK:
+        queries = tuple(RUNNING_QUERIES.get(project_name, {}).items())
 
     # Filter out completed tasks
-    active = {}
-    for query_id, info in RUNNING_QUERIES[project_name].items():
-        if not info["task"].done():
-            active[query_id] = info
-    return active
+    return {query_id: info for query_id, info in queries if not info["task"].done()}
 
 
 def cancel_query(project_name: str, query_id: str = None) -> list:
@@ -191,36 +378,34 @@ def cancel_query(project_name: str, query_id: str = None) -> list:
     """
     from . import git
 
-    if project_name not in RUNNING_QUERIES:
-        return []
+    # Snapshot under the lock: the cancelled tasks unregister themselves as they finish
+    with _RUNNING_QUERIES_LOCK:
+        queries = RUNNING_QUERIES.get(project_name, {})
+        if query_id:
+            # Cancel specific query
+            targets = [(query_id, queries[query_id])] if query_id in queries else []
+        else:
+            # Cancel all queries for the project
+            targets = list(queries.items())
 
     cancelled = []
-
-    if query_id:
-        # Cancel specific query
-        if query_id in RUNNING_QUERIES[project_name]:
-            info = RUNNING_QUERIES[project_name][query_id]
-            if not info["task"].done():
-                info["task"].cancel()
-                cancelled.append(query_id)
-                logger.info(f"Cancelled query {query_id} for project {project_name}")
-                # Clean up worktree
-                worktree_path = info.get("worktree_path")
-                project_workdir = info.get("project_workdir")
-                if worktree_path and project_workdir:
-                    git.cleanup_worktree(project_workdir, worktree_path)
-    else:
-        # Cancel all queries for the project
-        for qid, info in RUNNING_QUERIES[project_name].items():
-            if not info["task"].done():
-                info["task"].cancel()
-                cancelled.append(qid)
-                logger.info(f"Cancelled query {qid} for project {project_name}")
-                # Clean up worktree
-                worktree_path = info.get("worktree_path")
-                project_workdir = info.get("project_workdir")
-                if worktree_path and project_workdir:
-                    git.cleanup_worktree(project_workdir, worktree_path)
+    for qid, info in targets:
+        task = info["task"]
+        if task.done():
+            continue
+        # The task may belong to another platform's event loop
+        try:
+            task.get_loop().call_soon_threadsafe(task.cancel)
+        except RuntimeError:
+            # Its loop closed after the task finished
+            continue
+        cancelled.append(qid)
+        logger.info("Cancelled query %s for project %s", qid, project_name)
+        # Clean up worktree
+        worktree_path = info.get("worktree_path")
+        project_workdir = info.get("project_workdir")
+        if worktree_path and project_workdir:
+            git.cleanup_worktree(project_workdir, worktree_path)
 
     return cancelled
 
@@ -231,17 +416,32 @@ def get_all_running_queries() -> dict:
     Returns:
         Dict of {project_name: {query_id: query_info}}
     """
+    with _RUNNING_QUERIES_LOCK:
+        snapshot = [(project_name, tuple(queries.items())) for project_name, queries in RUNNING_QUERIES.items()]
+
     result = {}
-    for project_name, queries in RUNNING_QUERIES.items():
-        active = {}
-        for query_id, info in queries.items():
-            if not info["task"].done():
-                active[query_id] = info
+    for project_name, queries in snapshot:
+        active = {query_id: info for query_id, info in queries if not info["task"].done()}
         if active:
             result[project_name] = active
     return result
 
 
+# Prepares main before claude /init. Every step runs even if an earlier one
+# fails; the exit status reports whether anything other than git clean failed.
+_INIT_SETUP_SCRIPT = (
+    "status=0; "
+    "git reset --hard || status=1; "
+    "git clean -fd; "
+    "git checkout main || status=1; "
+    "git pull origin main || status=1; "
+    "exit $status"
+)
+
+# Publishes the generated CLAUDE.md; the commit message is passed as $1
+_INIT_PUBLISH_SCRIPT = 'git add CLAUDE.md && git commit -m "$1" && git push origin main'
+
+
 async def initialize_claude_md(messenger: Messenger, context: Any, project_workdir: str) -> bool:
     """Check if CLAUDE.md exists, if not run claude /init to create it, then commit and push.
 
@@ -253,73 +453,29 @@ async def initialize_claude_md(messenger: Messenger, context: Any, project_workd
     claude_md_path = os.path.join(project_workdir, "CLAUDE.md")
 
     if os.path.exists(claude_md_path):
-        logger.info(f"CLAUDE.md already exists in {project_workdir}")
+        logger.info("CLAUDE.md already exists in %s", project_workdir)
         return True
 
     await messenger.reply(context, "CLAUDE.md not found. Preparing to initialize codebase...")
-    logger.info(f"Preparing to run claude /init in {project_workdir}")
+    logger.info("Preparing to run claude /init in %s", project_workdir)
 
     try:
-        # Clean up the branch - reset any uncommitted changes
-        logger.info("Cleaning up branch")
-
-        reset_result = subprocess.run(
-            ["git", "reset", "--hard"],
-            cwd=project_workdir,
-            capture_output=True,
-            text=True,
-            timeout=60
-        )
-
-        if reset_result.returncode != 0:
-            logger.error(f"git reset failed: {reset_result.stderr}")
-            await messenger.reply(context, f"Warning: Could not clean branch:\n{reset_result.stderr[:500]}")
+        # Clean up the branch and pull latest main in a single shell
+        logger.info("Cleaning up branch and pulling from origin/main")
 
-        # Clean untracked files
-        clean_result = subprocess.run(
-            ["git", "clean", "-fd"],
+        setup_result = await process.run_command(
+            ["sh", "-c", _INIT_SETUP_SCRIPT],
             cwd=project_workdir,
-            capture_output=True,
-            text=True,
-            timeout=60
+            timeout=480
         )
 
-        if clean_result.returncode != 0:
-            logger.error(f"git clean failed: {clean_result.stderr}")
-
-        # Checkout to main branch
-        logger.info("Checking out main branch")
-
-        checkout_result = subprocess.run(
-            ["git", "checkout", "main"],
-            cwd=project_workdir,
-            capture_output=True,
-            text=True,
-            timeout=60
-        )
-
-        if checkout_result.returncode != 0:
-            logger.error(f"git checkout main failed: {checkout_result.stderr}")
-            await messenger.reply(context, f"Warning: Could not checkout main:\n{checkout_result.stderr[:500]}")
-
-        # Pull latest from main
-        logger.info("Pulling from origin/main")
-
-        pull_result = subprocess.run(
-            ["git", "pull", "origin", "main"],
-            cwd=project_workdir,
-            capture_output=True,
-            text=True,
-            timeout=300
-        )
-
-        if pull_result.returncode != 0:
-            logger.error(f"git pull failed: {pull_result.stderr}")
-            await messenger.reply(context, f"Warning: Could not pull from main:\n{pull_result.stderr[:500]}")
+        if setup_result.returncode != 0:
+            logger.error("Preparing main branch failed: %s", setup_result.stderr)
+            await messenger.reply(context, f"Warning: Could not fully refresh main:\n{setup_result.stderr[-500:]}")
 
         # Now run claude /init using SDK
         await messenger.reply(context, "Running claude /init to generate CLAUDE.md...")
-        logger.info(f"Running claude /init in {project_workdir}")
+        logger.info("Running claude /init in %s", project_workdir)
 
         try:
             options = ClaudeAgentOptions(
@@ -333,78 +489,48 @@ async def initialize_claude_md(messenger: Messenger, context: Any, project_workd
                 if isinstance(message, ResultMessage):
                     if message.is_error:
                         init_error = message.result
-                        logger.error(f"claude /init failed: {init_error}")
+                        logger.error("claude /init failed: %s", init_error)
 
             if init_error:
                 await messenger.reply(context, f"Failed to initialize CLAUDE.md:\n{init_error[:500] if init_error else 'Unknown error'}")
                 return False
 
         except Exception as e:
-            logger.error(f"claude /init failed: {e}")
+            logger.error("claude /init failed: %s", e)
             await messenger.reply(context, f"Failed to initialize CLAUDE.md:\n{str(e)[:500]}")
             return False
 
         await messenger.reply(context, "CLAUDE.md initialized successfully! Committing and pushing to main branch...")
-        logger.info(f"Successfully initialized CLAUDE.md in {project_workdir}")
+        logger.info("Successfully initialized CLAUDE.md in %s", project_workdir)
 
         # Commit and push CLAUDE.md to main
         try:
-            # Add CLAUDE.md to git
-            add_result = subprocess.run(
-                ["git", "add", "CLAUDE.md"],
-                cwd=project_workdir,
-                capture_output=True,
-                text=True,
-                timeout=60
-            )
-
-            if add_result.returncode != 0:
-                logger.error(f"git add failed: {add_result.stderr}")
-                await messenger.reply(context, f"Warning: Could not add CLAUDE.md to git:\n{add_result.stderr[:500]}")
-                return True  # Still return True as initialization succeeded
-
-            # Commit CLAUDE.md
+            # Add, commit and push CLAUDE.md in a single shell
             commit_message = """Add CLAUDE.md documentation for codebase architecture
 
 Generated with [Claude Code](https://claude.com/claude-code)
 
 Co-Authored-By: Claude <noreply@anthropic.com>"""
 
-            commit_result = subprocess.run(
-                ["git", "commit", "-m", commit_message],
-                cwd=project_workdir,
-                capture_output=True,
-                text=True,
-                timeout=60
-            )
-
-            if commit_result.returncode != 0:
-                logger.error(f"git commit failed: {commit_result.stderr}")
-                await messenger.reply(context, f"Warning: Could not commit CLAUDE.md:\n{commit_result.stderr[:500]}")
-                return True  # Still return True as initialization succeeded
-
-            # Push to main branch
-            push_result = subprocess.run(
-                ["git", "push", "origin", "main"],
+            publish_result = await process.run_command(
+                ["sh", "-c", _INIT_PUBLISH_SCRIPT, "sh", commit_message],
                 cwd=project_workdir,
-                capture_output=True,
-                text=True,
-                timeout=300
+                timeout=420
             )
 
-            if push_result.returncode != 0:
-                logger.error(f"git push failed: {push_result.stderr}")
-                await messenger.reply(context, f"Warning: Could not push CLAUDE.md to main:\n{push_result.stderr[:500]}")
+            if publish_result.returncode != 0:
+                logger.error("Publishing CLAUDE.md failed: %s", publish_result.stderr)
+                await messenger.reply(context, f"Warning: Could not commit and push CLAUDE.md to main:\n{publish_result.stderr[-500:]}")
                 return True  # Still return True as initialization succeeded
 
             await messenger.reply(context, "CLAUDE.md committed and pushed to main successfully!")
-            logger.info(f"Successfully committed and pushed CLAUDE.md to main in {project_workdir}")
+            logger.info("Successfully committed and pushed CLAUDE.md to main in %s", project_workdir)
 
         except subprocess.TimeoutExpired:
             await messenger.reply(context, "Warning: Git operation timed out")
             return True  # Still return True as initialization succeeded
         except Exception as e:
-            logger.error(f"Error committing/pushing CLAUDE.md: {e}")
+            logger.error("Error committing/pushing CLAUDE.md: %s", e)
             await messenger.reply(context, f"Warning: Error with git operations: {str(e)}")
             return True  # Still return True as initialization succeeded
 
@@ -414,11 +540,130 @@ Co-Authored-By: Claude <noreply@anthropic.com>"""
         await messenger.reply(context, "Git operation timed out during CLAUDE.md initialization")
         return False
     except Exception as e:
-        logger.error(f"Error initializing CLAUDE.md: {e}")
+        logger.error("Error initializing CLAUDE.md: %s", e)
         await messenger.reply(context, f"Error initializing CLAUDE.md: {str(e)}")
         return False
 
 
+def _is_project_ready(project_workdir: str) -> bool:
+    """Check the INITIALIZED_PROJECTS memo, forgetting workdirs whose CLAUDE.md is gone.
+
+    A single stat on CLAUDE.md also covers the workdir itself having been
+    deleted, so the next command clones and initializes it again.
+    """
+    if project_workdir not in INITIALIZED_PROJECTS:
+        return False
+    if os.path.exists(os.path.join(project_workdir, "CLAUDE.md")):
+        return True
+    logger.info("CLAUDE.md missing in %s, preparing the project again", project_workdir)
+    INITIALIZED_PROJECTS.discard(project_workdir)
+    return False
+
+
+async def ensure_project_ready(messenger: Messenger, context: Any, project_repo: str, project_workdir: str) -> bool:
+    """Clone the repository and initialize CLAUDE.md unless already done for this workdir.
+
+    Args:
+        messenger: Platform-specific messenger for sending replies
+        context: Platform-specific context (Telegram update, Lark message dict, etc.)
+        project_repo: Git repository URL
+        project_workdir: Working directory for the project
+
+    Returns:
+        True if the project is ready to use, False otherwise
+    """
+    if _is_project_ready(project_workdir):
+        return True
+
+    from . import git
+
+    async with git.checkout_lock(project_workdir):
+        # Another command may have prepared the project while we waited
+        if _is_project_ready(project_workdir):
+            return True
+
+        if not await git.clone_repository_if_needed(messenger, context, project_repo, project_workdir):
+            return False
+
+        if not await initialize_claude_md(messenger, context, project_workdir):
+            return False
+
+        INITIALIZED_PROJECTS.add(project_workdir)
+    return True
+
+
+def invalidate_project(project_workdir: str):
+    """Forget that a project workdir was initialized so the next command re-checks it."""
+    INITIALIZED_PROJECTS.discard(project_workdir)
+
+
+def mark_project_ready(project_workdir: str):
+    """Record that a project workdir is cloned and has CLAUDE.md, as ensure_project_ready would."""
+    INITIALIZED_PROJECTS.add(project_workdir)
+
+
+def new_query_id() -> str:
+    """Generate a short random query ID (8 hex characters) for easier reference."""
+    return uuid.uuid4().hex[:8]
+
+
+def build_project_prompt(project_name: str, project_repo: str, worktree_path: str,
+                         text: str, output_file: str, label: str = "Task") -> str:
+    """Build the prompt for a query that runs inside a project checkout.
+
+    Args:
+        project_name: Name of the project
+        project_repo: Repository URL
+        worktree_path: Directory Claude works in
+        text: The user's request
+        output_file: File Claude should write its answer to
+        label: Heading for the user's request ("Task" or "Query")
+    """
+    return f"""Project: {project_name}
+Repository: {project_repo}
+Working Directory: {worktree_path}
+
+{label}: {text}
+
+Write the output in {output_file}"""
+
+
+def build_casual_prompt(text: str, output_file: str) -> str:
+    """Build the prompt for a casual query that has no project context.
+
+    Args:
+        text: The user's query
+        output_file: File Claude should write its answer to
+    """
+    return f"""You are a helpful assistant. Please respond to the following query.
+
+Query: {text}
+
+IMPORTANT: Write your complete response to the file {output_file}. Use the Write tool to create this file with your response."""
+
+
+def consume_output_file(output_file: str, max_chars: int = -1) -> str | None:
+    """Read a query's output file and delete it.
+
+    Blocking; handlers call it through asyncio.to_thread.
+
+    Args:
+        output_file: Path of the file Claude wrote
+        max_chars: Read at most this many characters, or everything if negative
+
+    Returns:
+        File contents, or None if Claude did not create the file
+    """
+    try:
+        with open(output_file, 'r') as f:
+            content = f.read(max_chars)
+    except FileNotFoundError:
+        return None
+    os.remove(output_file)
+    logger.info("Cleaned up %s", output_file)
+    return content
+
+
 def get_session(project_name: str) -> str | None:
     """Get stored session ID for a project."""
     return PROJECT_SESSIONS.get(project_name)
@@ -428,13 +673,13 @@ def set_session(project_name: str, session_id: str):
     """Store session ID for a project."""
     if session_id:
         PROJECT_SESSIONS[project_name] = session_id
-        logger.info(f"Stored session {session_id} for project {project_name}")
+        logger.info("Stored session %s for project %s", session_id, project_name)
 
 
 def clear_session(project_name: str):
     """Clear stored session ID for a project."""
     PROJECT_SESSIONS.pop(project_name, None)
-    logger.info(f"Cleared existing session for project {project_name}")
+    logger.info("Cleared existing session for project %s", project_name)
 
 
 def get_completed_job(job_id: str) -> dict | None:
@@ -468,11 +713,11 @@ def remove_completed_job(job_id: str) -> bool:
     project_workdir = job_info.get("project_workdir")
 
     if worktree_path and project_workdir:
-        logger.info(f"Cleaning up worktree for completed job {job_id}")
+        logger.info("Cleaning up worktree for completed job %s", job_id)
         git.cleanup_worktree(project_workdir, worktree_path)
 
     del COMPLETED_JOBS[job_id]
-    logger.info(f"Removed completed job {job_id}")
+    logger.info("Removed completed job %s", job_id)
     return True
 
 
@@ -513,7 +758,7 @@ def cleanup_old_completed_jobs(max_age_hours: int = 24):
         remove_completed_job(job_id)
 
     if jobs_to_remove:
-        logger.info(f"Cleaned up {len(jobs_to_remove)} old completed jobs")
+        logger.info("Cleaned up %s old completed jobs", len(jobs_to_remove))
 
 
 # Thread-to-worktree functions
@@ -532,6 +777,47 @@ def get_thread_key_lark(chat_id: str, root_id: str = None) -> str:
     return f"lark:{chat_id}:main"
 
 
+def find_thread_worktree(platform: str, chat_id: str, thread_id: str = None) -> tuple[str, dict | None]:
+    """Find the worktree context for a chat thread, with fallback.
+
+    Tries the thread itself, then the chat's main thread, and for messages
+    outside a thread any thread of the chat.
+
+    Args:
+        platform: "telegram" or "lark"
+        chat_id: Chat identifier
+        thread_id: Telegram message_thread_id or Lark root_id (None outside threads)
+
+    Returns:
+        Tuple of (thread_key, worktree_info or None)
+    """
+    # Primary: try with the thread id
+    primary_key = f"{platform}:{chat_id}:{thread_id or 'main'}"
+    worktree_info = THREAD_WORKTREES.get(primary_key)
+
+    if worktree_info:
+        logger.info("Found thread context for key %s", primary_key)
+        return primary_key, worktree_info
+
+    if thread_id:
+        # Fallback 1: If we have a thread id, try the 'main' key for the same chat
+        fallback_key = f"{platform}:{chat_id}:main"
+        worktree_info = THREAD_WORKTREES.get(fallback_key)
+        if worktree_info:
+            logger.info("Found thread context using fallback key %s", fallback_key)
+            return fallback_key, worktree_info
+    else:
+        # Fallback 2: If we don't have a thread id, search for any thread in this chat
+        chat_prefix = f"{platform}:{chat_id}:"
+        for key, info in THREAD_WORKTREES.items():
+            if key.startswith(chat_prefix):
+                logger.info("Found thread context for chat using key %s", key)
+                return key, info
+
+    logger.info("No thread context found for key %s", primary_key)
+    return primary_key, None
+
+
 def validate_thread_key(thread_key: str) -> tuple[bool, str]:
     """Validate that a thread key is properly formed.
 
@@ -567,7 +853,7 @@ def validate_thread_key(thread_key: str) -> tuple[bool, str]:
 
 def set_thread_worktree(thread_key: str, query_id: str, session_id: str,
                         worktree_path: str, project_workdir: str,
-                        project_name: str, project_repo: str):
+                        project_name: str, project_repo: str, kind: str = "worktree"):
     """Associate a thread with a worktree context.
 
     Args:
@@ -578,6 +864,7 @@ def set_thread_worktree(thread_key: str, query_id: str, session_id: str,
         project_workdir: Main project working directory
         project_name: Project name
         project_repo: Project repository URL
+        kind: Context kind - "worktree", "casual" (no project) or "up" (/up pseudo worktree)
 
     Raises:
         ValueError: If thread_key is invalid
@@ -586,6 +873,11 @@ def set_thread_worktree(thread_key: str, query_id: str, session_id: str,
     if not is_valid:
         raise ValueError(f"Invalid thread key: {error}")
 
+    previous = THREAD_WORKTREES.get(thread_key)
+    if previous:
+        _unindex_thread(thread_key, previous.get("project_name"))
+    _THREADS_BY_PROJECT.setdefault(project_name, set()).add(thread_key)
+
     THREAD_WORKTREES[thread_key] = {
         "query_id": query_id,
         "session_id": session_id,
@@ -593,9 +885,10 @@ def set_thread_worktree(thread_key: str, query_id: str, session_id: str,
         "project_workdir": project_workdir,
         "project_name": project_name,
         "project_repo": project_repo,
+        "kind": kind,
         "updated_at": datetime.now()
     }
-    logger.info(f"Associated thread {thread_key} with worktree {query_id} (session: {session_id})")
+    logger.info("Associated thread %s with worktree %s (session: %s)", thread_key, query_id, session_id)
 
 
 def get_thread_worktree(thread_key: str) -> dict | None:
@@ -620,7 +913,7 @@ def update_thread_session(thread_key: str, session_id: str):
     if thread_key in THREAD_WORKTREES:
         THREAD_WORKTREES[thread_key]["session_id"] = session_id
         THREAD_WORKTREES[thread_key]["updated_at"] = datetime.now()
-        logger.info(f"Updated session for thread {thread_key} to {session_id}")
+        logger.info("Updated session for thread %s to %s", thread_key, session_id)
 
 
 def clear_thread_worktree(thread_key: str):
@@ -629,9 +922,43 @@ def clear_thread_worktree(thread_key: str):
     Args:
         thread_key: Unique thread identifier
     """
-    if thread_key in THREAD_WORKTREES:
-        del THREAD_WORKTREES[thread_key]
-        logger.info(f"Cleared worktree association for thread {thread_key}")
+    info = THREAD_WORKTREES.pop(thread_key, None)
+    if info is not None:
+        _unindex_thread(thread_key, info.get("project_name"))
+        logger.info("Cleared worktree association for thread %s", thread_key)
+
+
+def _unindex_thread(thread_key: str, project_name: str):
+    """Remove a thread from the project_name -> thread keys index."""
+    thread_keys = _THREADS_BY_PROJECT.get(project_name)
+    if thread_keys is not None:
+        thread_keys.discard(thread_key)
+        if not thread_keys:
+            del _THREADS_BY_PROJECT[project_name]
+
+
+def get_active_query_ids() -> set:
+    """Get the IDs of all queries whose worktrees are still in use.
+
+    Covers running queries, completed jobs kept for feedback and thread contexts.
+    """
+    with _RUNNING_QUERIES_LOCK:
+        running_ids = {query_id for queries in RUNNING_QUERIES.values() for query_id in queries}
+
+    return (
+        COMPLETED_JOBS.keys()
+        | running_ids
+        | {info["query_id"] for info in THREAD_WORKTREES.values() if info.get("query_id")}
+    )
+
+
+def get_thread_keys_for_project(project_name: str) -> set:
+    """Get the keys of all threads associated with a project.
+
+    Returns:
+        Set of thread keys (a copy, safe to iterate while clearing threads)
+    """
+    return set(_THREADS_BY_PROJECT.get(project_name, ()))
 
 
 def get_all_thread_worktrees() -> dict:
@@ -2,12 +2,24 @@
 
 import logging
 import os
+import tempfile
 import yaml
 
+try:
+    from yaml import CSafeLoader as _SafeLoader
+except ImportError:  # PyYAML built without libyaml
+    from yaml import SafeLoader as _SafeLoader
+
 logger = logging.getLogger(__name__)
 
+# Checkout the bot runs from, and the config.yaml shipped next to the package
+BOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CONFIG_PATH = os.path.join(BOT_DIR, "config.yaml")
+
 # Global configuration - Shared
 AUTHORIZED_USERS = []
+AUTHORIZED_USERS_SET = frozenset()  # AUTHORIZED_USERS for O(1) membership checks
+UNAUTHORIZED_REPLY = ""  # Reply sent to users outside AUTHORIZED_USERS
 PROJECTS = []
 ASK_RULES = ""
 FEAT_RULES = ""
@@ -16,6 +28,13 @@ PLAN_RULES = ""
 FEEDBACK_RULES = ""
 GENERAL_RULES = ""
 WORKTREE_BASE = "/tmp/ccc-worktrees"  # Base directory for git worktrees
+MAX_CONCURRENT_QUERIES = 0  # Max Claude queries in flight across all chats (0 = unlimited)
+MAX_QUERIES_PER_CHAT = 1  # Max Claude queries in flight per chat (0 = unlimited)
+
+# Directory for Claude output handoff files. Prefer /dev/shm (tmpfs) so the
+# write/read/unlink cycle of every query never touches the block device.
+_DEFAULT_OUTPUT_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+OUTPUT_DIR = os.environ.get("CCC_OUTPUT_DIR", _DEFAULT_OUTPUT_DIR)
 
 # Telegram-specific configuration
 TELEGRAM_BOT_TOKEN = ""
@@ -30,141 +49,223 @@ LARK_WEBHOOK_PORT = 8080
 LARK_AUTHORIZED_USERS = []  # List of Lark user open_ids
 LARK_AUTHORIZED_CHATS = []  # List of Lark chat_ids
 
+# Projects keyed by project_name, rebuilt by load_config()
+_PROJECT_INDEX = {}
+_AVAILABLE_PROJECTS_STR = ""  # Project names joined for "not found" replies
+# Telegram group id -> configured thread_id (sub) as int, or None
+_TELEGRAM_GROUP_INDEX = {}
+_TELEGRAM_GROUP_IDS = ()  # Group ids in config order, for broadcasts
+# Lark authorization lists as sets for O(1) membership checks
+_LARK_AUTHORIZED_USERS_SET = frozenset()
+_LARK_AUTHORIZED_CHATS_SET = frozenset()
+
+# (path, st_mtime_ns) of the config file currently applied, None after a failed load
+_LOADED_CONFIG_KEY = None
+
 
 def load_config(config_path: str = None):
     """Load configuration from config.yaml"""
     global PROJECTS, AUTHORIZED_USERS, TELEGRAM_AUTHORIZED_GROUPS
     global ASK_RULES, FEAT_RULES, FIX_RULES, PLAN_RULES, FEEDBACK_RULES, GENERAL_RULES
-    global TELEGRAM_BOT_TOKEN, WORKTREE_BASE
+    global TELEGRAM_BOT_TOKEN, WORKTREE_BASE, OUTPUT_DIR, MAX_CONCURRENT_QUERIES, MAX_QUERIES_PER_CHAT
     global LARK_APP_ID, LARK_APP_SECRET, LARK_VERIFICATION_TOKEN, LARK_ENCRYPT_KEY
     global LARK_WEBHOOK_PORT, LARK_AUTHORIZED_USERS, LARK_AUTHORIZED_CHATS
+    global _LOADED_CONFIG_KEY
 
     if config_path is None:
-        config_path = os.path.join(os.path.dirname(__file__), "..", "config.yaml")
-        config_path = os.path.abspath(config_path)
+        config_path = DEFAULT_CONFIG_PATH
 
     try:
-        with open(config_path, 'r') as f:
-            data = yaml.safe_load(f)
-
-            # Shared configuration
-            PROJECTS = data.get('projects', [])
-            AUTHORIZED_USERS = data.get('authorized_users', [])
-            GENERAL_RULES = data.get('general_rules', '')
-            ASK_RULES = data.get('ask_rules', '')
-            FEAT_RULES = data.get('feat_rules', '')
-            FIX_RULES = data.get('fix_rules', '')
-            PLAN_RULES = data.get('plan_rules', '')
-            FEEDBACK_RULES = data.get('feedback_rules', '')
-            WORKTREE_BASE = data.get('worktree_base', '/tmp/ccc-worktrees')
-
-            # Telegram configuration
-            telegram_config = data.get('telegram', {})
-            if telegram_config:
-                TELEGRAM_BOT_TOKEN = telegram_config.get('bot_token', '')
-
-                # Parse telegram authorized_groups - supports format with optional sub (thread_id)
-                raw_groups = telegram_config.get('authorized_groups', [])
-                TELEGRAM_AUTHORIZED_GROUPS = []
-                for group in raw_groups:
-                    if isinstance(group, dict):
-                        # Format: {group: "id", sub: "thread_id"}
-                        TELEGRAM_AUTHORIZED_GROUPS.append({
-                            "group": str(group.get('group', '')),
-                            "sub": str(group.get('sub', '')) if group.get('sub') else None
-                        })
-                    else:
-                        # Simple format: just the group id as string
-                        TELEGRAM_AUTHORIZED_GROUPS.append({"group": str(group), "sub": None})
-
-            # Lark configuration
-            lark_config = data.get('lark', {})
-            if lark_config:
-                LARK_APP_ID = lark_config.get('app_id', '')
-                LARK_APP_SECRET = lark_config.get('app_secret', '')
-                LARK_VERIFICATION_TOKEN = lark_config.get('verification_token', '')
-                LARK_ENCRYPT_KEY = lark_config.get('encrypt_key', '')
-                LARK_WEBHOOK_PORT = lark_config.get('webhook_port', 8080)
-                LARK_AUTHORIZED_USERS = lark_config.get('authorized_users', [])
-                LARK_AUTHORIZED_CHATS = lark_config.get('authorized_chats', [])
-
-            # Logging
-            logger.info(f"Loaded {len(PROJECTS)} projects from {config_path}")
-            logger.info(f"Worktree base: {WORKTREE_BASE}")
-            for project in PROJECTS:
-                logger.info(f"  - {project['project_name']}: {project['project_workdir']}")
-
-            logger.info(f"Loaded {len(AUTHORIZED_USERS)} authorized users (shared)")
-            for user in AUTHORIZED_USERS:
-                logger.info(f"  - {user}")
-
-            if TELEGRAM_BOT_TOKEN:
-                logger.info(f"Telegram configuration loaded")
-                logger.info(f"  - {len(TELEGRAM_AUTHORIZED_GROUPS)} authorized groups")
-                for group_info in TELEGRAM_AUTHORIZED_GROUPS:
-                    if group_info.get('sub'):
-                        logger.info(f"    - {group_info['group']} (sub: {group_info['sub']})")
-                    else:
-                        logger.info(f"    - {group_info['group']}")
-
-            if LARK_APP_ID:
-                logger.info(f"Lark configuration loaded (app_id: {LARK_APP_ID[:10]}...)")
-                logger.info(f"  - {len(LARK_AUTHORIZED_USERS)} authorized users")
-                logger.info(f"  - {len(LARK_AUTHORIZED_CHATS)} authorized chats")
-                logger.info(f"  - Webhook port: {LARK_WEBHOOK_PORT}")
+        cache_key = (config_path, os.stat(config_path).st_mtime_ns)
+        if cache_key == _LOADED_CONFIG_KEY:
+            # Unchanged and already applied, e.g. the bot threads reloading the
+            # file __main__ loaded at startup: skip the parse and the rebuild
+            return
+
+        # Binary mode lets libyaml detect the encoding and skip Python's text decoding
+        with open(config_path, 'rb') as f:
+            data = yaml.load(f, Loader=_SafeLoader)
+
+        # Shared configuration
+        PROJECTS = data.get('projects', [])
+        AUTHORIZED_USERS = data.get('authorized_users', [])
+        GENERAL_RULES = data.get('general_rules', '')
+        ASK_RULES = data.get('ask_rules', '')
+        FEAT_RULES = data.get('feat_rules', '')
+        FIX_RULES = data.get('fix_rules', '')
+        PLAN_RULES = data.get('plan_rules', '')
+        FEEDBACK_RULES = data.get('feedback_rules', '')
+        WORKTREE_BASE = data.get('worktree_base', '/tmp/ccc-worktrees')
+        # CCC_OUTPUT_DIR takes precedence over the config file
+        OUTPUT_DIR = os.environ.get("CCC_OUTPUT_DIR") or data.get('output_dir', _DEFAULT_OUTPUT_DIR)
+        MAX_CONCURRENT_QUERIES = data.get('max_concurrent_queries', 0)
+        MAX_QUERIES_PER_CHAT = data.get('max_queries_per_chat', 1)
+
+        # Telegram configuration
+        telegram_config = data.get('telegram', {})
+        if telegram_config:
+            TELEGRAM_BOT_TOKEN = telegram_config.get('bot_token', '')
+
+            # Parse telegram authorized_groups - supports format with optional sub (thread_id)
+            raw_groups = telegram_config.get('authorized_groups', [])
+            TELEGRAM_AUTHORIZED_GROUPS = []
+            for group in raw_groups:
+                if isinstance(group, dict):
+                    # Format: {group: "id", sub: "thread_id"}
+                    TELEGRAM_AUTHORIZED_GROUPS.append({
+                        "group": str(group.get('group', '')),
+                        "sub": str(group.get('sub', '')) if group.get('sub') else None
+                    })
+                else:
+                    # Simple format: just the group id as string
+                    TELEGRAM_AUTHORIZED_GROUPS.append({"group": str(group), "sub": None})
+
+        # Lark configuration
+        lark_config = data.get('lark', {})
+        if lark_config:
+            LARK_APP_ID = lark_config.get('app_id', '')
+            LARK_APP_SECRET = lark_config.get('app_secret', '')
+            LARK_VERIFICATION_TOKEN = lark_config.get('verification_token', '')
+            LARK_ENCRYPT_KEY = lark_config.get('encrypt_key', '')
+            LARK_WEBHOOK_PORT = lark_config.get('webhook_port', 8080)
+            LARK_AUTHORIZED_USERS = lark_config.get('authorized_users', [])
+            LARK_AUTHORIZED_CHATS = lark_config.get('authorized_chats', [])
+
+        if logger.isEnabledFor(logging.INFO):
+            _log_config(config_path)
 
     except Exception as e:
-        logger.error(f"Error loading config from {config_path}: {e}")
+        logger.error("Error loading config from %s: %s", config_path, e)
         PROJECTS = []
         AUTHORIZED_USERS = []
         TELEGRAM_AUTHORIZED_GROUPS = []
+        cache_key = None
+
+    _rebuild_indexes()
+    _LOADED_CONFIG_KEY = cache_key
+
+
+def _rebuild_indexes():
+    """Rebuild the lookup tables derived from the loaded configuration.
+
+    The getters below only read these, so every lookup is a dict or set
+    access and nothing is parsed again until the next load_config().
+    """
+    global _PROJECT_INDEX, _AVAILABLE_PROJECTS_STR, _TELEGRAM_GROUP_INDEX, _TELEGRAM_GROUP_IDS
+    global _LARK_AUTHORIZED_USERS_SET, _LARK_AUTHORIZED_CHATS_SET, AUTHORIZED_USERS_SET, UNAUTHORIZED_REPLY
+
+    _PROJECT_INDEX = {p['project_name']: p for p in PROJECTS}
+    _AVAILABLE_PROJECTS_STR = ", ".join(_PROJECT_INDEX)
+    _TELEGRAM_GROUP_INDEX = {}
+    for group_info in TELEGRAM_AUTHORIZED_GROUPS:
+        # First entry with a sub wins, matching the order of the config file
+        if _TELEGRAM_GROUP_INDEX.get(group_info['group']) is None:
+            sub = group_info.get('sub')
+            _TELEGRAM_GROUP_INDEX[group_info['group']] = int(sub) if sub else None
+    _TELEGRAM_GROUP_IDS = tuple(group_info['group'] for group_info in TELEGRAM_AUTHORIZED_GROUPS)
+    _LARK_AUTHORIZED_USERS_SET = frozenset(LARK_AUTHORIZED_USERS)
+    _LARK_AUTHORIZED_CHATS_SET = frozenset(LARK_AUTHORIZED_CHATS)
+    AUTHORIZED_USERS_SET = frozenset(AUTHORIZED_USERS)
+    UNAUTHORIZED_REPLY = f"I only respond to {', '.join(AUTHORIZED_USERS)}"
+    _specialize_telegram_authorization()
+
+
+def _log_config(config_path: str):
+    """Log a summary of the loaded configuration, one record per section."""
+    logger.info("Loaded %d projects from %s%s", len(PROJECTS), config_path,
+                "".join(f"\n  - {p['project_name']}: {p['project_workdir']}" for p in PROJECTS))
+    logger.info("Worktree base: %s", WORKTREE_BASE)
+    logger.info("Output dir: %s", OUTPUT_DIR)
+    if MAX_CONCURRENT_QUERIES or MAX_QUERIES_PER_CHAT:
+        logger.info("Query limits: %s total, %s per chat",
+                    MAX_CONCURRENT_QUERIES or 'unlimited', MAX_QUERIES_PER_CHAT or 'unlimited')
+
+    logger.info("Loaded %d authorized users (shared)%s", len(AUTHORIZED_USERS),
+                "".join(f"\n  - {user}" for user in AUTHORIZED_USERS))
+
+    if TELEGRAM_BOT_TOKEN:
+        groups = "".join(
+            f"\n    - {g['group']} (sub: {g['sub']})" if g.get('sub') else f"\n    - {g['group']}"
+            for g in TELEGRAM_AUTHORIZED_GROUPS
+        )
+        logger.info("Telegram configuration loaded\n  - %d authorized groups%s",
+                    len(TELEGRAM_AUTHORIZED_GROUPS), groups)
+
+    if LARK_APP_ID:
+        logger.info("Lark configuration loaded (app_id: %s...)\n  - %d authorized users\n  - %d authorized chats\n  - Webhook port: %s",
+                    LARK_APP_ID[:10], len(LARK_AUTHORIZED_USERS), len(LARK_AUTHORIZED_CHATS), LARK_WEBHOOK_PORT)
 
 
 def get_project(project_name: str) -> dict | None:
     """Find a project by name."""
-    for p in PROJECTS:
-        if p['project_name'] == project_name:
-            return p
-    return None
+    return _PROJECT_INDEX.get(project_name)
 
 
 def get_available_projects() -> str:
     """Get comma-separated list of available project names."""
-    return ", ".join([p['project_name'] for p in PROJECTS])
+    return _AVAILABLE_PROJECTS_STR
+
+
+def project_not_found_message(project_name: str) -> str:
+    """Get the reply for an unknown project name, listing the available projects."""
+    return f"Project '{project_name}' not found. Available projects: {_AVAILABLE_PROJECTS_STR}"
 
 
 # Telegram-specific helpers
 def is_telegram_group_authorized(chat_id: str) -> bool:
     """Check if a Telegram chat/group is authorized."""
-    for group_info in TELEGRAM_AUTHORIZED_GROUPS:
-        if group_info['group'] == chat_id:
-            return True
-    return False
+    return chat_id in _TELEGRAM_GROUP_INDEX
 
 
 def get_telegram_thread_id(chat_id: str) -> int | None:
     """Get the thread_id (sub) for a Telegram group, if configured."""
-    for group_info in TELEGRAM_AUTHORIZED_GROUPS:
-        if group_info['group'] == chat_id and group_info.get('sub'):
-            return int(group_info['sub'])
-    return None
+    return _TELEGRAM_GROUP_INDEX.get(chat_id)
+
+
+def _is_telegram_authorized_general(username: str, chat_id: str) -> bool:
+    """Check a Telegram user and chat against the full authorization lists."""
+    return username in AUTHORIZED_USERS_SET and is_telegram_group_authorized(chat_id)
+
+
+# Rebound by load_config() to a specialized check for single-user, single-chat setups
+is_telegram_authorized = _is_telegram_authorized_general
+
+
+def _specialize_telegram_authorization():
+    """Bind is_telegram_authorized to the cheapest check for the loaded config.
+
+    The common deployment has one authorized user and one group, in which case
+    authorization is two direct comparisons instead of list scans.
+    """
+    global is_telegram_authorized
+
+    if len(AUTHORIZED_USERS_SET) == 1 and len(TELEGRAM_AUTHORIZED_GROUPS) == 1:
+        only_user = next(iter(AUTHORIZED_USERS_SET))
+        only_group = TELEGRAM_AUTHORIZED_GROUPS[0]['group']
+
+        def _is_telegram_authorized_single(username: str, chat_id: str) -> bool:
+            return username == only_user and chat_id == only_group
+
+        is_telegram_authorized = _is_telegram_authorized_single
+    else:
+        is_telegram_authorized = _is_telegram_authorized_general
 
 
-def get_telegram_authorized_group_ids() -> list:
-    """Get list of authorized Telegram group IDs (for startup messages)."""
-    return [group_info['group'] for group_info in TELEGRAM_AUTHORIZED_GROUPS]
+def get_telegram_authorized_group_ids() -> tuple:
+    """Get authorized Telegram group IDs (for startup messages)."""
+    return _TELEGRAM_GROUP_IDS
 
 
 # Lark-specific helpers
 def is_lark_user_authorized(user_open_id: str) -> bool:
     """Check if a Lark user is authorized."""
     # Check both shared and Lark-specific authorized users
-    return user_open_id in LARK_AUTHORIZED_USERS
+    return user_open_id in _LARK_AUTHORIZED_USERS_SET
 
 
 def is_lark_chat_authorized(chat_id: str) -> bool:
     """Check if a Lark chat is authorized."""
-    return chat_id in LARK_AUTHORIZED_CHATS
+    return chat_id in _LARK_AUTHORIZED_CHATS_SET
 
 
 # Legacy aliases for backward compatibility
@@ -178,6 +279,6 @@ def get_thread_id(chat_id: str) -> int | None:
     return get_telegram_thread_id(chat_id)
 
 
-def get_authorized_group_ids() -> list:
+def get_authorized_group_ids() -> tuple:
     """Alias for get_telegram_authorized_group_ids for backward compatibility."""
     return get_telegram_authorized_group_ids()
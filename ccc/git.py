@@ -1,20 +1,56 @@
 """Git operations for ccc bot."""
 
+import asyncio
+import contextlib
 import logging
 import os
 import shutil
 import subprocess
+import threading
 from typing import Any, Optional
 
 from . import config
+from . import process
 from .messenger import Messenger
 
 logger = logging.getLogger(__name__)
 
+# Locks serializing changes to each project's main checkout (clone, CLAUDE.md
+# setup, reset/pull, worktree add), keyed by project_workdir. Threading locks
+# because the Telegram and Lark bots run separate event loops.
+_CHECKOUT_LOCKS = {}
+CHECKOUT_LOCK_POLL_INTERVAL = 0.1  # Seconds between attempts to take a held lock
+
+
+@contextlib.asynccontextmanager
+async def checkout_lock(project_workdir: str):
+    """Hold the lock for a project's main checkout without blocking the event loop.
+
+    Not reentrant: code running under the lock must not take it again.
+
+    Args:
+        project_workdir: Working directory for the project
+    """
+    lock = _CHECKOUT_LOCKS.get(project_workdir)
+    if lock is None:
+        lock = _CHECKOUT_LOCKS.setdefault(project_workdir, threading.Lock())
+    # Poll instead of blocking a thread on acquire(), so a cancelled waiter
+    # never ends up owning the lock
+    while not lock.acquire(blocking=False):
+        await asyncio.sleep(CHECKOUT_LOCK_POLL_INTERVAL)
+    try:
+        yield
+    finally:
+        lock.release()
+
 
 async def clone_repository_if_needed(messenger: Messenger, context: Any, project_repo: str, project_workdir: str) -> bool:
     """Clone repository if project directory doesn't exist.
 
+    Query commands reach this through claude.ensure_project_ready, which
+    remembers prepared workdirs, so the existence check only runs on a
+    project's first command and on /init.
+
     Args:
         messenger: Platform-specific messenger for sending replies
         context: Platform-specific context (Telegram update, Lark message dict, etc.)
@@ -25,18 +61,20 @@ async def clone_repository_if_needed(messenger: Messenger, context: Any, project
         return True
 
     await messenger.reply(context, f"Project directory not found. Cloning {project_repo}...")
-    logger.info(f"Cloning {project_repo} into {project_workdir}")
+    logger.info("Cloning %s into %s", project_repo, project_workdir)
 
     try:
         parent_dir = os.path.dirname(project_workdir)
         if parent_dir and not os.path.exists(parent_dir):
             os.makedirs(parent_dir, exist_ok=True)
 
-        clone_result = subprocess.run(
-            ["git", "clone", project_repo, project_workdir],
-            capture_output=True,
-            text=True,
-            timeout=1800
+        # Partial clone: full history, but file contents are only downloaded
+        # when checked out. Never prompt for credentials, fail instead of
+        # hanging until the timeout
+        clone_result = await process.run_command(
+            ["git", "clone", "--filter=blob:none", project_repo, project_workdir],
+            timeout=1800,
+            env={**os.environ, "GIT_TERMINAL_PROMPT": "0"}
         )
 
         if clone_result.returncode != 0:
@@ -44,14 +82,14 @@ async def clone_repository_if_needed(messenger: Messenger, context: Any, project
             return False
 
         await messenger.reply(context, f"Repository cloned successfully!")
-        logger.info(f"Successfully cloned {project_repo}")
+        logger.info("Successfully cloned %s", project_repo)
         return True
 
     except subprocess.TimeoutExpired:
         await messenger.reply(context, "Git clone timed out after 30 minutes")
         return False
     except Exception as e:
-        logger.error(f"Error cloning repository: {e}")
+        logger.error("Error cloning repository: %s", e)
         await messenger.reply(context, f"Error cloning repository: {str(e)}")
         return False
 
@@ -65,88 +103,78 @@ async def refresh_to_main_branch(messenger: Messenger, context: Any, project_wor
         project_workdir: Working directory for the project
         branch: Branch name to checkout (default: "main")
     """
-    logger.info(f"Preparing fresh {branch} branch")
+    async with checkout_lock(project_workdir):
+        logger.info("Preparing fresh %s branch", branch)
 
-    try:
-        # Fetch all branches first
-        logger.info("Fetching from origin")
+        try:
+            # Fetch all branches first
+            logger.info("Fetching from origin")
 
-        fetch_result = subprocess.run(
-            ["git", "fetch", "origin"],
-            cwd=project_workdir,
-            capture_output=True,
-            text=True,
-            timeout=120
-        )
+            fetch_result = await process.run_command(["git", "fetch", "origin"], cwd=project_workdir, timeout=120)
 
-        if fetch_result.returncode != 0:
-            logger.error(f"git fetch failed: {fetch_result.stderr}")
-            await messenger.reply(context, f"Warning: Could not fetch from origin:\n{fetch_result.stderr[:500]}")
+            if fetch_result.returncode != 0:
+                logger.error("git fetch failed: %s", fetch_result.stderr)
+                await messenger.reply(context, f"Warning: Could not fetch from origin:\n{fetch_result.stderr[:500]}")
 
-        # Clean up the branch - reset any uncommitted changes
-        logger.info("Cleaning up branch")
+            # Reset, checkout and pull in one step: force-point the branch at the
+            # tip just fetched, discarding uncommitted changes
+            logger.info("Checking out %s branch at origin/%s", branch, branch)
 
-        reset_result = subprocess.run(
-            ["git", "reset", "--hard"],
-            cwd=project_workdir,
-            capture_output=True,
-            text=True,
-            timeout=60
-        )
+            checkout_result = await process.run_command(
+                ["git", "checkout", "--force", "-B", branch, f"origin/{branch}"], cwd=project_workdir, timeout=60
+            )
 
-        if reset_result.returncode != 0:
-            logger.error(f"git reset failed: {reset_result.stderr}")
-            await messenger.reply(context, f"Warning: Could not clean branch:\n{reset_result.stderr[:500]}")
+            if checkout_result.returncode != 0:
+                # No such remote branch; fall back to a local one
+                logger.warning("git checkout origin/%s failed: %s", branch, checkout_result.stderr)
+                checkout_result = await process.run_command(
+                    ["git", "checkout", "--force", branch], cwd=project_workdir, timeout=60
+                )
 
-        # Clean untracked files
-        clean_result = subprocess.run(
-            ["git", "clean", "-fd"],
-            cwd=project_workdir,
-            capture_output=True,
-            text=True,
-            timeout=60
-        )
+            if checkout_result.returncode != 0:
+                logger.error("git checkout %s failed: %s", branch, checkout_result.stderr)
+                await messenger.reply(context, f"Error: Could not checkout {branch}:\n{checkout_result.stderr[:500]}")
+                return False
 
-        if clean_result.returncode != 0:
-            logger.error(f"git clean failed: {clean_result.stderr}")
+            # Clean untracked files
+            clean_result = await process.run_command(["git", "clean", "-fd"], cwd=project_workdir, timeout=60)
 
-        # Checkout to specified branch
-        logger.info(f"Checking out {branch} branch")
+            if clean_result.returncode != 0:
+                logger.error("git clean failed: %s", clean_result.stderr)
 
-        checkout_result = subprocess.run(
-            ["git", "checkout", branch],
-            cwd=project_workdir,
-            capture_output=True,
-            text=True,
-            timeout=60
-        )
+            return True
 
-        if checkout_result.returncode != 0:
-            logger.error(f"git checkout {branch} failed: {checkout_result.stderr}")
-            await messenger.reply(context, f"Error: Could not checkout {branch}:\n{checkout_result.stderr[:500]}")
+        except Exception as e:
+            logger.error("Error refreshing to %s branch: %s", branch, e)
+            await messenger.reply(context, f"Error refreshing to {branch} branch: {str(e)}")
             return False
 
-        # Pull latest from origin/branch
-        logger.info(f"Pulling from origin/{branch}")
 
-        pull_result = subprocess.run(
-            ["git", "pull", "origin", branch],
-            cwd=project_workdir,
-            capture_output=True,
-            text=True,
-            timeout=300
-        )
+async def get_head_commit(repo_dir: str) -> str:
+    """Get the short hash and subject of HEAD, or "unknown" if git fails.
 
-        if pull_result.returncode != 0:
-            logger.error(f"git pull failed: {pull_result.stderr}")
-            await messenger.reply(context, f"Warning: Could not pull from {branch}:\n{pull_result.stderr[:500]}")
+    Args:
+        repo_dir: Repository directory
+    """
+    result = await process.run_command(["git", "log", "-1", "--format=%h %s"], cwd=repo_dir, timeout=10)
+    return result.stdout.strip() if result.returncode == 0 else "unknown"
 
-        return True
 
-    except Exception as e:
-        logger.error(f"Error refreshing to {branch} branch: {e}")
-        await messenger.reply(context, f"Error refreshing to {branch} branch: {str(e)}")
-        return False
+async def get_changed_files(repo_dir: str, old_rev: str, new_rev: str = "HEAD") -> set[str] | None:
+    """Get the paths that differ between two revisions.
+
+    Args:
+        repo_dir: Repository directory
+        old_rev: Revision to compare from
+        new_rev: Revision to compare to
+
+    Returns:
+        Set of changed paths, or None if git fails
+    """
+    result = await process.run_command(["git", "diff", "--name-only", old_rev, new_rev], cwd=repo_dir, timeout=10)
+    if result.returncode != 0:
+        return None
+    return set(result.stdout.split())
 
 
 def get_worktree_path(project_name: str, query_id: str) -> str:
@@ -175,50 +203,39 @@ async def create_worktree(messenger: Messenger, context: Any, project_workdir: s
     Returns:
         Path to the created worktree, or None if failed
     """
-    worktree_path = get_worktree_path(project_name, query_id)
-
-    try:
-        # Ensure base directory exists
-        os.makedirs(os.path.dirname(worktree_path), exist_ok=True)
+    async with checkout_lock(project_workdir):
+        worktree_path = get_worktree_path(project_name, query_id)
 
-        # First, make sure main repo is on main branch and up to date
-        logger.info(f"Fetching latest changes in {project_workdir}")
-        fetch_result = subprocess.run(
-            ["git", "fetch", "origin"],
-            cwd=project_workdir,
-            capture_output=True,
-            text=True,
-            timeout=300
-        )
-        if fetch_result.returncode != 0:
-            logger.warning(f"git fetch failed: {fetch_result.stderr}")
-
-        # Create worktree from origin/main (detached HEAD, will create branch in Claude)
-        logger.info(f"Creating worktree at {worktree_path}")
-        result = subprocess.run(
-            ["git", "worktree", "add", "--detach", worktree_path, "origin/main"],
-            cwd=project_workdir,
-            capture_output=True,
-            text=True,
-            timeout=120
-        )
-
-        if result.returncode != 0:
-            logger.error(f"Failed to create worktree: {result.stderr}")
-            await messenger.reply(context, f"Failed to create isolated workspace: {result.stderr[:200]}")
+        try:
+            # Ensure base directory exists
+            os.makedirs(os.path.dirname(worktree_path), exist_ok=True)
+
+            # First, make sure main repo is on main branch and up to date
+            logger.info("Fetching latest changes in %s", project_workdir)
+            fetch_result = await process.run_command(["git", "fetch", "origin"], cwd=project_workdir, timeout=300)
+            if fetch_result.returncode != 0:
+                logger.warning("git fetch failed: %s", fetch_result.stderr)
+
+            # Create worktree from origin/main (detached HEAD, will create branch in Claude)
+            logger.info("Creating worktree at %s", worktree_path)
+            result = await process.run_command(["git", "worktree", "add", "--detach", worktree_path, "origin/main"], cwd=project_workdir, timeout=120)
+
+            if result.returncode != 0:
+                logger.error("Failed to create worktree: %s", result.stderr)
+                await messenger.reply(context, f"Failed to create isolated workspace: {result.stderr[:200]}")
+                return None
+
+            logger.info("Created worktree at %s", worktree_path)
+            return worktree_path
+
+        except subprocess.TimeoutExpired:
+            logger.error("Worktree creation timed out")
+            await messenger.reply(context, "Failed to create workspace: operation timed out")
+            return None
+        except Exception as e:
+            logger.error("Error creating worktree: %s", e)
+            await messenger.reply(context, f"Failed to create workspace: {str(e)[:200]}")
             return None
-
-        logger.info(f"Created worktree at {worktree_path}")
-        return worktree_path
-
-    except subprocess.TimeoutExpired:
-        logger.error("Worktree creation timed out")
-        await messenger.reply(context, "Failed to create workspace: operation timed out")
-        return None
-    except Exception as e:
-        logger.error(f"Error creating worktree: {e}")
-        await messenger.reply(context, f"Failed to create workspace: {str(e)[:200]}")
-        return None
 
 
 def cleanup_worktree(project_workdir: str, worktree_path: str) -> bool:
@@ -236,7 +253,7 @@ def cleanup_worktree(project_workdir: str, worktree_path: str) -> bool:
 
     try:
         # Remove the worktree using git command
-        logger.info(f"Removing worktree at {worktree_path}")
+        logger.info("Removing worktree at %s", worktree_path)
         result = subprocess.run(
             ["git", "worktree", "remove", "--force", worktree_path],
             cwd=project_workdir,
@@ -246,7 +263,7 @@ def cleanup_worktree(project_workdir: str, worktree_path: str) -> bool:
         )
 
         if result.returncode != 0:
-            logger.warning(f"git worktree remove failed: {result.stderr}")
+            logger.warning("git worktree remove failed: %s", result.stderr)
             # Fall back to manual removal
             if os.path.exists(worktree_path):
                 shutil.rmtree(worktree_path, ignore_errors=True)
@@ -260,11 +277,11 @@ def cleanup_worktree(project_workdir: str, worktree_path: str) -> bool:
             timeout=30
         )
 
-        logger.info(f"Cleaned up worktree at {worktree_path}")
+        logger.info("Cleaned up worktree at %s", worktree_path)
         return True
 
     except Exception as e:
-        logger.error(f"Error cleaning up worktree: {e}")
+        logger.error("Error cleaning up worktree: %s", e)
         # Try manual cleanup as last resort
         try:
             if os.path.exists(worktree_path):
@@ -274,6 +291,125 @@ def cleanup_worktree(project_workdir: str, worktree_path: str) -> bool:
         return False
 
 
+async def cleanup_worktree_async(project_workdir: str, worktree_path: str, prune: bool = True) -> bool:
+    """Clean up a git worktree without blocking the event loop.
+
+    Args:
+        project_workdir: Main project working directory (git repo)
+        worktree_path: Path to the worktree to remove
+        prune: Run git worktree prune afterwards (batch callers prune once at the end)
+
+    Returns:
+        True if cleanup succeeded
+    """
+    if not worktree_path or not os.path.exists(worktree_path):
+        return True
+
+    try:
+        logger.info("Removing worktree at %s", worktree_path)
+        result = await process.run_command(
+            ["git", "worktree", "remove", "--force", worktree_path], cwd=project_workdir, timeout=60
+        )
+
+        if result.returncode != 0:
+            logger.warning("git worktree remove failed: %s", result.stderr)
+            # Fall back to manual removal
+            if os.path.exists(worktree_path):
+                await asyncio.to_thread(shutil.rmtree, worktree_path, ignore_errors=True)
+
+        if prune:
+            await process.run_command(["git", "worktree", "prune"], cwd=project_workdir, timeout=30)
+
+        logger.info("Cleaned up worktree at %s", worktree_path)
+        return True
+
+    except Exception as e:
+        logger.error("Error cleaning up worktree: %s", e)
+        # Try manual cleanup as last resort
+        await asyncio.to_thread(shutil.rmtree, worktree_path, ignore_errors=True)
+        return False
+
+
+def find_orphan_worktrees(worktree_base: str, active_ids: set, project_workdirs: dict) -> list[tuple]:
+    """Find worktrees under worktree_base that no longer belong to any active query.
+
+    Blocking; run it in a worker thread from async code.
+
+    Args:
+        worktree_base: Base directory containing {project_name}/{query_id} worktrees
+        active_ids: Query IDs whose worktrees must be preserved
+        project_workdirs: {project_name: project_workdir} for git worktree commands
+
+    Returns:
+        List of (project_dir, worktree_id, project_workdir or None, worktree_path) tuples
+    """
+    orphans = []
+
+    with os.scandir(worktree_base) as project_entries:
+        for project_entry in project_entries:
+            if not project_entry.is_dir(follow_symlinks=False):
+                continue
+
+            project_dir = project_entry.name
+            project_workdir = project_workdirs.get(project_dir)
+
+            with os.scandir(project_entry.path) as worktree_entries:
+                for worktree_entry in worktree_entries:
+                    if worktree_entry.is_dir(follow_symlinks=False) and worktree_entry.name not in active_ids:
+                        orphans.append((project_dir, worktree_entry.name, project_workdir, worktree_entry.path))
+
+    return orphans
+
+
+async def cleanup_orphan_worktrees(worktree_base: str, active_ids: set, project_workdirs: dict,
+                                   concurrency: int = 8) -> tuple[list, list]:
+    """Remove orphan worktrees concurrently.
+
+    Args:
+        worktree_base: Base directory containing {project_name}/{query_id} worktrees
+        active_ids: Query IDs whose worktrees must be preserved
+        project_workdirs: {project_name: project_workdir} for git worktree commands
+        concurrency: Maximum number of removals running at once
+
+    Returns:
+        Tuple of (cleaned "project/query_id" entries, error messages)
+    """
+    orphans = await asyncio.to_thread(find_orphan_worktrees, worktree_base, active_ids, project_workdirs)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _cleanup_one(project_workdir: str, worktree_path: str):
+        async with semaphore:
+            logger.info("Cleaning up orphan worktree: %s", worktree_path)
+            if project_workdir:
+                await cleanup_worktree_async(project_workdir, worktree_path, prune=False)
+            else:
+                # Fallback: just remove the directory
+                await asyncio.to_thread(shutil.rmtree, worktree_path, ignore_errors=True)
+
+    results = await asyncio.gather(
+        *(_cleanup_one(project_workdir, worktree_path) for _, _, project_workdir, worktree_path in orphans),
+        return_exceptions=True
+    )
+
+    cleaned = []
+    errors = []
+    for (project_dir, worktree_id, _, worktree_path), result in zip(orphans, results):
+        if isinstance(result, Exception):
+            logger.error("Error cleaning up %s: %s", worktree_path, result)
+            errors.append(f"{project_dir}/{worktree_id}: {str(result)[:50]}")
+        else:
+            cleaned.append(f"{project_dir}/{worktree_id}")
+
+    # Prune stale worktree references once per project instead of once per worktree
+    for project_workdir in {project_workdir for _, _, project_workdir, _ in orphans if project_workdir}:
+        try:
+            await process.run_command(["git", "worktree", "prune"], cwd=project_workdir, timeout=30)
+        except Exception as e:
+            logger.warning("git worktree prune failed in %s: %s", project_workdir, e)
+
+    return cleaned, errors
+
+
 def cleanup_all_project_worktrees(project_workdir: str, project_name: str) -> int:
     """Clean up all worktrees for a project.
 
@@ -285,17 +421,18 @@ def cleanup_all_project_worktrees(project_workdir: str, project_name: str) -> in
         Number of worktrees cleaned up
     """
     project_worktree_base = os.path.join(config.WORKTREE_BASE, project_name)
-    if not os.path.exists(project_worktree_base):
-        return 0
 
     count = 0
     try:
-        for query_id in os.listdir(project_worktree_base):
-            worktree_path = os.path.join(project_worktree_base, query_id)
-            if os.path.isdir(worktree_path):
-                if cleanup_worktree(project_workdir, worktree_path):
-                    count += 1
+        with os.scandir(project_worktree_base) as entries:
+            # Collect first: cleanup_worktree prunes entries while we iterate
+            worktree_paths = [entry.path for entry in entries if entry.is_dir(follow_symlinks=False)]
+        for worktree_path in worktree_paths:
+            if cleanup_worktree(project_workdir, worktree_path):
+                count += 1
+    except FileNotFoundError:
+        return 0
     except Exception as e:
-        logger.error(f"Error cleaning up project worktrees: {e}")
+        logger.error("Error cleaning up project worktrees: %s", e)
 
     return count
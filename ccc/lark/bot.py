@@ -91,12 +91,12 @@ def webhook():
     try:
         # Get request data
         raw_body = request.get_data(as_text=True)
-        logger.info(f"Received webhook request (truncated): {raw_body[:200]}...")
+        logger.info("Received webhook request (truncated): %s...", raw_body[:200])
 
         try:
             data = request.get_json()
         except Exception as e:
-            logger.error(f"Failed to parse JSON: {e}")
+            logger.error("Failed to parse JSON: %s", e)
             return jsonify({"code": 1, "msg": "Invalid JSON"})
 
         if data is None:
@@ -105,7 +105,7 @@ def webhook():
 
         # Handle URL verification challenge (v2 format)
         if "challenge" in data:
-            logger.info(f"Received URL verification challenge: {data['challenge']}")
+            logger.info("Received URL verification challenge: %s", data['challenge'])
             return jsonify({"challenge": data["challenge"]})
 
         # Handle encrypted events
@@ -118,7 +118,7 @@ def webhook():
                 decrypted = decrypt_message(config.LARK_ENCRYPT_KEY, data["encrypt"])
                 data = json.loads(decrypted)
             except Exception as e:
-                logger.error(f"Failed to decrypt message: {e}")
+                logger.error("Failed to decrypt message: %s", e)
                 return jsonify({"code": 1, "msg": "Decryption failed"})
 
         # Verify signature if provided
@@ -131,14 +131,14 @@ def webhook():
             return jsonify({"code": 1, "msg": "Invalid signature"})
 
         # Handle event callback
-        logger.info(f"Checking for header in data: {'header' in data}")
-        logger.info(f"Messenger initialized: {messenger is not None}")
+        logger.info("Checking for header in data: %s", 'header' in data)
+        logger.info("Messenger initialized: %s", messenger is not None)
 
         if "header" in data:
             event_type = data.get("header", {}).get("event_type", "")
             event = data.get("event", {})
 
-            logger.info(f"Received event type: {event_type}")
+            logger.info("Received event type: %s", event_type)
 
             # Handle message events
             if event_type == "im.message.receive_v1":
@@ -147,12 +147,13 @@ def webhook():
                 content = message.get("content", "")
 
                 # Log full message structure to see all available fields
-                logger.info(f"=== FULL MESSAGE OBJECT ===")
-                for key, value in message.items():
-                    logger.info(f"  {key}: {value}")
-                logger.info(f"=== END MESSAGE OBJECT ===")
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info("=== FULL MESSAGE OBJECT ===")
+                    for key, value in message.items():
+                        logger.info("  %s: %s", key, value)
+                    logger.info("=== END MESSAGE OBJECT ===")
 
-                logger.info(f"Message type: {message_type}, content: {content[:200]}")
+                logger.info("Message type: %s, content: %s", message_type, content[:200])
 
                 # Check if it's a processable message (text or post/rich-text)
                 is_processable = message_type in ("text", "post")
@@ -170,11 +171,11 @@ def webhook():
                     message_id = message.get("message_id") or message.get("msg_id") or message.get("id")
                     event_id = data.get("header", {}).get("event_id")
 
-                    logger.info(f"Dedup check: message_id={message_id}, event_id={event_id}")
+                    logger.info("Dedup check: message_id=%s, event_id=%s", message_id, event_id)
 
                     # Check for duplicate message
                     if dedup.is_duplicate(message_id, event_id):
-                        logger.info(f"Skipping duplicate message: {message_id}")
+                        logger.info("Skipping duplicate message: %s", message_id)
                         return jsonify({"code": 0, "msg": "success"})
 
                     # Mark as processed before handling to prevent race conditions
@@ -186,24 +187,24 @@ def webhook():
                     try:
                         loop.run_until_complete(handlers.handle_message(messenger, event))
                     except Exception as e:
-                        logger.error(f"Error in message handler: {e}")
+                        logger.error("Error in message handler: %s", e)
                     finally:
                         loop.close()
                 else:
-                    logger.info(f"Skipping non-text message type: {message_type}")
+                    logger.info("Skipping non-text message type: %s", message_type)
 
             return jsonify({"code": 0, "msg": "success"})
 
         # Handle v1 event format (legacy)
         event_type = data.get("type", "")
         if event_type == "url_verification":
-            logger.info(f"Received URL verification (v1 format): {data.get('challenge', '')}")
+            logger.info("Received URL verification (v1 format): %s", data.get('challenge', ''))
             return jsonify({"challenge": data.get("challenge", "")})
 
         return jsonify({"code": 0, "msg": "success"})
 
     except Exception as e:
-        logger.error(f"Error handling webhook: {e}")
+        logger.error("Error handling webhook: %s", e)
         return jsonify({"code": 1, "msg": str(e)})
 
 
@@ -259,15 +260,15 @@ def run(config_path: str = None):
                         # Use reply with just chat_id in context to send direct message
                         loop.run_until_complete(messenger.reply({"chat_id": chat_id}, summary))
                     except Exception as e:
-                        logger.error(f"Failed to send startup summary to chat {chat_id}: {e}")
+                        logger.error("Failed to send startup summary to chat %s: %s", chat_id, e)
             else:
                 logger.info("No projects with project_up configured for auto-start")
         except Exception as e:
-            logger.error(f"Error during project auto-start: {e}")
+            logger.error("Error during project auto-start: %s", e)
         finally:
             loop.close()
 
-        logger.info(f"Lark bot is starting on port {config.LARK_WEBHOOK_PORT}...")
+        logger.info("Lark bot is starting on port %s...", config.LARK_WEBHOOK_PORT)
         logger.info("Listening for webhook events...")
 
         # Run Flask app
@@ -282,5 +283,5 @@ def run(config_path: str = None):
         logger.error("lark-oapi package not installed. Install with: pip install lark-oapi")
         return
     except Exception as e:
-        logger.error(f"Error starting Lark bot: {e}")
+        logger.error("Error starting Lark bot: %s", e)
         return
@@ -57,7 +57,7 @@ def is_duplicate(message_id: str, event_id: str = None) -> bool:
                     (message_id,)
                 )
                 if cursor.fetchone():
-                    logger.info(f"Duplicate message detected: {message_id}")
+                    logger.info("Duplicate message detected: %s", message_id)
                     conn.close()
                     return True
 
@@ -68,7 +68,7 @@ def is_duplicate(message_id: str, event_id: str = None) -> bool:
                     (event_id,)
                 )
                 if cursor.fetchone():
-                    logger.info(f"Duplicate event detected: {event_id}")
+                    logger.info("Duplicate event detected: %s", event_id)
                     conn.close()
                     return True
 
@@ -76,7 +76,7 @@ def is_duplicate(message_id: str, event_id: str = None) -> bool:
             return False
 
         except Exception as e:
-            logger.error(f"Error checking for duplicate: {e}")
+            logger.error("Error checking for duplicate: %s", e)
             return False
 
 
@@ -104,10 +104,10 @@ def mark_processed(message_id: str, event_id: str = None):
             conn.commit()
             conn.close()
 
-            logger.info(f"Marked message as processed: {key}")
+            logger.info("Marked message as processed: %s", key)
 
         except Exception as e:
-            logger.error(f"Error marking message as processed: {e}")
+            logger.error("Error marking message as processed: %s", e)
 
 
 def cleanup_old_entries():
@@ -127,7 +127,7 @@ def cleanup_old_entries():
             conn.close()
 
             if deleted > 0:
-                logger.info(f"Cleaned up {deleted} old dedup entries")
+                logger.info("Cleaned up %s old dedup entries", deleted)
 
         except Exception as e:
-            logger.error(f"Error cleaning up old entries: {e}")
+            logger.error("Error cleaning up old entries: %s", e)
@@ -3,13 +3,17 @@
 import asyncio
 import logging
 import os
+import shutil
 import subprocess
+import sys
 import uuid
+from datetime import datetime
 
 from ccc import config
 from ccc import claude
 from ccc import git
 from ccc import process
+from ccc.messenger import OUTPUT_LIMIT, clip_output
 
 logger = logging.getLogger(__name__)
 
@@ -27,17 +31,17 @@ def is_authorized(event: dict) -> bool:
     message = event.get("message", {})
     chat_id = message.get("chat_id", "")
 
-    logger.info(f"Checking authorization for user: {user_open_id}, chat_id: {chat_id}")
+    logger.info("Checking authorization for user: %s, chat_id: %s", user_open_id, chat_id)
 
     user_authorized = config.is_lark_user_authorized(user_open_id)
     chat_authorized = config.is_lark_chat_authorized(chat_id)
 
-    logger.info(f"Authorization result: user={user_authorized}, chat={chat_authorized}")
+    logger.info("Authorization result: user=%s, chat=%s", user_authorized, chat_authorized)
 
     if not user_authorized:
-        logger.warning(f"User {user_open_id} not in authorized list: {config.LARK_AUTHORIZED_USERS}")
+        logger.warning("User %s not in authorized list: %s", user_open_id, config.LARK_AUTHORIZED_USERS)
     if not chat_authorized:
-        logger.warning(f"Chat {chat_id} not in authorized list: {config.LARK_AUTHORIZED_CHATS}")
+        logger.warning("Chat %s not in authorized list: %s", chat_id, config.LARK_AUTHORIZED_CHATS)
 
     return user_authorized and chat_authorized
 
@@ -118,68 +122,38 @@ def get_thread_key_with_fallback(context: dict) -> tuple[str, dict | None]:
     Returns:
         Tuple of (thread_key, worktree_info or None)
     """
-    chat_id = context.get("chat_id", "")
-    root_id = context.get("root_id")
+    return claude.find_thread_worktree("lark", context.get("chat_id", ""), context.get("root_id"))
 
-    # Primary: try with root_id
-    primary_key = claude.get_thread_key_lark(chat_id, root_id)
-    worktree_info = claude.get_thread_worktree(primary_key)
 
-    if worktree_info:
-        logger.info(f"Found thread context for key {primary_key}")
-        return primary_key, worktree_info
-
-    # Fallback 1: If we have a root_id, try the 'main' key for the same chat
-    if root_id:
-        fallback_key = claude.get_thread_key_lark(chat_id, None)
-        worktree_info = claude.get_thread_worktree(fallback_key)
-        if worktree_info:
-            logger.info(f"Found thread context using fallback key {fallback_key}")
-            return fallback_key, worktree_info
-
-    # Fallback 2: If we don't have a root_id, search for any thread in this chat
-    if not root_id:
-        all_worktrees = claude.get_all_thread_worktrees()
-        chat_prefix = f"lark:{chat_id}:"
-        for key, info in all_worktrees.items():
-            if key.startswith(chat_prefix):
-                logger.info(f"Found thread context for chat using key {key}")
-                return key, info
-
-    logger.info(f"No thread context found for key {primary_key}")
-    return primary_key, None
-
-
-async def process_output_file(messenger, context: dict, output_file: str, duration_minutes: float):
-    """Process output file and send to user with cleanup."""
-    if os.path.exists(output_file):
-        with open(output_file, 'a') as f:
-            f.write(f"\n\nExecution time: {duration_minutes:.2f} minutes")
-
-    if os.path.exists(output_file):
-        with open(output_file, 'r') as f:
-            output_content = f.read()
-
-        if output_content:
-            # Lark has different message limits, but keep similar truncation
-            if len(output_content) > 4000:
-                await messenger.reply(context, output_content[:4000] + "\n\n[Output truncated...]")
-            else:
-                await messenger.reply(context, output_content)
-        else:
-            await messenger.reply(context, f"Command completed but {output_file} is empty")
+async def process_output_file(messenger, context: dict, output_file: str, duration_minutes: float,
+                              missing_message: str | None = None):
+    """Process output file and send to user with cleanup.
 
-        os.remove(output_file)
-        logger.info(f"Cleaned up {output_file}")
+    missing_message replaces the default error if Claude did not create the file.
+    """
+    # Only OUTPUT_LIMIT characters are sent; one more is enough to know it was truncated
+    output_content = await asyncio.to_thread(claude.consume_output_file, output_file, OUTPUT_LIMIT + 1)
+
+    if output_content is None:
+        await messenger.reply(context, missing_message or f"Error: {output_file} was not created by Claude")
+    elif output_content:
+        output_content += f"\n\nExecution time: {duration_minutes:.2f} minutes"
+        # Lark has different message limits, but keep similar truncation
+        await messenger.reply(context, clip_output(output_content))
     else:
-        await messenger.reply(context, f"Error: {output_file} was not created by Claude")
+        await messenger.reply(context, f"Command completed but {output_file} is empty")
 
 
 def cleanup_output_file(output_file: str):
-    """Clean up output file if it exists."""
-    if os.path.exists(output_file):
+    """Clean up output file if it exists.
+
+    Safe to call after process_output_file, which already removed it.
+    """
+    try:
         os.remove(output_file)
-        logger.info(f"Cleaned up {output_file}")
+    except FileNotFoundError:
+        return
+    logger.info("Cleaned up %s", output_file)
 
 
 async def handle_message(messenger, event: dict) -> None:
@@ -205,7 +179,7 @@ async def handle_message(messenger, event: dict) -> None:
     message_type = message.get("message_type", "")
 
     # Log all message fields to debug
-    logger.info(f"Message fields: {list(message.keys())}")
+    logger.info("Message fields: %s", list(message.keys()))
 
     # Parse message content (it's JSON)
     import json
@@ -230,7 +204,7 @@ async def handle_message(messenger, event: dict) -> None:
         "root_id": message.get("root_id") or message.get("parent_id"),
     }
 
-    logger.info(f"Context for reply: {context}")
+    logger.info("Context for reply: %s", context)
 
     # Parse command
     command, args = parse_command(text)
@@ -257,7 +231,7 @@ async def handle_message(messenger, event: dict) -> None:
         logger.info("Message is not a command and has no content, ignoring")
         return
 
-    logger.info(f"Received command: /{command} with args: {args}")
+    logger.info("Received command: /%s with args: %s", command, args)
 
     # Route to appropriate handler
     handlers = {
@@ -288,28 +262,12 @@ async def handle_message(messenger, event: dict) -> None:
 
 async def cmd_cleanup(messenger, context: dict, args: list) -> None:
     """Handle /cleanup command. Clean up orphan worktrees."""
-    import shutil
-
     logger.info("Received /cleanup command")
 
     # Get all active worktree IDs (running queries + completed jobs + thread worktrees)
-    active_ids = set()
-
-    # Add running query IDs
-    running_queries = claude.get_all_running_queries()
-    for project_name, queries in running_queries.items():
-        for query_id in queries.keys():
-            active_ids.add(query_id)
-
-    # Add completed job IDs
-    for job_id in claude.COMPLETED_JOBS.keys():
-        active_ids.add(job_id)
+    active_ids = claude.get_active_query_ids()
 
-    # Add thread-worktree IDs
-    for thread_key, info in claude.get_all_thread_worktrees().items():
-        active_ids.add(info.get("query_id"))
-
-    logger.info(f"Active worktree IDs to preserve: {active_ids}")
+    logger.info("Active worktree IDs to preserve: %s", active_ids)
 
     # Scan worktree base directory for orphan worktrees
     worktree_base = config.WORKTREE_BASE
@@ -317,36 +275,9 @@ async def cmd_cleanup(messenger, context: dict, args: list) -> None:
         await messenger.reply(context, "No worktrees directory found. Nothing to clean up.")
         return
 
-    cleaned = []
-    errors = []
-
-    for project_dir in os.listdir(worktree_base):
-        project_path = os.path.join(worktree_base, project_dir)
-        if not os.path.isdir(project_path):
-            continue
-
-        # Get the project's main workdir for git worktree commands
-        project = config.get_project(project_dir)
-        project_workdir = project['project_workdir'] if project else None
-
-        for worktree_id in os.listdir(project_path):
-            worktree_path = os.path.join(project_path, worktree_id)
-            if not os.path.isdir(worktree_path):
-                continue
-
-            # Check if this worktree is active
-            if worktree_id not in active_ids:
-                logger.info(f"Cleaning up orphan worktree: {worktree_path}")
-                try:
-                    if project_workdir:
-                        git.cleanup_worktree(project_workdir, worktree_path)
-                    else:
-                        # Fallback: just remove the directory
-                        shutil.rmtree(worktree_path, ignore_errors=True)
-                    cleaned.append(f"{project_dir}/{worktree_id}")
-                except Exception as e:
-                    logger.error(f"Error cleaning up {worktree_path}: {e}")
-                    errors.append(f"{project_dir}/{worktree_id}: {str(e)[:50]}")
+    # Resolve project workdirs up front so the scan thread doesn't read config
+    project_workdirs = {p['project_name']: p['project_workdir'] for p in config.PROJECTS}
+    cleaned, errors = await git.cleanup_orphan_worktrees(worktree_base, active_ids, project_workdirs)
 
     # Build response
     lines = []
@@ -374,24 +305,18 @@ async def cmd_list(messenger, context: dict, args: list) -> None:
         return
 
     lines = ["Registered projects:\n"]
-    for project in config.PROJECTS:
-        name = project.get('project_name', '?')
-        repo = project.get('project_repo', '?')
-        workdir = project.get('project_workdir', '?')
-        has_up = "Yes" if project.get('project_up') else "No"
-
-        lines.append(f"**{name}**")
-        lines.append(f"  Repo: {repo}")
-        lines.append(f"  Workdir: {workdir}")
-        lines.append(f"  Has project_up: {has_up}")
-        lines.append("")
+    lines.extend(
+        f"**{project.get('project_name', '?')}**\n"
+        f"  Repo: {project.get('project_repo', '?')}\n"
+        f"  Workdir: {project.get('project_workdir', '?')}\n"
+        f"  Has project_up: {'Yes' if project.get('project_up') else 'No'}\n"
+        for project in config.PROJECTS
+    )
 
     await messenger.reply(context, "\n".join(lines))
 
 
-async def cmd_help(messenger, context: dict, args: list) -> None:
-    """Handle /help command."""
-    help_text = """Available commands:
+_HELP_TEXT = """Available commands:
 
 /help
   Show this help message
@@ -449,7 +374,10 @@ async def cmd_help(messenger, context: dict, args: list) -> None:
 /selfupdate
   Update bot from GitHub and restart"""
 
-    await messenger.reply(context, help_text)
+
+async def cmd_help(messenger, context: dict, args: list) -> None:
+    """Handle /help command."""
+    await messenger.reply(context, _HELP_TEXT)
 
 
 async def cmd_ask(messenger, context: dict, args: list) -> None:
@@ -482,10 +410,7 @@ async def _ask_project(messenger, context: dict, project_name: str, project: dic
     project_repo = project['project_repo']
     project_workdir = project['project_workdir']
 
-    if not await git.clone_repository_if_needed(messenger, context, project_repo, project_workdir):
-        return
-
-    if not await claude.initialize_claude_md(messenger, context, project_workdir):
+    if not await claude.ensure_project_ready(messenger, context, project_repo, project_workdir):
         return
 
     # Store thread context for this project
@@ -495,12 +420,16 @@ async def _ask_project(messenger, context: dict, project_name: str, project: dic
     thread_key = get_thread_key(context)
     is_valid, error = claude.validate_thread_key(thread_key)
     if not is_valid:
-        logger.error(f"Invalid thread key for /ask: {error}")
+        logger.error("Invalid thread key for /ask: %s", error)
         await messenger.reply(context, f"Error: Cannot determine thread context. {error}")
         return
 
     # Generate query ID and create worktree
-    query_id = str(uuid.uuid4())[:8]
+    query_id = claude.new_query_id()
+    # Wait for a query slot first so a queued query does not hold a worktree
+    if not await claude.reserve_query_slot(messenger, context, query_id, thread_key, project_name, "ask", user_text):
+        await messenger.reply(context, f"Query {query_id} for {project_name} was cancelled.")
+        return
     worktree_path = await git.create_worktree(messenger, context, project_workdir, project_name, query_id)
     if not worktree_path:
         return
@@ -511,32 +440,27 @@ async def _ask_project(messenger, context: dict, project_name: str, project: dic
             thread_key, query_id, None,  # session_id is None initially
             worktree_path, project_workdir, project_name, project_repo
         )
-        logger.info(f"Pre-registered thread {thread_key} with worktree {query_id}")
+        logger.info("Pre-registered thread %s with worktree %s", thread_key, query_id)
     except ValueError as e:
-        logger.error(f"Failed to associate thread with worktree: {e}")
+        logger.error("Failed to associate thread with worktree: %s", e)
         await messenger.reply(context, f"Error: Failed to set up thread context. {str(e)}")
         return
 
     await messenger.reply(context, f"Processing for project: {project_name} (query: {query_id}, thread: {thread_key})...")
 
-    output_file = f"/tmp/output_{query_id}.txt"
+    output_file = os.path.join(config.OUTPUT_DIR, f"output_{query_id}.txt")
 
     try:
-        prompt = f"""Project: {project_name}
-Repository: {project_repo}
-Working Directory: {worktree_path}
+        prompt = claude.build_project_prompt(project_name, project_repo, worktree_path, user_text, output_file, label="Query")
 
-Query: {user_text}
-
-Write the output in {output_file}"""
-
-        logger.info(f"Running query {query_id} for project {project_name} in thread {thread_key}")
+        logger.info("Running query %s for project %s in thread %s", query_id, project_name, thread_key)
 
         duration_minutes, session_id = await claude.run_claude_query(
             prompt, config.ASK_RULES, worktree_path,
             project_name=project_name, command="ask", user_prompt=user_text,
             worktree_path=worktree_path, project_workdir=project_workdir, query_id=query_id,
-            keep_worktree=True  # Keep for thread context
+            keep_worktree=True,  # Keep for thread context
+            thread_key=thread_key
         )
 
         # Update thread-worktree association with session_id
@@ -545,24 +469,24 @@ Write the output in {output_file}"""
         await process_output_file(messenger, context, output_file, duration_minutes)
 
     except asyncio.CancelledError:
-        logger.info(f"Query {query_id} for project {project_name} was cancelled")
+        logger.info("Query %s for project %s was cancelled", query_id, project_name)
         await messenger.reply(context, f"Query {query_id} for {project_name} was cancelled.")
-        cleanup_output_file(output_file)
     except Exception as e:
-        logger.error(f"Error running query: {e}")
+        logger.error("Error running query: %s", e)
         await messenger.reply(context, f"Error: {str(e)}")
+    finally:
         cleanup_output_file(output_file)
 
 
 async def _ask_casual(messenger, context: dict, user_text: str, existing_session: str = None) -> None:
     """Handle casual conversation /ask query (no project context)."""
-    query_id = str(uuid.uuid4())[:8]
+    query_id = claude.new_query_id()
 
     # Get and validate thread key
     thread_key = get_thread_key(context)
     is_valid, error = claude.validate_thread_key(thread_key)
     if not is_valid:
-        logger.error(f"Invalid thread key for casual /ask: {error}")
+        logger.error("Invalid thread key for casual /ask: %s", error)
         await messenger.reply(context, f"Error: Cannot determine thread context. {error}")
         return
 
@@ -570,11 +494,12 @@ async def _ask_casual(messenger, context: dict, user_text: str, existing_session
     try:
         claude.set_thread_worktree(
             thread_key, f"casual-{query_id}", None,  # session_id is None initially
-            None, None, "_casual", None  # No worktree for casual queries
+            None, None, "_casual", None,  # No worktree for casual queries
+            kind="casual"
         )
-        logger.info(f"Pre-registered thread {thread_key} for casual query {query_id}")
+        logger.info("Pre-registered thread %s for casual query %s", thread_key, query_id)
     except ValueError as e:
-        logger.error(f"Failed to set up thread context: {e}")
+        logger.error("Failed to set up thread context: %s", e)
         await messenger.reply(context, f"Error: Failed to set up thread context. {str(e)}")
         return
 
@@ -583,19 +508,16 @@ async def _ask_casual(messenger, context: dict, user_text: str, existing_session
     else:
         await messenger.reply(context, f"Processing casual query (query: {query_id}, thread: {thread_key})...")
 
-    output_file = f"/tmp/output_{query_id}.txt"
+    output_file = os.path.join(config.OUTPUT_DIR, f"output_{query_id}.txt")
 
     # Use a temporary directory for casual queries
     cwd = "/tmp"
 
     try:
-        prompt = f"""You are a helpful assistant. Please respond to the following query.
-
-Query: {user_text}
+        prompt = claude.build_casual_prompt(user_text, output_file)
 
-IMPORTANT: Write your complete response to the file {output_file}. Use the Write tool to create this file with your response."""
-
-        logger.info(f"Running casual query {query_id} in thread {thread_key}" + (f" (resuming session {existing_session})" if existing_session else ""))
+        logger.info("Running casual query %s in thread %s%s", query_id, thread_key,
+                    f" (resuming session {existing_session})" if existing_session else "")
 
         # Use GENERAL_RULES for casual queries, fall back to empty string
         system_prompt = config.GENERAL_RULES if config.GENERAL_RULES else ""
@@ -604,25 +526,24 @@ IMPORTANT: Write your complete response to the file {output_file}. Use the Write
             prompt, system_prompt, cwd,
             resume=existing_session,
             project_name="_casual", command="ask", user_prompt=user_text,
-            query_id=query_id
+            query_id=query_id,
+            thread_key=thread_key
         )
 
         # Update thread context with session_id
         claude.update_thread_session(thread_key, session_id)
 
-        # Check if output file exists, provide fallback message if not
-        if os.path.exists(output_file):
-            await process_output_file(messenger, context, output_file, duration_minutes)
-        else:
-            await messenger.reply(context, f"Query completed in {duration_minutes:.2f} minutes, but no output file was generated. The assistant may have responded directly in the logs.")
+        # Provide a fallback message if Claude did not write the output file
+        await process_output_file(messenger, context, output_file, duration_minutes,
+            missing_message=f"Query completed in {duration_minutes:.2f} minutes, but no output file was generated. The assistant may have responded directly in the logs.")
 
     except asyncio.CancelledError:
-        logger.info(f"Casual query {query_id} was cancelled")
+        logger.info("Casual query %s was cancelled", query_id)
         await messenger.reply(context, f"Query {query_id} was cancelled.")
-        cleanup_output_file(output_file)
     except Exception as e:
-        logger.error(f"Error running casual query: {e}")
+        logger.error("Error running casual query: %s", e)
         await messenger.reply(context, f"Error: {str(e)}")
+    finally:
         cleanup_output_file(output_file)
 
 
@@ -634,23 +555,34 @@ async def _continue_in_worktree(messenger, context: dict, user_text: str, worktr
     project_name = worktree_info["project_name"]
     project_repo = worktree_info["project_repo"]
     existing_session = worktree_info.get("session_id")
+    # Records created before "kind" existed are classified by their query_id prefix
+    kind = worktree_info.get("kind")
+    if kind is None:
+        if query_id.startswith("casual-") or project_name == "_casual":
+            kind = "casual"
+        elif query_id.startswith("up-"):
+            kind = "up"
 
     # Check if this is a casual conversation context
-    if query_id.startswith("casual-") or project_name == "_casual":
-        logger.info(f"Continuing casual conversation with session {existing_session}")
+    if kind == "casual":
+        logger.info("Continuing casual conversation with session %s", existing_session)
         await _ask_casual(messenger, context, user_text, existing_session)
         return
 
-    logger.info(f"Continuing in worktree {query_id} for project {project_name}")
+    logger.info("Continuing in worktree %s for project %s", query_id, project_name)
 
     # Check if this is from /up command (pseudo worktree) or if worktree doesn't exist
-    is_up_context = query_id.startswith("up-")
+    is_up_context = kind == "up"
     worktree_exists = worktree_path and os.path.isdir(worktree_path)
 
     if is_up_context or not worktree_exists:
         # Need to create a proper worktree for continuation
-        logger.info(f"Worktree doesn't exist or is /up context, creating new worktree")
-        query_id = str(uuid.uuid4())[:8]
+        logger.info("Worktree doesn't exist or is /up context, creating new worktree")
+        query_id = claude.new_query_id()
+        # Wait for a query slot first so a queued query does not hold a worktree
+        if not await claude.reserve_query_slot(messenger, context, query_id, thread_key, project_name, "continue", user_text):
+            await messenger.reply(context, f"Query {query_id} for {project_name} was cancelled.")
+            return
         worktree_path = await git.create_worktree(messenger, context, project_workdir, project_name, query_id)
         if not worktree_path:
             await messenger.reply(context, f"Failed to create worktree for continuation in {project_name}")
@@ -660,24 +592,19 @@ async def _continue_in_worktree(messenger, context: dict, user_text: str, worktr
 
     await messenger.reply(context, f"Continuing with query {query_id} for {project_name}...")
 
-    output_file = f"/tmp/output_{query_id}_cont_{str(uuid.uuid4())[:4]}.txt"
+    output_file = os.path.join(config.OUTPUT_DIR, f"output_{query_id}_cont_{uuid.uuid4().hex[:4]}.txt")
 
     try:
-        prompt = f"""Project: {project_name}
-Repository: {project_repo}
-Working Directory: {worktree_path}
+        prompt = claude.build_project_prompt(project_name, project_repo, worktree_path, user_text, output_file)
 
-Task: {user_text}
-
-Write the output in {output_file}"""
-
-        logger.info(f"Running continuation query in worktree {query_id}")
+        logger.info("Running continuation query in worktree %s", query_id)
 
         duration_minutes, session_id = await claude.run_claude_query(
             prompt, config.FEEDBACK_RULES, worktree_path,
             resume=existing_session, project_name=project_name, command="continue", user_prompt=user_text,
             worktree_path=worktree_path, project_workdir=project_workdir, query_id=query_id,
-            keep_worktree=True
+            keep_worktree=True,
+            thread_key=thread_key
         )
 
         # Update thread worktree association with new info
@@ -689,117 +616,32 @@ Write the output in {output_file}"""
         await process_output_file(messenger, context, output_file, duration_minutes)
 
     except asyncio.CancelledError:
-        logger.info(f"Continuation query in worktree {query_id} was cancelled")
+        logger.info("Continuation query in worktree %s was cancelled", query_id)
         await messenger.reply(context, f"Query in {project_name} was cancelled.")
-        cleanup_output_file(output_file)
     except Exception as e:
-        logger.error(f"Error running continuation query: {e}")
+        logger.error("Error running continuation query: %s", e)
         await messenger.reply(context, f"Error: {str(e)}")
+    finally:
         cleanup_output_file(output_file)
 
 
-async def cmd_feat(messenger, context: dict, args: list) -> None:
-    """Handle /feat command. Format: /feat project-name prompt"""
-    if len(args) < 2:
-        await messenger.reply(context, "Usage: /feat project-name prompt")
-        return
-
-    project_name = args[0]
-    user_prompt = " ".join(args[1:])
-
-    project = config.get_project(project_name)
-    if not project:
-        await messenger.reply(context, f"Project '{project_name}' not found. Available projects: {config.get_available_projects()}")
-        return
-
-    project_repo = project['project_repo']
-    project_workdir = project['project_workdir']
-
-    if not await git.clone_repository_if_needed(messenger, context, project_repo, project_workdir):
-        return
-
-    if not await claude.initialize_claude_md(messenger, context, project_workdir):
-        return
-
-    # Clear existing session and store new thread context
-    claude.clear_session(project_name)
-    messenger.set_thread_context(project_name, context)
-
-    # Get and validate thread key BEFORE creating worktree
-    thread_key = get_thread_key(context)
-    is_valid, error = claude.validate_thread_key(thread_key)
-    if not is_valid:
-        logger.error(f"Invalid thread key for /feat: {error}")
-        await messenger.reply(context, f"Error: Cannot determine thread context. {error}")
-        return
-
-    # Generate query ID and create worktree (starts from origin/main)
-    query_id = str(uuid.uuid4())[:8]
-    worktree_path = await git.create_worktree(messenger, context, project_workdir, project_name, query_id)
-    if not worktree_path:
-        return
-
-    # Associate thread with worktree BEFORE calling Claude
-    try:
-        claude.set_thread_worktree(
-            thread_key, query_id, None,  # session_id is None initially
-            worktree_path, project_workdir, project_name, project_repo
-        )
-        logger.info(f"Pre-registered thread {thread_key} with worktree {query_id}")
-    except ValueError as e:
-        logger.error(f"Failed to associate thread with worktree: {e}")
-        await messenger.reply(context, f"Error: Failed to set up thread context. {str(e)}")
-        return
-
-    await messenger.reply(context, f"Processing for project: {project_name} (query: {query_id}, thread: {thread_key})...")
-
-    output_file = f"/tmp/output_{query_id}.txt"
-
-    try:
-        prompt = f"""Project: {project_name}
-Repository: {project_repo}
-Working Directory: {worktree_path}
-
-Task: {user_prompt}
+async def _run_project_command(messenger, context: dict, args: list, command: str, rules: str,
+                               verb: str = "Processing") -> None:
+    """Run a /feat, /fix or /plan style command. Format: /<command> project-name prompt
 
-Write the output in {output_file}"""
+    Starts a fresh session in a new worktree, replies with the output and
+    spins the project up if configured.
 
-        logger.info(f"Running query {query_id} for project {project_name} in thread {thread_key}")
-
-        duration_minutes, session_id = await claude.run_claude_query(
-            prompt, config.FEAT_RULES, worktree_path,
-            project_name=project_name, command="feat", user_prompt=user_prompt,
-            worktree_path=worktree_path, project_workdir=project_workdir, query_id=query_id,
-            keep_worktree=True  # Keep worktree for potential feedback
-        )
-        claude.set_session(project_name, session_id)
-
-        # Update thread-worktree association with session_id
-        claude.update_thread_session(thread_key, session_id)
-
-        await process_output_file(messenger, context, output_file, duration_minutes)
-
-        # Auto spin-up project on the current branch if configured
-        project_up = project.get('project_up')
-        if project_up:
-            project_endpoint_url = project.get('project_endpoint_url')
-            project_ports = project.get('project_ports')
-            await process.spin_up_project(messenger, context, project_name, worktree_path, project_up, project_endpoint_url, project_ports)
-
-    except asyncio.CancelledError:
-        logger.info(f"Query {query_id} for project {project_name} was cancelled")
-        await messenger.reply(context, f"Query {query_id} for {project_name} was cancelled.")
-        cleanup_output_file(output_file)
-    except Exception as e:
-        logger.error(f"Error running query: {e}")
-        await messenger.reply(context, f"Error: {str(e)}")
-        cleanup_output_file(output_file)
-
-
-async def cmd_fix(messenger, context: dict, args: list) -> None:
-    """Handle /fix command. Format: /fix project-name prompt"""
+    Args:
+        messenger: Lark messenger
+        context: Message context
+        args: Command arguments
+        command: Command name, without the slash
+        rules: System prompt for the query
+        verb: Word used in the progress message
+    """
     if len(args) < 2:
-        await messenger.reply(context, "Usage: /fix project-name prompt")
+        await messenger.reply(context, f"Usage: /{command} project-name prompt")
         return
 
     project_name = args[0]
@@ -807,16 +649,13 @@ async def cmd_fix(messenger, context: dict, args: list) -> None:
 
     project = config.get_project(project_name)
     if not project:
-        await messenger.reply(context, f"Project '{project_name}' not found. Available projects: {config.get_available_projects()}")
+        await messenger.reply(context, config.project_not_found_message(project_name))
         return
 
     project_repo = project['project_repo']
     project_workdir = project['project_workdir']
 
-    if not await git.clone_repository_if_needed(messenger, context, project_repo, project_workdir):
-        return
-
-    if not await claude.initialize_claude_md(messenger, context, project_workdir):
+    if not await claude.ensure_project_ready(messenger, context, project_repo, project_workdir):
         return
 
     # Clear existing session and store new thread context
@@ -827,12 +666,16 @@ async def cmd_fix(messenger, context: dict, args: list) -> None:
     thread_key = get_thread_key(context)
     is_valid, error = claude.validate_thread_key(thread_key)
     if not is_valid:
-        logger.error(f"Invalid thread key for /fix: {error}")
+        logger.error("Invalid thread key for /%s: %s", command, error)
         await messenger.reply(context, f"Error: Cannot determine thread context. {error}")
         return
 
     # Generate query ID and create worktree (starts from origin/main)
-    query_id = str(uuid.uuid4())[:8]
+    query_id = claude.new_query_id()
+    # Wait for a query slot first so a queued query does not hold a worktree
+    if not await claude.reserve_query_slot(messenger, context, query_id, thread_key, project_name, command, user_prompt):
+        await messenger.reply(context, f"Query {query_id} for {project_name} was cancelled.")
+        return
     worktree_path = await git.create_worktree(messenger, context, project_workdir, project_name, query_id)
     if not worktree_path:
         return
@@ -843,32 +686,27 @@ async def cmd_fix(messenger, context: dict, args: list) -> None:
             thread_key, query_id, None,  # session_id is None initially
             worktree_path, project_workdir, project_name, project_repo
         )
-        logger.info(f"Pre-registered thread {thread_key} with worktree {query_id}")
+        logger.info("Pre-registered thread %s with worktree %s", thread_key, query_id)
     except ValueError as e:
-        logger.error(f"Failed to associate thread with worktree: {e}")
+        logger.error("Failed to associate thread with worktree: %s", e)
         await messenger.reply(context, f"Error: Failed to set up thread context. {str(e)}")
         return
 
-    await messenger.reply(context, f"Processing for project: {project_name} (query: {query_id}, thread: {thread_key})...")
+    await messenger.reply(context, f"{verb} for project: {project_name} (query: {query_id}, thread: {thread_key})...")
 
-    output_file = f"/tmp/output_{query_id}.txt"
+    output_file = os.path.join(config.OUTPUT_DIR, f"output_{query_id}.txt")
 
     try:
-        prompt = f"""Project: {project_name}
-Repository: {project_repo}
-Working Directory: {worktree_path}
-
-Task: {user_prompt}
-
-Write the output in {output_file}"""
+        prompt = claude.build_project_prompt(project_name, project_repo, worktree_path, user_prompt, output_file)
 
-        logger.info(f"Running query {query_id} for project {project_name} in thread {thread_key}")
+        logger.info("Running query %s for project %s in thread %s", query_id, project_name, thread_key)
 
         duration_minutes, session_id = await claude.run_claude_query(
-            prompt, config.FIX_RULES, worktree_path,
-            project_name=project_name, command="fix", user_prompt=user_prompt,
+            prompt, rules, worktree_path,
+            project_name=project_name, command=command, user_prompt=user_prompt,
             worktree_path=worktree_path, project_workdir=project_workdir, query_id=query_id,
-            keep_worktree=True  # Keep worktree for potential feedback
+            keep_worktree=True,  # Keep worktree for potential feedback
+            thread_key=thread_key
         )
         claude.set_session(project_name, session_id)
 
@@ -885,111 +723,28 @@ Write the output in {output_file}"""
             await process.spin_up_project(messenger, context, project_name, worktree_path, project_up, project_endpoint_url, project_ports)
 
     except asyncio.CancelledError:
-        logger.info(f"Query {query_id} for project {project_name} was cancelled")
+        logger.info("Query %s for project %s was cancelled", query_id, project_name)
         await messenger.reply(context, f"Query {query_id} for {project_name} was cancelled.")
-        cleanup_output_file(output_file)
     except Exception as e:
-        logger.error(f"Error running query: {e}")
+        logger.error("Error running query: %s", e)
         await messenger.reply(context, f"Error: {str(e)}")
+    finally:
         cleanup_output_file(output_file)
 
 
-async def cmd_plan(messenger, context: dict, args: list) -> None:
-    """Handle /plan command. Format: /plan project-name prompt"""
-    if len(args) < 2:
-        await messenger.reply(context, "Usage: /plan project-name prompt")
-        return
-
-    project_name = args[0]
-    user_prompt = " ".join(args[1:])
-
-    project = config.get_project(project_name)
-    if not project:
-        await messenger.reply(context, f"Project '{project_name}' not found. Available projects: {config.get_available_projects()}")
-        return
-
-    project_repo = project['project_repo']
-    project_workdir = project['project_workdir']
-
-    if not await git.clone_repository_if_needed(messenger, context, project_repo, project_workdir):
-        return
-
-    if not await claude.initialize_claude_md(messenger, context, project_workdir):
-        return
-
-    # Clear existing session and store new thread context
-    claude.clear_session(project_name)
-    messenger.set_thread_context(project_name, context)
-
-    # Get and validate thread key BEFORE creating worktree
-    thread_key = get_thread_key(context)
-    is_valid, error = claude.validate_thread_key(thread_key)
-    if not is_valid:
-        logger.error(f"Invalid thread key for /plan: {error}")
-        await messenger.reply(context, f"Error: Cannot determine thread context. {error}")
-        return
-
-    # Generate query ID and create worktree (starts from origin/main)
-    query_id = str(uuid.uuid4())[:8]
-    worktree_path = await git.create_worktree(messenger, context, project_workdir, project_name, query_id)
-    if not worktree_path:
-        return
-
-    # Associate thread with worktree BEFORE calling Claude
-    try:
-        claude.set_thread_worktree(
-            thread_key, query_id, None,  # session_id is None initially
-            worktree_path, project_workdir, project_name, project_repo
-        )
-        logger.info(f"Pre-registered thread {thread_key} with worktree {query_id}")
-    except ValueError as e:
-        logger.error(f"Failed to associate thread with worktree: {e}")
-        await messenger.reply(context, f"Error: Failed to set up thread context. {str(e)}")
-        return
-
-    await messenger.reply(context, f"Planning for project: {project_name} (query: {query_id}, thread: {thread_key})...")
-
-    output_file = f"/tmp/output_{query_id}.txt"
-
-    try:
-        prompt = f"""Project: {project_name}
-Repository: {project_repo}
-Working Directory: {worktree_path}
-
-Task: {user_prompt}
-
-Write the output in {output_file}"""
-
-        logger.info(f"Running query {query_id} for project {project_name} in thread {thread_key}")
-
-        duration_minutes, session_id = await claude.run_claude_query(
-            prompt, config.PLAN_RULES, worktree_path,
-            project_name=project_name, command="plan", user_prompt=user_prompt,
-            worktree_path=worktree_path, project_workdir=project_workdir, query_id=query_id,
-            keep_worktree=True  # Keep worktree for potential feedback
-        )
-        claude.set_session(project_name, session_id)
+async def cmd_feat(messenger, context: dict, args: list) -> None:
+    """Handle /feat command. Format: /feat project-name prompt"""
+    await _run_project_command(messenger, context, args, "feat", config.FEAT_RULES)
 
-        # Update thread-worktree association with session_id
-        claude.update_thread_session(thread_key, session_id)
 
-        await process_output_file(messenger, context, output_file, duration_minutes)
+async def cmd_fix(messenger, context: dict, args: list) -> None:
+    """Handle /fix command. Format: /fix project-name prompt"""
+    await _run_project_command(messenger, context, args, "fix", config.FIX_RULES)
 
-        # Auto spin-up project on the current branch if configured
-        project_up = project.get('project_up')
-        if project_up:
-            project_endpoint_url = project.get('project_endpoint_url')
-            project_ports = project.get('project_ports')
-            await process.spin_up_project(messenger, context, project_name, worktree_path, project_up, project_endpoint_url, project_ports)
 
-    except asyncio.CancelledError:
-        logger.info(f"Query {query_id} for project {project_name} was cancelled")
-        await messenger.reply(context, f"Query {query_id} for {project_name} was cancelled.")
-        cleanup_output_file(output_file)
-    except Exception as e:
-        logger.error(f"Error running query: {e}")
-        await messenger.reply(context, f"Error: {str(e)}")
-        cleanup_output_file(output_file)
+async def cmd_plan(messenger, context: dict, args: list) -> None:
+    """Handle /plan command. Format: /plan project-name prompt"""
+    await _run_project_command(messenger, context, args, "plan", config.PLAN_RULES, verb="Planning")
 
 
 async def cmd_feedback(messenger, context: dict, args: list) -> None:
@@ -1012,9 +767,9 @@ async def cmd_feedback(messenger, context: dict, args: list) -> None:
 
     # Check if first arg is a project name
     first_arg = args[0]
-    if config.get_project(first_arg):
+    project = config.get_project(first_arg)
+    if project:
         project_name = first_arg
-        project = config.get_project(project_name)
         args_index = 1
     elif worktree_info:
         # Use thread context for project
@@ -1025,7 +780,7 @@ async def cmd_feedback(messenger, context: dict, args: list) -> None:
         return
 
     if not project:
-        await messenger.reply(context, f"Project '{project_name}' not found. Available projects: {config.get_available_projects()}")
+        await messenger.reply(context, config.project_not_found_message(project_name))
         return
 
     project_repo = project['project_repo']
@@ -1047,10 +802,7 @@ async def cmd_feedback(messenger, context: dict, args: list) -> None:
         await messenger.reply(context, "Usage: /feedback [project-name] [job-id] prompt\n\nPlease provide feedback text.")
         return
 
-    if not await git.clone_repository_if_needed(messenger, context, project_repo, project_workdir):
-        return
-
-    if not await claude.initialize_claude_md(messenger, context, project_workdir):
+    if not await claude.ensure_project_ready(messenger, context, project_repo, project_workdir):
         return
 
     # Determine worktree and session
@@ -1069,8 +821,8 @@ async def cmd_feedback(messenger, context: dict, args: list) -> None:
         existing_session = job_info.get("session_id")
         query_id = job_id
 
-        logger.info(f"Resuming job {job_id} with session {existing_session} in worktree {worktree_path}")
-        await messenger.reply(context, f"Continuing job {job_id} for project: {project_name}...")
+        logger.info("Resuming job %s with session %s in worktree %s", job_id, existing_session, worktree_path)
+        startup_msg = f"Continuing job {job_id} for project: {project_name}..."
 
         del claude.COMPLETED_JOBS[job_id]
     elif worktree_info and worktree_info.get("project_name") == project_name:
@@ -1079,44 +831,45 @@ async def cmd_feedback(messenger, context: dict, args: list) -> None:
         existing_session = worktree_info.get("session_id")
         query_id = worktree_info.get("query_id")
 
-        logger.info(f"Using thread worktree {query_id} with session {existing_session}")
-        await messenger.reply(context, f"Continuing with query {query_id} for project: {project_name}...")
+        logger.info("Using thread worktree %s with session %s", query_id, existing_session)
+        startup_msg = f"Continuing with query {query_id} for project: {project_name}..."
     else:
         # Create new worktree
         existing_session = claude.get_session(project_name)
         if existing_session:
-            logger.info(f"Resuming session {existing_session} for project {project_name}")
+            logger.info("Resuming session %s for project %s", existing_session, project_name)
         else:
-            logger.info(f"No existing session for project {project_name}, starting fresh")
+            logger.info("No existing session for project %s, starting fresh", project_name)
 
-        query_id = str(uuid.uuid4())[:8]
+        query_id = claude.new_query_id()
+        # Wait for a query slot first so a queued query does not hold a worktree
+        if not await claude.reserve_query_slot(messenger, context, query_id, thread_key, project_name, "feedback", user_prompt):
+            await messenger.reply(context, f"Query {query_id} for {project_name} was cancelled.")
+            return
         worktree_path = await git.create_worktree(messenger, context, project_workdir, project_name, query_id)
         if not worktree_path:
             return
 
         if existing_session:
-            await messenger.reply(context, f"Continuing session for project: {project_name} (query: {query_id})...")
+            startup_msg = f"Continuing session for project: {project_name} (query: {query_id})..."
         else:
-            await messenger.reply(context, f"No existing session found. Starting new session for project: {project_name} (query: {query_id})...")
-
-    output_file = f"/tmp/output_{query_id}.txt"
+            startup_msg = f"No existing session found. Starting new session for project: {project_name} (query: {query_id})..."
 
-    try:
-        prompt = f"""Project: {project_name}
-Repository: {project_repo}
-Working Directory: {worktree_path}
+    await messenger.reply(context, startup_msg)
 
-Task: {user_prompt}
+    output_file = os.path.join(config.OUTPUT_DIR, f"output_{query_id}.txt")
 
-Write the output in {output_file}"""
+    try:
+        prompt = claude.build_project_prompt(project_name, project_repo, worktree_path, user_prompt, output_file)
 
-        logger.info(f"Running query {query_id} for project {project_name}")
+        logger.info("Running query %s for project %s", query_id, project_name)
 
         duration_minutes, session_id = await claude.run_claude_query(
             prompt, config.FEEDBACK_RULES, worktree_path,
             resume=existing_session, project_name=project_name, command="feedback", user_prompt=user_prompt,
             worktree_path=worktree_path, project_workdir=project_workdir, query_id=query_id,
-            keep_worktree=True
+            keep_worktree=True,
+            thread_key=thread_key
         )
 
         # Update session for future commands
@@ -1131,12 +884,12 @@ Write the output in {output_file}"""
         await process_output_file(messenger, context, output_file, duration_minutes)
 
     except asyncio.CancelledError:
-        logger.info(f"Query {query_id} for project {project_name} was cancelled")
+        logger.info("Query %s for project %s was cancelled", query_id, project_name)
         await messenger.reply(context, f"Query {query_id} for {project_name} was cancelled.")
-        cleanup_output_file(output_file)
     except Exception as e:
-        logger.error(f"Error running query: {e}")
+        logger.error("Error running query: %s", e)
         await messenger.reply(context, f"Error: {str(e)}")
+    finally:
         cleanup_output_file(output_file)
 
 
@@ -1150,7 +903,7 @@ async def cmd_init(messenger, context: dict, args: list) -> None:
 
     project = config.get_project(project_name)
     if not project:
-        await messenger.reply(context, f"Project '{project_name}' not found. Available projects: {config.get_available_projects()}")
+        await messenger.reply(context, config.project_not_found_message(project_name))
         return
 
     project_repo = project['project_repo']
@@ -1159,10 +912,19 @@ async def cmd_init(messenger, context: dict, args: list) -> None:
     project_endpoint_url = project.get('project_endpoint_url')
     project_ports = project.get('project_ports')
 
-    if not await git.clone_repository_if_needed(messenger, context, project_repo, project_workdir):
-        return
+    # /init always re-checks the project on disk
+    claude.invalidate_project(project_workdir)
 
-    init_success = await claude.initialize_claude_md(messenger, context, project_workdir)
+    # CLAUDE.md generation and the refresh below both reset and clean the main
+    # checkout, so they run one after the other rather than concurrently
+    async with git.checkout_lock(project_workdir):
+        if not await git.clone_repository_if_needed(messenger, context, project_repo, project_workdir):
+            return
+
+        init_success = await claude.initialize_claude_md(messenger, context, project_workdir)
+        if init_success:
+            # Spare the next command the clone and CLAUDE.md checks
+            claude.mark_project_ready(project_workdir)
 
     if project_up:
         # Clean up workdir and pull from main before spinning up
@@ -1192,7 +954,7 @@ async def cmd_up(messenger, context: dict, args: list) -> None:
         project_name = args[0]
         project = config.get_project(project_name)
         if not project:
-            await messenger.reply(context, f"Project '{project_name}' not found. Available projects: {config.get_available_projects()}")
+            await messenger.reply(context, config.project_not_found_message(project_name))
             return
         # Check for optional branch parameter
         if len(args) >= 2:
@@ -1222,10 +984,9 @@ async def cmd_up(messenger, context: dict, args: list) -> None:
     thread_key = get_thread_key(context)
 
     # Clear any existing thread associations for this project from other threads
-    for existing_key, info in list(claude.get_all_thread_worktrees().items()):
-        if info.get("project_name") == project_name and existing_key != thread_key:
-            claude.clear_thread_worktree(existing_key)
-            logger.info(f"Cleared old thread association {existing_key} for project {project_name}")
+    for existing_key in claude.get_thread_keys_for_project(project_name) - {thread_key}:
+        claude.clear_thread_worktree(existing_key)
+        logger.info("Cleared old thread association %s for project %s", existing_key, project_name)
 
     # Clean up workdir and pull from specified branch before spinning up
     await messenger.reply(context, f"Switching to branch: {branch}...")
@@ -1237,7 +998,8 @@ async def cmd_up(messenger, context: dict, args: list) -> None:
     # Associate this thread with the project
     claude.set_thread_worktree(
         thread_key, f"up-{project_name}", None,
-        project_workdir, project_workdir, project_name, project_repo
+        project_workdir, project_workdir, project_name, project_repo,
+        kind="up"
     )
 
 
@@ -1253,7 +1015,7 @@ async def cmd_stop(messenger, context: dict, args: list) -> None:
         project_name = args[0]
         project = config.get_project(project_name)
         if not project:
-            await messenger.reply(context, f"Project '{project_name}' not found. Available projects: {config.get_available_projects()}")
+            await messenger.reply(context, config.project_not_found_message(project_name))
             return
     else:
         # Try to get project from thread context with fallback
@@ -1273,63 +1035,64 @@ async def cmd_down(messenger, context: dict, args: list) -> None:
     await cmd_stop(messenger, context, args)
 
 
+def _format_query_row(project_name: str, query_id: str, info: dict, now) -> str:
+    """Format a running or queued Claude query as a /status line."""
+    cmd = info.get("command", "query")
+    prompt_full = info.get("prompt", "")
+    prompt = prompt_full[:50] + "..." if len(prompt_full) > 50 else prompt_full
+    started = info.get("started_at")
+    elapsed_str = f"{(now - started).total_seconds() / 60:.1f}m" if started else "?"
+    if info.get("queued"):
+        elapsed_str = f"queued {elapsed_str}"
+    return f"  [{query_id}] {project_name} /{cmd}: {prompt} ({elapsed_str})"
+
+
+def _format_job_row(job_id: str, info: dict, now) -> str:
+    """Format a completed job as a /status line."""
+    completed = info.get("completed_at")
+    if completed:
+        age = (now - completed).total_seconds() / 60
+        age_str = f"{age:.0f}m ago" if age < 60 else f"{age/60:.1f}h ago"
+    else:
+        age_str = "?"
+    return f"  [{job_id}] {info.get('project_name', '?')} /{info.get('command', '?')} ({age_str})"
+
+
+def _format_process_row(project_name: str, entry: process.ProjectProcess) -> str:
+    """Format a background process started by /up as a /status line."""
+    is_running, pid, returncode = entry.status()
+    if is_running:
+        return f"  - {project_name} (PID: {pid})"
+    return f"  - {project_name} (PID: {pid}, exited with code {returncode})"
+
+
 async def cmd_status(messenger, context: dict, args: list) -> None:
     """Handle /status command. Shows running queries, completed jobs, and processes."""
-    from datetime import datetime
     status_lines = []
+    append = status_lines.append
+    extend = status_lines.extend
+    now = datetime.now()
 
     # Check running Claude queries
     running_queries = claude.get_all_running_queries()
     if running_queries:
-        status_lines.append("Running Claude queries:")
+        append("Running Claude queries:")
         for project_name, queries in running_queries.items():
-            for query_id, info in queries.items():
-                cmd = info.get("command", "query")
-                prompt = info.get("prompt", "")[:50]
-                if len(info.get("prompt", "")) > 50:
-                    prompt += "..."
-                started = info.get("started_at")
-                if started:
-                    elapsed = (datetime.now() - started).total_seconds() / 60
-                    elapsed_str = f"{elapsed:.1f}m"
-                else:
-                    elapsed_str = "?"
-                status_lines.append(f"  [{query_id}] {project_name} /{cmd}: {prompt} ({elapsed_str})")
-
-        status_lines.append("")
-        status_lines.append("Use /cancel <project> [id] to cancel queries")
+            extend(_format_query_row(project_name, query_id, info, now) for query_id, info in queries.items())
+        extend(("", "Use /cancel <project> [id] to cancel queries"))
 
     # Check completed jobs available for feedback
     completed_jobs = claude.COMPLETED_JOBS
     if completed_jobs:
-        status_lines.append("\nCompleted jobs (available for /feedback):")
-        for job_id, info in completed_jobs.items():
-            project = info.get("project_name", "?")
-            cmd = info.get("command", "?")
-            completed = info.get("completed_at")
-            if completed:
-                age = (datetime.now() - completed).total_seconds() / 60
-                if age < 60:
-                    age_str = f"{age:.0f}m ago"
-                else:
-                    age_str = f"{age/60:.1f}h ago"
-            else:
-                age_str = "?"
-            status_lines.append(f"  [{job_id}] {project} /{cmd} ({age_str})")
-
-        status_lines.append("")
-        status_lines.append("Use /feedback <project> <job-id> <prompt> to continue")
+        append("\nCompleted jobs (available for /feedback):")
+        extend(_format_job_row(job_id, info, now) for job_id, info in completed_jobs.items())
+        extend(("", "Use /feedback <project> <job-id> <prompt> to continue"))
 
     # Check running background processes (from /up)
     running_projects = process.get_running_projects()
     if running_projects:
-        status_lines.append("\nRunning background processes:")
-        for project_name, process_info in running_projects.items():
-            proc, log_path, _ = process_info
-            if proc.poll() is None:
-                status_lines.append(f"  - {project_name} (PID: {proc.pid})")
-            else:
-                status_lines.append(f"  - {project_name} (PID: {proc.pid}, exited with code {proc.returncode})")
+        append("\nRunning background processes:")
+        extend(_format_process_row(project_name, entry) for project_name, entry in running_projects.items())
 
     if not status_lines:
         await messenger.reply(context, "No running queries, completed jobs, or processes.")
@@ -1362,7 +1125,7 @@ async def cmd_cancel(messenger, context: dict, args: list) -> None:
                 project_name = worktree_info.get("project_name")
                 query_id = potential_project  # Treat first arg as query ID
             else:
-                await messenger.reply(context, f"Project '{potential_project}' not found. Available projects: {config.get_available_projects()}")
+                await messenger.reply(context, config.project_not_found_message(potential_project))
                 return
     else:
         # No args - try thread context
@@ -1377,10 +1140,9 @@ async def cmd_cancel(messenger, context: dict, args: list) -> None:
             await messenger.reply(context, "No running queries to cancel.")
             return
 
-        all_cancelled = []
-        for pname in list(running.keys()):
-            cancelled = claude.cancel_query(pname)
-            all_cancelled.extend([f"{pname}:{qid}" for qid in cancelled])
+        # cancel_query removes worktrees with blocking git calls; run the projects in parallel threads
+        results = await asyncio.gather(*(asyncio.to_thread(claude.cancel_query, pname) for pname in running))
+        all_cancelled = [f"{pname}:{qid}" for pname, cancelled in zip(running, results) for qid in cancelled]
 
         if all_cancelled:
             await messenger.reply(context, f"Cancelled {len(all_cancelled)} queries: {', '.join(all_cancelled)}")
@@ -1399,14 +1161,14 @@ async def cmd_cancel(messenger, context: dict, args: list) -> None:
             await messenger.reply(context, f"Query ID '{query_id}' not found for project {project_name}. Running queries: {', '.join(queries.keys())}")
             return
 
-        cancelled = claude.cancel_query(project_name, query_id)
+        cancelled = await asyncio.to_thread(claude.cancel_query, project_name, query_id)
         if cancelled:
             await messenger.reply(context, f"Cancelled query {query_id} for project {project_name}.")
         else:
             await messenger.reply(context, f"Failed to cancel query {query_id} for project {project_name}.")
     else:
         # Cancel all queries for the project
-        cancelled = claude.cancel_query(project_name)
+        cancelled = await asyncio.to_thread(claude.cancel_query, project_name)
         if cancelled:
             await messenger.reply(context, f"Cancelled {len(cancelled)} queries for project {project_name}: {', '.join(cancelled)}")
         else:
@@ -1419,12 +1181,14 @@ async def cmd_log(messenger, context: dict, args: list) -> None:
     If project-name is not provided, uses the project from thread context.
     """
     project_name = None
+    project = None
     lines = 50
 
     if args and len(args) >= 1:
         # Check if first arg is a project name or number of lines
         first_arg = args[0]
-        if config.get_project(first_arg):
+        project = config.get_project(first_arg)
+        if project:
             project_name = first_arg
             if len(args) >= 2:
                 try:
@@ -1438,7 +1202,7 @@ async def cmd_log(messenger, context: dict, args: list) -> None:
                 lines = int(first_arg)
                 lines = min(max(lines, 1), 200)
             except ValueError:
-                await messenger.reply(context, f"Project '{first_arg}' not found. Available projects: {config.get_available_projects()}")
+                await messenger.reply(context, config.project_not_found_message(first_arg))
                 return
 
     # If no project name, try thread context with fallback
@@ -1451,9 +1215,10 @@ async def cmd_log(messenger, context: dict, args: list) -> None:
         await messenger.reply(context, "Usage: /log [project-name] [lines]\n\nNo project specified and no project context in this thread.")
         return
 
-    project = config.get_project(project_name)
     if not project:
-        await messenger.reply(context, f"Project '{project_name}' not found. Available projects: {config.get_available_projects()}")
+        project = config.get_project(project_name)
+    if not project:
+        await messenger.reply(context, config.project_not_found_message(project_name))
         return
 
     is_running, pid, _ = process.get_process_status(project_name)
@@ -1469,65 +1234,73 @@ async def cmd_log(messenger, context: dict, args: list) -> None:
     status = "running" if is_running else "exited"
     header = f"Logs for {project_name} (PID: {pid}, {status}) - last {lines} lines:\n\n"
 
-    output = header + logs
-    if len(output) > 4000:
-        output = output[:4000] + "\n\n[Output truncated...]"
+    await messenger.reply(context, clip_output(header + logs))
+
+
+# Files whose changes require reinstalling the bot package on selfupdate
+_DEPENDENCY_FILES = frozenset({"pyproject.toml", "setup.py", "setup.cfg", "requirements.txt", "uv.lock", "poetry.lock"})
 
-    await messenger.reply(context, output)
+
+# Marker kept under .git (untouched by the reset) while a selfupdate reinstall has not succeeded
+_REINSTALL_PENDING_MARKER = "ccc_reinstall_pending"
+
+
+def _dependency_files_changed(changed_files: set[str]) -> bool:
+    """Check whether any changed path is a packaging or requirements file."""
+    return any(
+        path in _DEPENDENCY_FILES or (path.startswith("requirements") and path.endswith(".txt"))
+        for path in changed_files
+    )
+
+
+async def _reinstall_package(bot_dir: str) -> subprocess.CompletedProcess:
+    """Reinstall the bot package, preferring uv and falling back to pip."""
+    if shutil.which("uv"):
+        result = await process.run_command_tail(
+            ["uv", "pip", "install", "--python", sys.executable, "-e", "."], cwd=bot_dir, timeout=300
+        )
+        if result.returncode == 0:
+            return result
+        # e.g. an externally managed interpreter that uv refuses to install into
+        logger.warning("uv pip install failed, falling back to pip: %s", result.stdout[-500:])
+    return await process.run_command_tail([sys.executable, "-m", "pip", "install", "-e", "."], cwd=bot_dir, timeout=300)
 
 
 async def cmd_selfupdate(messenger, context: dict, args: list) -> None:
     """Handle /selfupdate command. Updates bot from GitHub and restarts."""
-    import sys
-    import shutil
-
     logger.info("Received /selfupdate command")
 
     # Get the bot's installation directory
-    bot_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    config_path = os.path.join(bot_dir, "config.yaml")
+    bot_dir = config.BOT_DIR
+    config_path = config.DEFAULT_CONFIG_PATH
     config_backup_path = os.path.join("/tmp", "ccc_config_backup.yaml")
 
     # Get current commit
-    current_commit_result = subprocess.run(
-        ["git", "log", "-1", "--format=%h %s"],
-        cwd=bot_dir,
-        capture_output=True,
-        text=True,
-        timeout=10
-    )
-    current_commit = current_commit_result.stdout.strip() if current_commit_result.returncode == 0 else "unknown"
+    current_commit = await git.get_head_commit(bot_dir)
 
     await messenger.reply(context, f"Starting self-update...\nCurrent: {current_commit}")
 
+    # Background tasks overlapped with progress messages; awaited on every exit path
+    tasks = []
     try:
         # Backup config.yaml
         if os.path.exists(config_path):
-            shutil.copy2(config_path, config_backup_path)
-            logger.info(f"Backed up config.yaml to {config_backup_path}")
+            # Keep the permission bits (the file holds tokens); timestamps don't matter
+            shutil.copy(config_path, config_backup_path)
+            logger.info("Backed up config.yaml to %s", config_backup_path)
 
-        # Fetch latest from origin
+        # Fetch latest from origin, overlapping the fetch with the progress message
+        fetch_task = asyncio.create_task(process.run_command_tail(["git", "fetch", "origin"], cwd=bot_dir, timeout=60))
+        tasks.append(fetch_task)
         await messenger.reply(context, "Fetching latest code from GitHub...")
-        fetch_result = subprocess.run(
-            ["git", "fetch", "origin"],
-            cwd=bot_dir,
-            capture_output=True,
-            text=True,
-            timeout=60
-        )
+        fetch_result = await fetch_task
 
         if fetch_result.returncode != 0:
-            await messenger.reply(context, f"Failed to fetch: {fetch_result.stderr[:500]}")
+            await messenger.reply(context, f"Failed to fetch: {fetch_result.stdout[-500:]}")
             return
 
         # Reset to origin/main
-        reset_result = subprocess.run(
-            ["git", "reset", "--hard", "origin/main"],
-            cwd=bot_dir,
-            capture_output=True,
-            text=True,
-            timeout=60
-        )
+        reset_result = await process.run_command(["git", "reset", "--hard", "origin/main"], cwd=bot_dir, timeout=60)
 
         if reset_result.returncode != 0:
             await messenger.reply(context, f"Failed to reset: {reset_result.stderr[:500]}")
@@ -1535,35 +1308,46 @@ async def cmd_selfupdate(messenger, context: dict, args: list) -> None:
 
         # Restore config.yaml
         if os.path.exists(config_backup_path):
-            shutil.copy2(config_backup_path, config_path)
+            try:
+                # Atomic rename when /tmp and the checkout share a filesystem
+                os.replace(config_backup_path, config_path)
+            except OSError:
+                shutil.copy(config_backup_path, config_path)
             logger.info("Restored config.yaml from backup")
 
-        # Reinstall package (in case dependencies changed)
-        await messenger.reply(context, "Reinstalling package...")
-        pip_result = subprocess.run(
-            [sys.executable, "-m", "pip", "install", "-e", "."],
-            cwd=bot_dir,
-            capture_output=True,
-            text=True,
-            timeout=300
-        )
+        # HEAD is final after the reset, so read the new commit alongside the reinstall
+        new_commit_task = asyncio.create_task(git.get_head_commit(bot_dir))
+        tasks.append(new_commit_task)
 
-        if pip_result.returncode != 0:
-            await messenger.reply(context, f"Warning: pip install failed: {pip_result.stderr[:500]}")
-            # Continue anyway, the code update might still work
-
-        # Get new commit
-        new_commit_result = subprocess.run(
-            ["git", "log", "-1", "--format=%h %s"],
-            cwd=bot_dir,
-            capture_output=True,
-            text=True,
-            timeout=10
-        )
-        new_commit = new_commit_result.stdout.strip() if new_commit_result.returncode == 0 else "unknown"
+        # Reinstall package only if dependencies changed (ORIG_HEAD is the pre-reset commit)
+        # A previous reinstall that failed or was interrupted forces one even if dependencies are unchanged now
+        changed_files = await git.get_changed_files(bot_dir, "ORIG_HEAD")
+        reinstall_marker = os.path.join(bot_dir, ".git", _REINSTALL_PENDING_MARKER)
+        if changed_files is not None and not _dependency_files_changed(changed_files) and not os.path.exists(reinstall_marker):
+            await messenger.reply(context, "Dependencies unchanged, skipping reinstall")
+        else:
+            try:
+                open(reinstall_marker, "w").close()
+            except OSError as e:
+                logger.warning("Could not write %s: %s", reinstall_marker, e)
+            pip_task = asyncio.create_task(_reinstall_package(bot_dir))
+            tasks.append(pip_task)
+            await messenger.reply(context, "Reinstalling package...")
+            pip_result = await pip_task
+
+            if pip_result.returncode != 0:
+                await messenger.reply(context, f"Warning: pip install failed: {pip_result.stdout[-500:]}")
+                # Continue anyway, the code update might still work; the marker retries it next time
+            else:
+                try:
+                    os.remove(reinstall_marker)
+                except FileNotFoundError:
+                    pass
+
+        new_commit = await new_commit_task
 
         await messenger.reply(context, f"Update complete! Restarting bot...\nUpdated to: {new_commit}")
-        logger.info(f"Self-update complete ({current_commit} -> {new_commit}), restarting...")
+        logger.info("Self-update complete (%s -> %s), restarting...", current_commit, new_commit)
 
         # Give Lark time to send the message
         await asyncio.sleep(1)
@@ -1574,10 +1358,12 @@ async def cmd_selfupdate(messenger, context: dict, args: list) -> None:
     except subprocess.TimeoutExpired:
         await messenger.reply(context, "Update timed out")
     except Exception as e:
-        logger.error(f"Error during self-update: {e}")
+        logger.error("Error during self-update: %s", e)
         await messenger.reply(context, f"Error during self-update: {str(e)}")
 
         # Try to restore config if something went wrong
         if os.path.exists(config_backup_path) and not os.path.exists(config_path):
-            shutil.copy2(config_backup_path, config_path)
+            shutil.copy(config_backup_path, config_path)
             logger.info("Restored config.yaml after error")
+    finally:
+        await asyncio.gather(*tasks, return_exceptions=True)
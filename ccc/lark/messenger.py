@@ -29,7 +29,7 @@ class LarkMessenger(Messenger):
             context: Dict containing chat_id, message_id, and optionally root_id
             text: The text message to send
         """
-        logger.info(f"Attempting to reply with context: {context}")
+        logger.info("Attempting to reply with context: %s", context)
 
         try:
             from lark_oapi.api.im.v1 import (
@@ -47,7 +47,7 @@ class LarkMessenger(Messenger):
 
             if root_id:
                 # Use ReplyMessageRequest with reply_in_thread=True for true thread replies
-                logger.info(f"Sending thread reply to message: {root_id}, reply_in_thread=True")
+                logger.info("Sending thread reply to message: %s, reply_in_thread=True", root_id)
                 request = (
                     ReplyMessageRequest.builder()
                     .message_id(root_id)
@@ -63,18 +63,18 @@ class LarkMessenger(Messenger):
                 )
 
                 response = self.client.im.v1.message.reply(request)
-                logger.info(f"Reply response: success={response.success()}, code={response.code}, msg={response.msg}")
+                logger.info("Reply response: success=%s, code=%s, msg=%s", response.success(), response.code, response.msg)
 
                 if not response.success():
                     logger.error(
-                        f"Failed to send Lark thread reply: code={response.code}, msg={response.msg}"
+                        "Failed to send Lark thread reply: code=%s, msg=%s", response.code, response.msg
                     )
                 else:
-                    logger.info(f"Sent Lark thread reply to message {root_id}")
+                    logger.info("Sent Lark thread reply to message %s", root_id)
 
             elif chat_id:
                 # Fallback: send to chat directly if no message_id/root_id
-                logger.warning(f"No message_id/root_id, sending to chat_id: {chat_id}")
+                logger.warning("No message_id/root_id, sending to chat_id: %s", chat_id)
                 request = (
                     CreateMessageRequest.builder()
                     .receive_id_type("chat_id")
@@ -93,15 +93,15 @@ class LarkMessenger(Messenger):
 
                 if not response.success():
                     logger.error(
-                        f"Failed to send Lark message: code={response.code}, msg={response.msg}"
+                        "Failed to send Lark message: code=%s, msg=%s", response.code, response.msg
                     )
                 else:
-                    logger.info(f"Sent Lark message to chat {chat_id}")
+                    logger.info("Sent Lark message to chat %s", chat_id)
             else:
                 logger.error("No message_id, root_id, or chat_id in context for reply")
 
         except Exception as e:
-            logger.error(f"Error sending Lark reply: {e}", exc_info=True)
+            logger.error("Error sending Lark reply: %s", e, exc_info=True)
 
     def get_thread_context(self, context: dict) -> Optional[str]:
         """Get thread/conversation context from Lark message.
@@ -125,7 +125,7 @@ class LarkMessenger(Messenger):
             "chat_id": context.get("chat_id"),
             "root_id": context.get("root_id") or context.get("message_id"),
         }
-        logger.info(f"Stored thread context for project {project_name}")
+        logger.info("Stored thread context for project %s", project_name)
 
     def get_project_thread(self, project_name: str) -> Optional[dict]:
         """Get stored thread context for a project.
@@ -145,4 +145,4 @@ class LarkMessenger(Messenger):
             project_name: Name of the project
         """
         self.thread_contexts.pop(project_name, None)
-        logger.info(f"Cleared thread context for project {project_name}")
+        logger.info("Cleared thread context for project %s", project_name)
@@ -3,6 +3,15 @@
 from abc import ABC, abstractmethod
 from typing import Any, Optional
 
+# Longest command output sent back to the user
+OUTPUT_LIMIT = 4000
+TRUNCATED_SUFFIX = "\n\n[Output truncated...]"
+
+
+def clip_output(text: str, limit: int = OUTPUT_LIMIT) -> str:
+    """Truncate text to limit characters, marking it as truncated if it was cut."""
+    return text if len(text) <= limit else text[:limit] + TRUNCATED_SUFFIX
+
 
 class Messenger(ABC):
     """Abstract interface for platform-specific messaging."""
@@ -8,7 +8,8 @@ import subprocess
 import sys
 import threading
 from collections import deque
-from typing import Any
+from dataclasses import dataclass, field
+from typing import Any, BinaryIO
 
 from . import config
 from .messenger import Messenger
@@ -16,38 +17,216 @@ from .messenger import Messenger
 logger = logging.getLogger(__name__)
 
 
-# Process storage for running project instances: {project_name: (subprocess.Popen, log_file_path, log_file)}
-PROJECT_PROCESSES = {}
+# Most recent output lines kept in memory per project (the /log command's maximum)
+LOG_BUFFER_LINES = 200
+
+# Most bytes read from a project's output pipe at once
+STREAM_CHUNK_SIZE = 65536
+
+
+@dataclass(slots=True)
+class ProjectProcess:
+    """A project process started by /up.
+
+    output holds the last LOG_BUFFER_LINES lines (bytes) the process printed, so
+    recent logs can be shown without reading the log file back.
+    """
+
+    process: subprocess.Popen
+    log_file_path: str
+    output: deque = field(default_factory=lambda: deque(maxlen=LOG_BUFFER_LINES))
+
+    def status(self) -> tuple[bool, int, int | None]:
+        """Poll the process once. Returns (is_running, pid, returncode)."""
+        returncode = self.process.poll()
+        return (returncode is None, self.process.pid, returncode)
+
+
+# Process storage for running project instances: {project_name: ProjectProcess}
+PROJECT_PROCESSES: dict[str, ProjectProcess] = {}
 
 # Background threads for output streaming: {project_name: thread}
 OUTPUT_THREADS = {}
 
+# Log file path per project, built once: {project_name: path}
+_LOG_PATHS: dict[str, str] = {}
+
+
+def use_pidfd_child_watcher(loop: asyncio.AbstractEventLoop) -> bool:
+    """Reap loop's asyncio subprocesses through pidfds instead of a thread per child.
+
+    Python 3.12+ already does this by default. Before that the default watcher
+    starts a waitpid thread for every git or pip command; PidfdChildWatcher
+    instead registers each child's pidfd with the loop's selector.
+
+    The child watcher is process-wide and this one is bound to a single loop,
+    so only call it when that loop is the only one in the process that starts
+    subprocesses: the Lark bot's per-request loops in other threads would
+    otherwise register their children on it.
+
+    Args:
+        loop: The event loop all asyncio subprocesses will run on
+
+    Returns:
+        True if the pidfd watcher was installed
+    """
+    if sys.version_info >= (3, 12):
+        return False
+    try:
+        os.close(os.pidfd_open(os.getpid()))
+    except (AttributeError, OSError):
+        # Not Linux, or a kernel older than 5.3
+        return False
+
+    watcher = asyncio.PidfdChildWatcher()
+    watcher.attach_loop(loop)
+    asyncio.set_child_watcher(watcher)
+    return True
+
+
+async def run_command(args, cwd: str = None, timeout: float = None, shell: bool = False, env: dict = None) -> subprocess.CompletedProcess:
+    """Run a command without blocking the event loop.
+
+    Async counterpart of subprocess.run(..., capture_output=True, text=True).
+
+    Args:
+        args: Argument list, or a command string when shell is True
+        cwd: Working directory for the command
+        timeout: Seconds to wait before killing the command
+        shell: Run args through the shell
+        env: Environment for the command (default: inherit the bot's)
+
+    Returns:
+        CompletedProcess with decoded stdout and stderr
+
+    Raises:
+        subprocess.TimeoutExpired: If the command did not finish within timeout
+    """
+    if shell:
+        proc = await asyncio.create_subprocess_shell(
+            args, cwd=cwd, env=env, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+    else:
+        proc = await asyncio.create_subprocess_exec(
+            *args, cwd=cwd, env=env, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise subprocess.TimeoutExpired(args, timeout)
+
+    return subprocess.CompletedProcess(
+        args, proc.returncode,
+        stdout.decode(errors="replace"), stderr.decode(errors="replace")
+    )
+
+
+async def run_command_tail(args: list, cwd: str = None, timeout: float = None, tail_lines: int = 50) -> subprocess.CompletedProcess:
+    """Run a command, keeping only the last lines of its combined output.
+
+    Meant for chatty commands (pip install, git fetch) where only the end of
+    the output matters for error reports: output is consumed line by line, so
+    memory use stays constant however much the command prints.
+
+    Args:
+        args: Argument list
+        cwd: Working directory for the command
+        timeout: Seconds to wait before killing the command
+        tail_lines: Number of trailing output lines to keep
+
+    Returns:
+        CompletedProcess whose stdout holds the last tail_lines lines of
+        stdout and stderr interleaved, and whose stderr is empty
+
+    Raises:
+        subprocess.TimeoutExpired: If the command did not finish within timeout
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *args, cwd=cwd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT
+    )
+    tail = deque(maxlen=tail_lines)
+
+    async def consume():
+        async for line in proc.stdout:
+            tail.append(line)
+        await proc.wait()
 
-def _stream_output(process: subprocess.Popen, project_name: str, log_file_path: str):
-    """Stream process output to both log file and stdout. Runs in background thread."""
     try:
-        with open(log_file_path, 'w') as log_file:
-            prefix = f"[{project_name}] "
-            for line in iter(process.stdout.readline, b''):
-                if not line:
+        await asyncio.wait_for(consume(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise subprocess.TimeoutExpired(args, timeout)
+
+    return subprocess.CompletedProcess(args, proc.returncode, b"".join(tail).decode(errors="replace"), "")
+
+
+def _echo(data: bytes):
+    """Write raw process output to the bot's stdout."""
+    stdout = getattr(sys.stdout, "buffer", None)
+    if stdout is None:
+        sys.stdout.write(data.decode('utf-8', errors='replace'))
+        sys.stdout.flush()
+        return
+    # Flush pending text first so it stays in order with these bytes
+    sys.stdout.flush()
+    stdout.write(data)
+    stdout.flush()
+
+
+def _stream_output(process: subprocess.Popen, project_name: str, log_file: BinaryIO, output: deque):
+    """Stream process output to the log file, stdout and output buffer. Runs in background thread.
+
+    Output is handled in chunks of whatever the pipe has available, so a burst
+    of lines costs one write and flush per destination instead of one per line.
+    Output stays bytes throughout; only what /log shows is ever decoded.
+    The log file is opened by the caller and closed here.
+    """
+    try:
+        with log_file:
+            prefix = f"[{project_name}] ".encode()
+            pending = b""
+            while True:
+                chunk = process.stdout.read1(STREAM_CHUNK_SIZE)
+                if not chunk:
                     break
-                try:
-                    decoded = line.decode('utf-8', errors='replace')
-                except Exception:
-                    decoded = str(line)
 
-                # Write to log file
-                log_file.write(decoded)
+                # Write to log file as it arrives
+                log_file.write(chunk)
                 log_file.flush()
 
+                # Only complete lines go to stdout and the buffer; a trailing
+                # partial line waits for the rest unless it grows too long
+                data = pending + chunk
+                cut = data.rfind(b"\n") + 1
+                if not cut and len(data) < STREAM_CHUNK_SIZE:
+                    pending = data
+                    continue
+                if not cut:
+                    cut = len(data)
+                pending = data[cut:]
+                lines = data[:cut].splitlines(keepends=True)
+                output.extend(lines)
+
                 # Write to stdout with project prefix
-                sys.stdout.write(prefix + decoded)
-                sys.stdout.flush()
+                _echo(b"".join(prefix + line for line in lines))
+
+            if pending:
+                output.append(pending)
+                _echo(prefix + pending + b"\n")
 
             # Wait for process to finish
             process.wait()
+
+            # /log is served from memory, so the file is rarely read again;
+            # let the kernel drop its cached pages
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(log_file.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
     except Exception as e:
-        logger.error(f"Error streaming output for {project_name}: {e}")
+        logger.error("Error streaming output for %s: %s", project_name, e)
     finally:
         OUTPUT_THREADS.pop(project_name, None)
 
@@ -84,35 +263,41 @@ def _kill_processes_on_ports(ports: list[str], project_name: str) -> list[tuple[
                         try:
                             pid = int(pid_str)
                             os.kill(pid, signal.SIGTERM)
-                            logger.info(f"[{project_name}] Killed PID {pid} on port {port}")
+                            logger.info("[%s] Killed PID %s on port %s", project_name, pid, port)
                             killed.append((port, pid))
                         except (ValueError, ProcessLookupError) as e:
-                            logger.warning(f"[{project_name}] Could not kill PID {pid_str} on port {port}: {e}")
+                            logger.warning("[%s] Could not kill PID %s on port %s: %s", project_name, pid_str, port, e)
                         except PermissionError:
-                            logger.warning(f"[{project_name}] Permission denied killing PID {pid_str} on port {port}")
+                            logger.warning("[%s] Permission denied killing PID %s on port %s", project_name, pid_str, port)
         except FileNotFoundError:
-            logger.warning(f"[{project_name}] lsof not found, cannot check port {port}")
+            logger.warning("[%s] lsof not found, cannot check port %s", project_name, port)
         except Exception as e:
-            logger.error(f"[{project_name}] Error checking port {port}: {e}")
+            logger.error("[%s] Error checking port %s: %s", project_name, port, e)
 
     return killed
 
 
-def _read_log_file(log_file_path: str, lines: int = 50) -> str | None:
-    """Read the last N lines from a log file."""
-    if not os.path.exists(log_file_path):
-        return None
+def _log_file_path(project_name: str) -> str:
+    """Get the path of a project's log file, reusing the string across restarts."""
+    path = _LOG_PATHS.get(project_name)
+    if path is None:
+        path = _LOG_PATHS[project_name] = f"/tmp/ccc_{project_name}.log"
+    return path
 
-    try:
-        with open(log_file_path, 'r') as f:
-            content = ''.join(deque(f, maxlen=lines))
-            # Truncate if too long for chat message
-            if len(content) > 3000:
-                content = content[-3000:]
-            return content.strip() if content else None
-    except Exception as e:
-        logger.error(f"Error reading log file {log_file_path}: {e}")
-        return None
+
+def _recent_output(output: deque, lines: int) -> str:
+    """Join the last N lines of a process's buffered output."""
+    # list() copies the deque in one step, safe against the streaming thread appending
+    return b"".join(list(output)[-lines:]).decode('utf-8', errors='replace')
+
+
+def _initial_output(output: deque, lines: int) -> str | None:
+    """Get the last N output lines, trimmed for a chat message."""
+    content = _recent_output(output, lines)
+    # Truncate if too long for chat message
+    if len(content) > 3000:
+        content = content[-3000:]
+    return content.strip() or None
 
 
 async def spin_up_project(messenger: Messenger, context: Any, project_name: str, project_workdir: str, project_up: str, project_endpoint_url: str = None, project_ports: list[str] = None) -> bool:
@@ -128,7 +313,7 @@ async def spin_up_project(messenger: Messenger, context: Any, project_name: str,
         project_ports: Optional list of ports to free up before starting
     """
     if not project_up:
-        logger.info(f"No project_up command configured for {project_name}")
+        logger.info("No project_up command configured for %s", project_name)
         return True
 
     # Helper to send message only if messenger is available
@@ -141,7 +326,7 @@ async def spin_up_project(messenger: Messenger, context: Any, project_name: str,
 
     # Kill processes occupying the configured ports
     if project_ports:
-        killed = _kill_processes_on_ports(project_ports, project_name)
+        killed = await asyncio.to_thread(_kill_processes_on_ports, project_ports, project_name)
         if killed:
             killed_info = ", ".join([f"PID {pid} on port {port}" for port, pid in killed])
             await send_msg(f"Killed processes occupying ports: {killed_info}")
@@ -150,31 +335,50 @@ async def spin_up_project(messenger: Messenger, context: Any, project_name: str,
 
     try:
         await send_msg(f"Spinning up project {project_name}...")
-        logger.info(f"Running project_up command for {project_name}: {project_up}")
-
-        log_file_path = f"/tmp/ccc_{project_name}.log"
-
-        # Run the command with PIPE for stdout so we can stream it
-        process = subprocess.Popen(
-            project_up,
-            shell=True,
-            cwd=project_workdir,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,  # Merge stderr into stdout
-            start_new_session=True  # Detach from parent process group
-        )
+        logger.info("Running project_up command for %s: %s", project_name, project_up)
+
+        log_file_path = _log_file_path(project_name)
+        # Open the log before starting the process: if this fails nothing would
+        # drain the pipe, and the process would block once it filled up
+        log_file = await asyncio.to_thread(open, log_file_path, 'wb')
+
+        # Run the command with PIPE for stdout so we can stream it. Popen forks and
+        # execs synchronously, so start it from a worker thread. It stays a Popen
+        # rather than an asyncio process because the streaming thread and other
+        # event loops (the Lark bot's) need to use it too. Both streams share one
+        # pipe, so the kernel keeps each write (up to PIPE_BUF) whole and only
+        # the streaming thread writes the log file. No hand-rolled posix_spawn:
+        # with no preexec_fn or uid/gid changes CPython already launches via
+        # vfork, and closes inherited fds with close_range rather than a loop.
+        try:
+            process = await asyncio.to_thread(
+                subprocess.Popen,
+                project_up,
+                shell=True,
+                cwd=project_workdir,
+                stdin=subprocess.DEVNULL,  # Don't share the bot's stdin with a long-running server
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,  # Merge stderr into stdout
+                close_fds=True,  # Only the three standard streams reach the child
+                start_new_session=True  # Detach from parent process group
+            )
+        except BaseException:
+            log_file.close()
+            raise
+
+        entry = ProjectProcess(process, log_file_path)
 
-        # Start background thread to stream output to both log file and stdout
+        # Start background thread to stream output to the log file, stdout and buffer
         output_thread = threading.Thread(
             target=_stream_output,
-            args=(process, project_name, log_file_path),
+            args=(process, project_name, log_file, entry.output),
             daemon=True
         )
         output_thread.start()
         OUTPUT_THREADS[project_name] = output_thread
 
-        PROJECT_PROCESSES[project_name] = (process, log_file_path, None)
-        logger.info(f"Started process {process.pid} for project {project_name}, logging to {log_file_path}")
+        PROJECT_PROCESSES[project_name] = entry
+        logger.info("Started process %s for project %s, logging to %s", process.pid, project_name, log_file_path)
 
         await send_msg(f"Project {project_name} started (PID: {process.pid}). Output streaming to console.")
 
@@ -185,14 +389,14 @@ async def spin_up_project(messenger: Messenger, context: Any, project_name: str,
         poll_result = process.poll()
         if poll_result is not None:
             # Process already exited
-            initial_logs = _read_log_file(log_file_path, lines=30)
+            initial_logs = _initial_output(entry.output, 30)
             if initial_logs:
                 await send_msg(f"Process exited with code {poll_result}. Output:\n```\n{initial_logs}\n```")
             else:
                 await send_msg(f"Process exited with code {poll_result} (no output)")
         else:
             # Process still running, show initial output
-            initial_logs = _read_log_file(log_file_path, lines=20)
+            initial_logs = _initial_output(entry.output, 20)
             if initial_logs:
                 await send_msg(f"Initial output:\n```\n{initial_logs}\n```")
 
@@ -203,11 +407,50 @@ async def spin_up_project(messenger: Messenger, context: Any, project_name: str,
         return True
 
     except Exception as e:
-        logger.error(f"Error spinning up project {project_name}: {e}")
+        logger.error("Error spinning up project %s: %s", project_name, e)
         await send_msg(f"Error spinning up project: {str(e)}")
         return False
 
 
+async def _wait_for_exit(process: subprocess.Popen, timeout: float) -> bool:
+    """Wait for a process to exit without blocking the event loop.
+
+    Uses a pidfd watched by the event loop where available (Linux 5.3+), and
+    otherwise waits in a worker thread.
+
+    Args:
+        process: Process to wait for
+        timeout: Seconds to wait
+
+    Returns:
+        True if the process exited within timeout
+    """
+    if process.poll() is not None:
+        return True
+
+    try:
+        pidfd = os.pidfd_open(process.pid)
+    except (AttributeError, OSError):
+        try:
+            await asyncio.to_thread(process.wait, timeout)
+            return True
+        except subprocess.TimeoutExpired:
+            return False
+
+    loop = asyncio.get_running_loop()
+    exited = loop.create_future()
+    # The pidfd becomes readable once the process exits
+    loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(None))
+    try:
+        await asyncio.wait_for(exited, timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        loop.remove_reader(pidfd)
+        os.close(pidfd)
+
+
 async def kill_project_process(messenger: Messenger, context: Any, project_name: str, silent: bool = False) -> bool:
     """Kill a running project process.
 
@@ -222,28 +465,30 @@ async def kill_project_process(messenger: Messenger, context: Any, project_name:
         if not silent and messenger and context:
             await messenger.reply(context, msg)
 
-    process_info = PROJECT_PROCESSES.get(project_name)
-    if not process_info:
+    entry = PROJECT_PROCESSES.get(project_name)
+    if entry is None:
         await send_msg(f"No running process found for project {project_name}")
         return False
 
-    process, log_file_path, _ = process_info
+    process = entry.process
 
     try:
-        # Kill the entire process group
-        os.killpg(os.getpgid(process.pid), signal.SIGTERM)
-        process.wait(timeout=5)
-        logger.info(f"Killed process {process.pid} for project {project_name}")
-        await send_msg(f"Stopped project {project_name} (PID: {process.pid})")
-    except subprocess.TimeoutExpired:
-        # Force kill if SIGTERM didn't work
-        os.killpg(os.getpgid(process.pid), signal.SIGKILL)
-        logger.info(f"Force killed process {process.pid} for project {project_name}")
-        await send_msg(f"Force stopped project {project_name} (PID: {process.pid})")
+        # Kill the entire process group. start_new_session made the process its
+        # own group leader, so the group id is its pid; this still reaches the
+        # group's other members after the leader itself has exited
+        os.killpg(process.pid, signal.SIGTERM)
+        if await _wait_for_exit(process, 5):
+            logger.info("Killed process %s for project %s", process.pid, project_name)
+            await send_msg(f"Stopped project {project_name} (PID: {process.pid})")
+        else:
+            # Force kill if SIGTERM didn't work
+            os.killpg(process.pid, signal.SIGKILL)
+            logger.info("Force killed process %s for project %s", process.pid, project_name)
+            await send_msg(f"Force stopped project {project_name} (PID: {process.pid})")
     except ProcessLookupError:
-        logger.info(f"Process {process.pid} for project {project_name} already terminated")
+        logger.info("Process %s for project %s already terminated", process.pid, project_name)
     except Exception as e:
-        logger.error(f"Error killing process for {project_name}: {e}")
+        logger.error("Error killing process for %s: %s", project_name, e)
         await send_msg(f"Error stopping project: {str(e)}")
         return False
 
@@ -254,43 +499,43 @@ async def kill_project_process(messenger: Messenger, context: Any, project_name:
     return True
 
 
+async def kill_all_projects() -> None:
+    """Stop every running project process.
+
+    The processes are stopped concurrently, so they share one SIGTERM grace
+    period instead of waiting for each other's.
+    """
+    if PROJECT_PROCESSES:
+        await asyncio.gather(*(
+            kill_project_process(None, None, project_name, silent=True)
+            for project_name in list(PROJECT_PROCESSES)
+        ))
+
+
 def get_running_projects() -> dict:
-    """Get dictionary of running project processes. Returns {project_name: (process, log_path, log_file)}."""
+    """Get dictionary of running project processes. Returns {project_name: ProjectProcess}."""
     return PROJECT_PROCESSES
 
 
 def get_process_status(project_name: str) -> tuple:
     """Get status of a project process. Returns (is_running, pid, returncode)."""
-    process_info = PROJECT_PROCESSES.get(project_name)
-    if not process_info:
+    entry = PROJECT_PROCESSES.get(project_name)
+    if entry is None:
         return (False, None, None)
 
-    process, _, _ = process_info
-    poll_result = process.poll()
-    if poll_result is None:
-        return (True, process.pid, None)
-    else:
-        return (False, process.pid, poll_result)
+    return entry.status()
 
 
 def get_project_logs(project_name: str, lines: int = 50) -> str | None:
-    """Get the last N lines from a project's log file."""
-    process_info = PROJECT_PROCESSES.get(project_name)
-    if not process_info:
-        return None
+    """Get the last N lines (at most LOG_BUFFER_LINES) of a project's output.
 
-    _, log_file_path, _ = process_info
-
-    if not os.path.exists(log_file_path):
+    Served from the in-memory buffer; the full output stays in the log file.
+    """
+    entry = PROJECT_PROCESSES.get(project_name)
+    if entry is None:
         return None
 
-    try:
-        # Read last N lines efficiently
-        with open(log_file_path, 'r') as f:
-            return ''.join(deque(f, maxlen=lines))
-    except Exception as e:
-        logger.error(f"Error reading log file for {project_name}: {e}")
-        return None
+    return _recent_output(entry.output, lines) or None
 
 
 async def startup_all_projects() -> list[tuple[str, bool, str]]:
@@ -311,16 +556,16 @@ async def startup_all_projects() -> list[tuple[str, bool, str]]:
         project_ports = project.get('project_ports')
 
         if not project_up:
-            logger.info(f"[startup] Skipping {project_name} - no project_up command configured")
+            logger.info("[startup] Skipping %s - no project_up command configured", project_name)
             continue
 
         if not project_workdir or not os.path.exists(project_workdir):
             msg = f"Workdir not found: {project_workdir}"
-            logger.warning(f"[startup] Skipping {project_name} - {msg}")
+            logger.warning("[startup] Skipping %s - %s", project_name, msg)
             results.append((project_name, False, msg))
             continue
 
-        logger.info(f"[startup] Starting project {project_name}...")
+        logger.info("[startup] Starting project %s...", project_name)
 
         try:
             # Run spin_up_project in silent mode (no messenger/context)
@@ -343,7 +588,7 @@ async def startup_all_projects() -> list[tuple[str, bool, str]]:
                 results.append((project_name, False, "Failed to start"))
 
         except Exception as e:
-            logger.error(f"[startup] Error starting {project_name}: {e}")
+            logger.error("[startup] Error starting %s: %s", project_name, e)
             results.append((project_name, False, str(e)))
 
     return results
@@ -4,6 +4,7 @@ import asyncio
 import logging
 import os
 import signal
+import threading
 
 from telegram import Update
 from telegram.ext import Application, MessageHandler, CommandHandler, filters
@@ -23,6 +24,9 @@ logger = logging.getLogger(__name__)
 # Global messenger instance
 messenger = None
 
+# Starts the shutdown sequence of the running bot; set while run() is active
+_request_stop = None
+
 
 def get_messenger() -> TelegramMessenger:
     """Get the global TelegramMessenger instance."""
@@ -32,22 +36,51 @@ def get_messenger() -> TelegramMessenger:
     return messenger
 
 
-async def send_startup_messages(application: Application) -> None:
-    """Send startup notification to all authorized groups."""
-    logger.info("Sending startup notifications to authorized groups...")
+def stop() -> None:
+    """Ask the running bot to shut down. Safe to call from any thread.
+
+    The bot then sends its shutdown messages and stops the project processes
+    before run() returns.
+    """
+    if _request_stop is not None:
+        _request_stop()
+
+
+# Cap on in-flight broadcast sends, in line with Telegram's ~30 messages/second bot limit
+BROADCAST_CONCURRENCY = 30
 
-    for group_id in config.get_telegram_authorized_group_ids():
+
+async def broadcast(application: Application, text: str, description: str) -> None:
+    """Send a message to all authorized groups concurrently.
+
+    Args:
+        application: Running Telegram application
+        text: Message to send
+        description: What is being sent, used in log messages (e.g. "startup message")
+    """
+    semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+
+    async def send_one(group_id: str) -> None:
+        thread_id = config.get_telegram_thread_id(group_id)
         try:
-            thread_id = config.get_telegram_thread_id(group_id)
-            await application.bot.send_message(
-                chat_id=group_id,
-                text="Agent is now online and ready to receive commands.",
-                message_thread_id=thread_id
-            )
+            async with semaphore:
+                await application.bot.send_message(
+                    chat_id=group_id,
+                    text=text,
+                    message_thread_id=thread_id
+                )
             thread_info = f" (thread {thread_id})" if thread_id else ""
-            logger.info(f"Sent startup message to group {group_id}{thread_info}")
+            logger.info("Sent %s to group %s%s", description, group_id, thread_info)
         except Exception as e:
-            logger.error(f"Failed to send startup message to group {group_id}: {e}")
+            logger.error("Failed to send %s to group %s: %s", description, group_id, e)
+
+    await asyncio.gather(*(send_one(group_id) for group_id in config.get_telegram_authorized_group_ids()))
+
+
+async def send_startup_messages(application: Application) -> None:
+    """Send startup notification to all authorized groups."""
+    logger.info("Sending startup notifications to authorized groups...")
+    await broadcast(application, "Agent is now online and ready to receive commands.", "startup message")
 
 
 async def startup_projects_and_notify(application: Application) -> None:
@@ -66,38 +99,23 @@ async def startup_projects_and_notify(application: Application) -> None:
     logger.info(summary)
 
     # Send summary to all authorized groups
-    for group_id in config.get_telegram_authorized_group_ids():
-        try:
-            thread_id = config.get_telegram_thread_id(group_id)
-            await application.bot.send_message(
-                chat_id=group_id,
-                text=summary,
-                message_thread_id=thread_id
-            )
-        except Exception as e:
-            logger.error(f"Failed to send startup summary to group {group_id}: {e}")
+    await broadcast(application, summary, "startup summary")
 
 
 async def send_shutdown_messages(application: Application) -> None:
     """Send shutdown notification to all authorized groups."""
     logger.info("Sending shutdown notifications to authorized groups...")
+    await broadcast(application, "Agent is going offline.", "shutdown message")
 
-    for group_id in config.get_telegram_authorized_group_ids():
-        try:
-            thread_id = config.get_telegram_thread_id(group_id)
-            await application.bot.send_message(
-                chat_id=group_id,
-                text="Agent is going offline.",
-                message_thread_id=thread_id
-            )
-            thread_info = f" (thread {thread_id})" if thread_id else ""
-            logger.info(f"Sent shutdown message to group {group_id}{thread_info}")
-        except Exception as e:
-            logger.error(f"Failed to send shutdown message to group {group_id}: {e}")
 
+def run(config_path: str = None, only_bot: bool = False):
+    """Run the Telegram bot.
 
-def run(config_path: str = None):
-    """Run the Telegram bot."""
+    Args:
+        config_path: Path to config.yaml
+        only_bot: No other bot runs in this process, so the Telegram loop may
+            install the process-wide pidfd child watcher
+    """
     if config_path:
         config.load_config(config_path)
 
@@ -105,7 +123,14 @@ def run(config_path: str = None):
         logger.error('telegram_bot_token not set in config.yaml')
         return
 
-    application = Application.builder().token(config.TELEGRAM_BOT_TOKEN).build()
+    # Process updates concurrently so a long-running query does not delay
+    # other commands (/status, /cancel, ...) until it finishes
+    application = (
+        Application.builder()
+        .token(config.TELEGRAM_BOT_TOKEN)
+        .concurrent_updates(True)
+        .build()
+    )
 
     # Register command handlers
     application.add_handler(CommandHandler("help", handlers.cmd_help))
@@ -126,9 +151,14 @@ def run(config_path: str = None):
     application.add_handler(CommandHandler("cost", handlers.cmd_cost))
     application.add_handler(CommandHandler("selfupdate", handlers.cmd_selfupdate))
 
-    # Register message handler for mentions
+    # Register message handler for mentions. Only new text messages in groups or
+    # private chats can mention the bot; filter everything else (edits, service
+    # messages, media, channel posts) before it reaches Python handler code.
     application.add_handler(MessageHandler(
-        filters.ALL,
+        filters.UpdateType.MESSAGE
+        & filters.TEXT
+        & ~filters.COMMAND
+        & (filters.ChatType.GROUPS | filters.ChatType.PRIVATE),
         handlers.handle_message
     ))
 
@@ -138,8 +168,22 @@ def run(config_path: str = None):
     # Run with custom signal handling to send shutdown messages
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
+    if only_bot and process.use_pidfd_child_watcher(loop):
+        logger.info("Using pidfd child watcher for subprocesses")
 
     async def main():
+        global _request_stop
+
+        # Created up front so a stop requested during startup is not lost
+        stop_event = asyncio.Event()
+        _request_stop = lambda: loop.call_soon_threadsafe(stop_event.set)
+
+        # Signal handlers can only be installed from the main thread; when the
+        # bot runs in a thread, __main__ catches the signal and calls stop()
+        if threading.current_thread() is threading.main_thread():
+            loop.add_signal_handler(signal.SIGINT, stop_event.set)
+            loop.add_signal_handler(signal.SIGTERM, stop_event.set)
+
         async with application:
             await application.start()
             await application.updater.start_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
@@ -151,23 +195,20 @@ def run(config_path: str = None):
             await startup_projects_and_notify(application)
 
             # Wait for stop signal
-            stop_event = asyncio.Event()
-
-            def signal_handler():
-                stop_event.set()
-
-            loop.add_signal_handler(signal.SIGINT, signal_handler)
-            loop.add_signal_handler(signal.SIGTERM, signal_handler)
-
             await stop_event.wait()
 
             # Send shutdown messages before stopping
             await send_shutdown_messages(application)
 
+            # Stop the projects started by /up or at startup
+            await process.kill_all_projects()
+
             await application.updater.stop()
             await application.stop()
 
+    global _request_stop
     try:
         loop.run_until_complete(main())
     finally:
+        _request_stop = None
         loop.close()
@@ -1,18 +1,24 @@
 """Telegram command handlers for ccc bot."""
 
 import asyncio
+import functools
 import logging
 import os
+import shutil
 import subprocess
+import sys
+import time
 import uuid
+from datetime import datetime as dt
 
-from telegram import Update
+from telegram import MessageEntity, Update
 from telegram.ext import ContextTypes
 
 from ccc import config
 from ccc import claude
 from ccc import git
 from ccc import process
+from ccc.messenger import OUTPUT_LIMIT, clip_output
 from ccc.telegram.messenger import TelegramMessenger
 
 logger = logging.getLogger(__name__)
@@ -20,6 +26,10 @@ logger = logging.getLogger(__name__)
 # Global messenger instance
 _messenger = None
 
+# Last formatted /cost report as (time.monotonic() timestamp, text)
+_cost_cache = None
+COST_CACHE_TTL = 60  # Seconds a /cost report is reused before re-running claude-monitor
+
 
 def get_messenger() -> TelegramMessenger:
     """Get or create the global TelegramMessenger instance."""
@@ -29,30 +39,57 @@ def get_messenger() -> TelegramMessenger:
     return _messenger
 
 
+def get_chat_and_thread_ids(message) -> tuple[str, str | None]:
+    """Get the chat id and thread id (None outside topics) of a message as strings."""
+    chat_id = str(message.chat.id)
+    # Use 'is not None' to handle thread_id = 0 correctly
+    thread_id = str(tid) if (tid := message.message_thread_id) is not None else None
+    return chat_id, thread_id
+
+
+def _authorize(chat_id: str, username: str) -> bool:
+    """Check if the user and chat (given as string id) are authorized to use the bot."""
+    logger.info("Checking authorization for user: %s, chat_id: %s", username, chat_id)
+    return config.is_telegram_authorized(username, chat_id)
+
+
 def is_authorized(update: Update) -> bool:
     """Check if the user and chat are authorized to use the bot."""
     if not update.message or not update.message.from_user:
         return False
 
-    username = update.message.from_user.username
-    chat_id = str(update.message.chat.id)
+    return _authorize(str(update.message.chat.id), update.message.from_user.username)
+
+
+def require_auth(command: str):
+    """Decorator for command handlers that ignores updates without a message
+    and refuses users that are not authorized.
 
-    logger.info(f"Checking authorization for user: {username}, chat_id: {chat_id}")
+    Args:
+        command: Command name used in log messages
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+            if not update.message:
+                logger.info("Received /%s command with no message object", command)
+                return
 
-    user_authorized = username in config.AUTHORIZED_USERS
-    group_authorized = config.is_telegram_group_authorized(chat_id)
+            if not is_authorized(update):
+                logger.info("Unauthorized user attempted to use /%s command", command)
+                await reply(update, config.UNAUTHORIZED_REPLY)
+                return
 
-    return user_authorized and group_authorized
+            await handler(update, context)
+        return wrapper
+    return decorator
 
 
 def get_thread_key(update: Update) -> str:
     """Get the thread key for this Telegram update."""
-    message = update.message
-    chat_id = str(message.chat.id)
-    # Use 'is not None' to handle thread_id = 0 correctly
-    thread_id = str(message.message_thread_id) if message.message_thread_id is not None else None
+    chat_id, thread_id = get_chat_and_thread_ids(update.message)
     key = claude.get_thread_key_telegram(chat_id, thread_id)
-    logger.debug(f"Thread key for chat {chat_id}, thread_id {message.message_thread_id}: {key}")
+    logger.debug("Thread key for chat %s, thread_id %s: %s", chat_id, thread_id, key)
     return key
 
 
@@ -62,37 +99,12 @@ def get_thread_key_with_fallback(update: Update) -> tuple[str, dict | None]:
     Returns:
         Tuple of (thread_key, worktree_info or None)
     """
-    message = update.message
-    chat_id = str(message.chat.id)
-
-    # Primary: try with message_thread_id
-    thread_id = str(message.message_thread_id) if message.message_thread_id is not None else None
-    primary_key = claude.get_thread_key_telegram(chat_id, thread_id)
-    worktree_info = claude.get_thread_worktree(primary_key)
+    return _thread_key_with_fallback(*get_chat_and_thread_ids(update.message))
 
-    if worktree_info:
-        logger.info(f"Found thread context for key {primary_key}")
-        return primary_key, worktree_info
 
-    # Fallback 1: If we have a thread_id, try the 'main' key for the same chat
-    if thread_id:
-        fallback_key = claude.get_thread_key_telegram(chat_id, None)
-        worktree_info = claude.get_thread_worktree(fallback_key)
-        if worktree_info:
-            logger.info(f"Found thread context using fallback key {fallback_key}")
-            return fallback_key, worktree_info
-
-    # Fallback 2: If we don't have a thread_id, search for any thread in this chat
-    if not thread_id:
-        all_worktrees = claude.get_all_thread_worktrees()
-        chat_prefix = f"telegram:{chat_id}:"
-        for key, info in all_worktrees.items():
-            if key.startswith(chat_prefix):
-                logger.info(f"Found thread context for chat using key {key}")
-                return key, info
-
-    logger.info(f"No thread context found for key {primary_key}")
-    return primary_key, None
+def _thread_key_with_fallback(chat_id: str, thread_id: str | None) -> tuple[str, dict | None]:
+    """Same as get_thread_key_with_fallback, for already converted chat and thread ids."""
+    return claude.find_thread_worktree("telegram", chat_id, thread_id)
 
 
 async def reply(update: Update, text: str):
@@ -101,35 +113,34 @@ async def reply(update: Update, text: str):
     await messenger.reply(update, text)
 
 
-async def process_output_file(update, output_file: str, duration_minutes: float):
-    """Process output file and send to user with cleanup."""
-    if os.path.exists(output_file):
-        with open(output_file, 'a') as f:
-            f.write(f"\n\nExecution time: {duration_minutes:.2f} minutes")
+async def process_output_file(update, output_file: str, duration_minutes: float,
+                              missing_message: str | None = None):
+    """Process output file and send to user with cleanup.
 
-    if os.path.exists(output_file):
-        with open(output_file, 'r') as f:
-            output_content = f.read()
-
-        if output_content:
-            if len(output_content) > 4000:
-                await reply(update, output_content[:4000] + "\n\n[Output truncated...]")
-            else:
-                await reply(update, output_content)
-        else:
-            await reply(update, f"Command completed but {output_file} is empty")
-
-        os.remove(output_file)
-        logger.info(f"Cleaned up {output_file}")
+    missing_message replaces the default error if Claude did not create the file.
+    """
+    # Only OUTPUT_LIMIT characters are sent; one more is enough to know it was truncated
+    output_content = await asyncio.to_thread(claude.consume_output_file, output_file, OUTPUT_LIMIT + 1)
+
+    if output_content is None:
+        await reply(update, missing_message or f"Error: {output_file} was not created by Claude")
+    elif output_content:
+        output_content += f"\n\nExecution time: {duration_minutes:.2f} minutes"
+        await reply(update, clip_output(output_content))
     else:
-        await reply(update, f"Error: {output_file} was not created by Claude")
+        await reply(update, f"Command completed but {output_file} is empty")
 
 
 def cleanup_output_file(output_file: str):
-    """Clean up output file if it exists."""
-    if os.path.exists(output_file):
+    """Clean up output file if it exists.
+
+    Safe to call after process_output_file, which already removed it.
+    """
+    try:
         os.remove(output_file)
-        logger.info(f"Cleaned up {output_file}")
+    except FileNotFoundError:
+        return
+    logger.info("Cleaned up %s", output_file)
 
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -137,50 +148,65 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     If mentioned in a thread with an active worktree context, continue the conversation there.
     """
-    if not update.message:
+    message = update.message
+    if not message:
         logger.info("Received update with no message object")
         return
 
-    if not is_authorized(update):
-        logger.info("Unauthorized user attempted to use bot")
-        authorized_list = ", ".join(config.AUTHORIZED_USERS)
-        await reply(update, f"I only respond to {authorized_list}")
+    if not message.text:
+        logger.info("Received update with no text")
         return
 
-    message = update.message
-    if not message or not message.text:
-        logger.info("Received update with no text")
+    # Most group traffic is not addressed to the bot. A mention needs an "@" in
+    # the text or a text_mention entity, so skip everything else before authorizing
+    if "@" not in message.text and not message.entities:
+        logger.debug("Ignoring message without mentions")
         return
 
-    bot_username = f"@{context.bot.username}"
+    # Convert ids once; they are needed for both authorization and thread lookup
+    chat_id, thread_id = get_chat_and_thread_ids(message)
 
-    logger.info(f"Chat type: {message.chat.type}")
-    logger.info(f"Message from: {message.from_user.username}")
-    logger.info(f"Message text: {message.text}")
-    logger.info(f"Bot username: {bot_username}")
+    if not message.from_user or not _authorize(chat_id, message.from_user.username):
+        logger.debug("Unauthorized user attempted to use bot")
+        await reply(update, config.UNAUTHORIZED_REPLY)
+        return
+
+    # The bot's username never changes while running, so format it once
+    bot_data = context.bot_data
+    bot_username = bot_data.get("bot_username")
+    if bot_username is None:
+        bot_username = bot_data["bot_username"] = f"@{context.bot.username}"
+        bot_data["bot_username_lower"] = bot_username.lower()
+
+    logger.info("Chat type: %s", message.chat.type)
+    logger.info("Message from: %s", message.from_user.username)
+    logger.info("Message text: %s", message.text)
+    logger.info("Bot username: %s", bot_username)
 
     is_mentioned = False
 
     if message.entities:
         for entity in message.entities:
-            if entity.type == "mention":
+            # PTB converts known entity types to MessageEntityType members, so compare identity
+            if entity.type is MessageEntity.MENTION:
                 mentioned_text = message.text[entity.offset:entity.offset + entity.length]
-                logger.info(f"Found mention: {mentioned_text}")
+                logger.info("Found mention: %s", mentioned_text)
                 if mentioned_text == bot_username:
                     is_mentioned = True
                     break
-            elif entity.type == "text_mention":
+            elif entity.type is MessageEntity.TEXT_MENTION:
                 if entity.user and entity.user.id == context.bot.id:
                     is_mentioned = True
                     break
 
-    if not is_mentioned and bot_username.lower() in message.text.lower():
+    # Without an "@" there is nothing to match, so skip lowercasing the whole text
+    if not is_mentioned and "@" in message.text and bot_data["bot_username_lower"] in message.text.lower():
         is_mentioned = True
         logger.info("Found bot username in text (case insensitive)")
 
     if is_mentioned:
         text_without_mention = message.text.replace(bot_username, "").strip()
-        logger.info(f"Bot was mentioned!")
+        logger.info("Bot was mentioned!")
 
         # Skip if it's a command (starts with /)
         if text_without_mention.startswith('/'):
@@ -192,7 +218,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             return
 
         # Check if this thread has an active worktree context
-        thread_key, worktree_info = get_thread_key_with_fallback(update)
+        thread_key, worktree_info = _thread_key_with_fallback(chat_id, thread_id)
 
         if worktree_info:
             # Continue conversation in the worktree context
@@ -202,7 +228,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             messenger = get_messenger()
             await _ask_casual(update, messenger, text_without_mention)
 
-        logger.info(f"Reply sent!")
+        logger.info("Reply sent!")
     else:
         logger.info("Bot was not mentioned in this message")
 
@@ -216,23 +242,34 @@ async def _continue_in_worktree(update: Update, user_text: str, worktree_info: d
     project_name = worktree_info["project_name"]
     project_repo = worktree_info["project_repo"]
     existing_session = worktree_info.get("session_id")
+    # Records created before "kind" existed are classified by their query_id prefix
+    kind = worktree_info.get("kind")
+    if kind is None:
+        if query_id.startswith("casual-") or project_name == "_casual":
+            kind = "casual"
+        elif query_id.startswith("up-"):
+            kind = "up"
 
     # Check if this is a casual conversation context
-    if query_id.startswith("casual-") or project_name == "_casual":
-        logger.info(f"Continuing casual conversation with session {existing_session}")
+    if kind == "casual":
+        logger.info("Continuing casual conversation with session %s", existing_session)
         await _ask_casual(update, messenger, user_text, existing_session)
         return
 
-    logger.info(f"Continuing in worktree {query_id} for project {project_name}")
+    logger.info("Continuing in worktree %s for project %s", query_id, project_name)
 
     # Check if this is from /up command (pseudo worktree) or if worktree doesn't exist
-    is_up_context = query_id.startswith("up-")
+    is_up_context = kind == "up"
     worktree_exists = worktree_path and os.path.isdir(worktree_path)
 
     if is_up_context or not worktree_exists:
         # Need to create a proper worktree for continuation
-        logger.info(f"Worktree doesn't exist or is /up context, creating new worktree")
-        query_id = str(uuid.uuid4())[:8]
+        logger.info("Worktree doesn't exist or is /up context, creating new worktree")
+        query_id = claude.new_query_id()
+        # Wait for a query slot first so a queued query does not hold a worktree
+        if not await claude.reserve_query_slot(messenger, update, query_id, thread_key, project_name, "continue", user_text):
+            await reply(update, f"Query {query_id} for {project_name} was cancelled.")
+            return
         worktree_path = await git.create_worktree(messenger, update, project_workdir, project_name, query_id)
         if not worktree_path:
             await reply(update, f"Failed to create worktree for continuation in {project_name}")
@@ -242,24 +279,19 @@ async def _continue_in_worktree(update: Update, user_text: str, worktree_info: d
 
     await reply(update, f"Continuing with query {query_id} for {project_name}...")
 
-    output_file = f"/tmp/output_{query_id}_cont_{str(uuid.uuid4())[:4]}.txt"
+    output_file = os.path.join(config.OUTPUT_DIR, f"output_{query_id}_cont_{uuid.uuid4().hex[:4]}.txt")
 
     try:
-        prompt = f"""Project: {project_name}
-Repository: {project_repo}
-Working Directory: {worktree_path}
-
-Task: {user_text}
+        prompt = claude.build_project_prompt(project_name, project_repo, worktree_path, user_text, output_file)
 
-Write the output in {output_file}"""
-
-        logger.info(f"Running continuation query in worktree {query_id}")
+        logger.info("Running continuation query in worktree %s", query_id)
 
         duration_minutes, session_id = await claude.run_claude_query(
             prompt, config.FEEDBACK_RULES, worktree_path,
             resume=existing_session, project_name=project_name, command="continue", user_prompt=user_text,
             worktree_path=worktree_path, project_workdir=project_workdir, query_id=query_id,
-            keep_worktree=True
+            keep_worktree=True,
+            thread_key=thread_key
         )
 
         # Update thread worktree association with new info
@@ -271,15 +303,16 @@ Write the output in {output_file}"""
         await process_output_file(update, output_file, duration_minutes)
 
     except asyncio.CancelledError:
-        logger.info(f"Continuation query in worktree {query_id} was cancelled")
+        logger.info("Continuation query in worktree %s was cancelled", query_id)
         await reply(update, f"Query in {project_name} was cancelled.")
-        cleanup_output_file(output_file)
     except Exception as e:
-        logger.error(f"Error running continuation query: {e}")
+        logger.error("Error running continuation query: %s", e)
         await reply(update, f"Error: {str(e)}")
+    finally:
         cleanup_output_file(output_file)
 
 
+@require_auth("ask")
 async def cmd_ask(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /ask command. Format: /ask [project-name] query
 
@@ -288,34 +321,26 @@ async def cmd_ask(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     messenger = get_messenger()
 
-    if not update.message:
-        logger.info("Received /ask command with no message object")
-        return
-
-    if not is_authorized(update):
-        logger.info("Unauthorized user attempted to use /ask command")
-        authorized_list = ", ".join(config.AUTHORIZED_USERS)
-        await reply(update, f"I only respond to {authorized_list}")
-        return
-
     logger.info("Received /ask command")
 
-    if not context.args or len(context.args) < 1:
+    args = context.args or ()
+
+    if not args:
         await reply(update, "Usage: /ask [project-name] query\n\nWith project-name: Ask about a specific project\nWithout project-name: Casual conversation with the agent")
         return
 
     # Check if first arg is a project name
-    potential_project = context.args[0]
+    potential_project = args[0]
     project = config.get_project(potential_project)
 
-    if project and len(context.args) >= 2:
+    if project and len(args) >= 2:
         # Project-specific query
         project_name = potential_project
-        user_text = " ".join(context.args[1:])
+        user_text = " ".join(args[1:])
         await _ask_project(update, messenger, project_name, project, user_text)
     else:
         # Casual conversation (no project context)
-        user_text = " ".join(context.args)
+        user_text = " ".join(args)
         await _ask_casual(update, messenger, user_text)
 
 
@@ -324,22 +349,23 @@ async def _ask_project(update: Update, messenger, project_name: str, project: di
     project_repo = project['project_repo']
     project_workdir = project['project_workdir']
 
-    if not await git.clone_repository_if_needed(messenger, update, project_repo, project_workdir):
-        return
-
-    if not await claude.initialize_claude_md(messenger, update, project_workdir):
+    if not await claude.ensure_project_ready(messenger, update, project_repo, project_workdir):
         return
 
     # Get and validate thread key BEFORE creating worktree
     thread_key = get_thread_key(update)
     is_valid, error = claude.validate_thread_key(thread_key)
     if not is_valid:
-        logger.error(f"Invalid thread key for /ask: {error}")
+        logger.error("Invalid thread key for /ask: %s", error)
         await reply(update, f"Error: Cannot determine thread context. {error}")
         return
 
     # Generate query ID and create worktree
-    query_id = str(uuid.uuid4())[:8]
+    query_id = claude.new_query_id()
+    # Wait for a query slot first so a queued query does not hold a worktree
+    if not await claude.reserve_query_slot(messenger, update, query_id, thread_key, project_name, "ask", user_text):
+        await reply(update, f"Query {query_id} for {project_name} was cancelled.")
+        return
     worktree_path = await git.create_worktree(messenger, update, project_workdir, project_name, query_id)
     if not worktree_path:
         return
@@ -350,32 +376,27 @@ async def _ask_project(update: Update, messenger, project_name: str, project: di
             thread_key, query_id, None,  # session_id is None initially
             worktree_path, project_workdir, project_name, project_repo
         )
-        logger.info(f"Pre-registered thread {thread_key} with worktree {query_id}")
+        logger.info("Pre-registered thread %s with worktree %s", thread_key, query_id)
     except ValueError as e:
-        logger.error(f"Failed to associate thread with worktree: {e}")
+        logger.error("Failed to associate thread with worktree: %s", e)
         await reply(update, f"Error: Failed to set up thread context. {str(e)}")
         return
 
     await reply(update, f"Processing for project: {project_name} (query: {query_id}, thread: {thread_key})...")
 
-    output_file = f"/tmp/output_{query_id}.txt"
+    output_file = os.path.join(config.OUTPUT_DIR, f"output_{query_id}.txt")
 
     try:
-        prompt = f"""Project: {project_name}
-Repository: {project_repo}
-Working Directory: {worktree_path}
-
-Query: {user_text}
-
-Write the output in {output_file}"""
+        prompt = claude.build_project_prompt(project_name, project_repo, worktree_path, user_text, output_file, label="Query")
 
-        logger.info(f"Running query {query_id} for project {project_name} in thread {thread_key}")
+        logger.info("Running query %s for project %s in thread %s", query_id, project_name, thread_key)
 
         duration_minutes, session_id = await claude.run_claude_query(
             prompt, config.ASK_RULES, worktree_path,
             project_name=project_name, command="ask", user_prompt=user_text,
             worktree_path=worktree_path, project_workdir=project_workdir, query_id=query_id,
-            keep_worktree=True  # Keep for thread context
+            keep_worktree=True,  # Keep for thread context
+            thread_key=thread_key
         )
 
         # Update thread-worktree association with session_id
@@ -384,24 +405,24 @@ Write the output in {output_file}"""
         await process_output_file(update, output_file, duration_minutes)
 
     except asyncio.CancelledError:
-        logger.info(f"Query {query_id} for project {project_name} was cancelled")
+        logger.info("Query %s for project %s was cancelled", query_id, project_name)
         await reply(update, f"Query {query_id} for {project_name} was cancelled.")
-        cleanup_output_file(output_file)
     except Exception as e:
-        logger.error(f"Error running query: {e}")
+        logger.error("Error running query: %s", e)
         await reply(update, f"Error: {str(e)}")
+    finally:
         cleanup_output_file(output_file)
 
 
 async def _ask_casual(update: Update, messenger, user_text: str, existing_session: str = None) -> None:
     """Handle casual conversation /ask query (no project context)."""
-    query_id = str(uuid.uuid4())[:8]
+    query_id = claude.new_query_id()
 
     # Get and validate thread key
     thread_key = get_thread_key(update)
     is_valid, error = claude.validate_thread_key(thread_key)
     if not is_valid:
-        logger.error(f"Invalid thread key for casual /ask: {error}")
+        logger.error("Invalid thread key for casual /ask: %s", error)
         await reply(update, f"Error: Cannot determine thread context. {error}")
         return
 
@@ -409,11 +430,12 @@ async def _ask_casual(update: Update, messenger, user_text: str, existing_sessio
     try:
         claude.set_thread_worktree(
             thread_key, f"casual-{query_id}", None,  # session_id is None initially
-            None, None, "_casual", None  # No worktree for casual queries
+            None, None, "_casual", None,  # No worktree for casual queries
+            kind="casual"
         )
-        logger.info(f"Pre-registered thread {thread_key} for casual query {query_id}")
+        logger.info("Pre-registered thread %s for casual query %s", thread_key, query_id)
     except ValueError as e:
-        logger.error(f"Failed to set up thread context: {e}")
+        logger.error("Failed to set up thread context: %s", e)
         await reply(update, f"Error: Failed to set up thread context. {str(e)}")
         return
 
@@ -422,19 +444,16 @@ async def _ask_casual(update: Update, messenger, user_text: str, existing_sessio
     else:
         await reply(update, f"Processing casual query (query: {query_id}, thread: {thread_key})...")
 
-    output_file = f"/tmp/output_{query_id}.txt"
+    output_file = os.path.join(config.OUTPUT_DIR, f"output_{query_id}.txt")
 
     # Use a temporary directory for casual queries
     cwd = "/tmp"
 
     try:
-        prompt = f"""You are a helpful assistant. Please respond to the following query.
-
-Query: {user_text}
-
-IMPORTANT: Write your complete response to the file {output_file}. Use the Write tool to create this file with your response."""
+        prompt = claude.build_casual_prompt(user_text, output_file)
 
-        logger.info(f"Running casual query {query_id} in thread {thread_key}" + (f" (resuming session {existing_session})" if existing_session else ""))
+        logger.info("Running casual query %s in thread %s%s", query_id, thread_key,
+                    f" (resuming session {existing_session})" if existing_session else "")
 
         # Use GENERAL_RULES for casual queries, fall back to empty string
         system_prompt = config.GENERAL_RULES if config.GENERAL_RULES else ""
@@ -443,176 +462,63 @@ IMPORTANT: Write your complete response to the file {output_file}. Use the Write
             prompt, system_prompt, cwd,
             resume=existing_session,
             project_name="_casual", command="ask", user_prompt=user_text,
-            query_id=query_id
+            query_id=query_id,
+            thread_key=thread_key
         )
 
         # Update thread context with session_id
         claude.update_thread_session(thread_key, session_id)
 
-        # Check if output file exists, provide fallback message if not
-        if os.path.exists(output_file):
-            await process_output_file(update, output_file, duration_minutes)
-        else:
-            await reply(update, f"Query completed in {duration_minutes:.2f} minutes, but no output file was generated. The assistant may have responded directly in the logs.")
+        # Provide a fallback message if Claude did not write the output file
+        await process_output_file(update, output_file, duration_minutes,
+            missing_message=f"Query completed in {duration_minutes:.2f} minutes, but no output file was generated. The assistant may have responded directly in the logs.")
 
     except asyncio.CancelledError:
-        logger.info(f"Casual query {query_id} was cancelled")
+        logger.info("Casual query %s was cancelled", query_id)
         await reply(update, f"Query {query_id} was cancelled.")
-        cleanup_output_file(output_file)
     except Exception as e:
-        logger.error(f"Error running casual query: {e}")
+        logger.error("Error running casual query: %s", e)
         await reply(update, f"Error: {str(e)}")
+    finally:
         cleanup_output_file(output_file)
 
 
-async def cmd_feat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle /feat command. Format: /feat project-name prompt"""
-    messenger = get_messenger()
-
-    if not update.message:
-        logger.info("Received /feat command with no message object")
-        return
-
-    if not is_authorized(update):
-        logger.info("Unauthorized user attempted to use /feat command")
-        authorized_list = ", ".join(config.AUTHORIZED_USERS)
-        await reply(update, f"I only respond to {authorized_list}")
-        return
-
-    logger.info("Received /feat command")
-
-    if not context.args or len(context.args) < 2:
-        await reply(update, "Usage: /feat project-name prompt")
-        return
-
-    project_name = context.args[0]
-    user_prompt = " ".join(context.args[1:])
-
-    project = config.get_project(project_name)
-    if not project:
-        await reply(update, f"Project '{project_name}' not found. Available projects: {config.get_available_projects()}")
-        return
-
-    project_repo = project['project_repo']
-    project_workdir = project['project_workdir']
-
-    if not await git.clone_repository_if_needed(messenger, update, project_repo, project_workdir):
-        return
-
-    if not await claude.initialize_claude_md(messenger, update, project_workdir):
-        return
-
-    # Clear existing session for this project (starting fresh)
-    claude.clear_session(project_name)
-
-    # Get and validate thread key BEFORE creating worktree
-    thread_key = get_thread_key(update)
-    is_valid, error = claude.validate_thread_key(thread_key)
-    if not is_valid:
-        logger.error(f"Invalid thread key for /feat: {error}")
-        await reply(update, f"Error: Cannot determine thread context. {error}")
-        return
-
-    # Generate query ID and create worktree (starts from origin/main)
-    query_id = str(uuid.uuid4())[:8]
-    worktree_path = await git.create_worktree(messenger, update, project_workdir, project_name, query_id)
-    if not worktree_path:
-        return
-
-    # Associate thread with worktree BEFORE calling Claude
-    try:
-        claude.set_thread_worktree(
-            thread_key, query_id, None,  # session_id is None initially
-            worktree_path, project_workdir, project_name, project_repo
-        )
-        logger.info(f"Pre-registered thread {thread_key} with worktree {query_id}")
-    except ValueError as e:
-        logger.error(f"Failed to associate thread with worktree: {e}")
-        await reply(update, f"Error: Failed to set up thread context. {str(e)}")
-        return
-
-    await reply(update, f"Processing for project: {project_name} (query: {query_id}, thread: {thread_key})...")
-
-    output_file = f"/tmp/output_{query_id}.txt"
-
-    try:
-        prompt = f"""Project: {project_name}
-Repository: {project_repo}
-Working Directory: {worktree_path}
-
-Task: {user_prompt}
-
-Write the output in {output_file}"""
-
-        logger.info(f"Running query {query_id} for project {project_name} in thread {thread_key}")
-
-        duration_minutes, session_id = await claude.run_claude_query(
-            prompt, config.FEAT_RULES, worktree_path,
-            project_name=project_name, command="feat", user_prompt=user_prompt,
-            worktree_path=worktree_path, project_workdir=project_workdir, query_id=query_id,
-            keep_worktree=True  # Keep worktree for potential feedback
-        )
-
-        # Store session for future /feedback commands
-        claude.set_session(project_name, session_id)
-
-        # Update thread-worktree association with session_id
-        claude.update_thread_session(thread_key, session_id)
-
-        await process_output_file(update, output_file, duration_minutes)
-
-        # Auto spin-up project on the current branch if configured
-        project_up = project.get('project_up')
-        if project_up:
-            project_endpoint_url = project.get('project_endpoint_url')
-            project_ports = project.get('project_ports')
-            await process.spin_up_project(messenger, update, project_name, worktree_path, project_up, project_endpoint_url, project_ports)
-
-    except asyncio.CancelledError:
-        logger.info(f"Query {query_id} for project {project_name} was cancelled")
-        await reply(update, f"Query {query_id} for {project_name} was cancelled.")
-        cleanup_output_file(output_file)
-    except Exception as e:
-        logger.error(f"Error running query: {e}")
-        await reply(update, f"Error: {str(e)}")
-        cleanup_output_file(output_file)
+async def _run_project_command(update: Update, context: ContextTypes.DEFAULT_TYPE, command: str, rules: str,
+                               verb: str = "Processing") -> None:
+    """Run a /feat, /fix or /plan style command. Format: /<command> project-name prompt
 
+    Starts a fresh session in a new worktree, replies with the output and
+    spins the project up if configured.
 
-async def cmd_fix(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle /fix command. Format: /fix project-name prompt"""
+    Args:
+        update: Telegram Update object
+        context: Handler context
+        command: Command name, without the slash
+        rules: System prompt for the query
+        verb: Word used in the progress message
+    """
     messenger = get_messenger()
 
-    if not update.message:
-        logger.info("Received /fix command with no message object")
-        return
-
-    if not is_authorized(update):
-        logger.info("Unauthorized user attempted to use /fix command")
-        authorized_list = ", ".join(config.AUTHORIZED_USERS)
-        await reply(update, f"I only respond to {authorized_list}")
-        return
+    logger.info("Received /%s command", command)
 
-    logger.info("Received /fix command")
+    args = context.args or ()
 
-    if not context.args or len(context.args) < 2:
-        await reply(update, "Usage: /fix project-name prompt")
+    if len(args) < 2:
+        await reply(update, f"Usage: /{command} project-name prompt")
         return
 
-    project_name = context.args[0]
-    user_prompt = " ".join(context.args[1:])
+    project_name = args[0]
+    user_prompt = " ".join(args[1:])
 
     project = config.get_project(project_name)
     if not project:
-        await reply(update, f"Project '{project_name}' not found. Available projects: {config.get_available_projects()}")
+        await reply(update, config.project_not_found_message(project_name))
         return
 
     project_repo = project['project_repo']
     project_workdir = project['project_workdir']
 
-    if not await git.clone_repository_if_needed(messenger, update, project_repo, project_workdir):
-        return
-
-    if not await claude.initialize_claude_md(messenger, update, project_workdir):
+    if not await claude.ensure_project_ready(messenger, update, project_repo, project_workdir):
         return
 
     # Clear existing session for this project (starting fresh)
@@ -622,12 +528,16 @@ async def cmd_fix(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     thread_key = get_thread_key(update)
     is_valid, error = claude.validate_thread_key(thread_key)
     if not is_valid:
-        logger.error(f"Invalid thread key for /fix: {error}")
+        logger.error("Invalid thread key for /%s: %s", command, error)
         await reply(update, f"Error: Cannot determine thread context. {error}")
         return
 
     # Generate query ID and create worktree (starts from origin/main)
-    query_id = str(uuid.uuid4())[:8]
+    query_id = claude.new_query_id()
+    # Wait for a query slot first so a queued query does not hold a worktree
+    if not await claude.reserve_query_slot(messenger, update, query_id, thread_key, project_name, command, user_prompt):
+        await reply(update, f"Query {query_id} for {project_name} was cancelled.")
+        return
     worktree_path = await git.create_worktree(messenger, update, project_workdir, project_name, query_id)
     if not worktree_path:
         return
@@ -638,32 +548,27 @@ async def cmd_fix(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             thread_key, query_id, None,  # session_id is None initially
             worktree_path, project_workdir, project_name, project_repo
         )
-        logger.info(f"Pre-registered thread {thread_key} with worktree {query_id}")
+        logger.info("Pre-registered thread %s with worktree %s", thread_key, query_id)
     except ValueError as e:
-        logger.error(f"Failed to associate thread with worktree: {e}")
+        logger.error("Failed to associate thread with worktree: %s", e)
         await reply(update, f"Error: Failed to set up thread context. {str(e)}")
         return
 
-    await reply(update, f"Processing for project: {project_name} (query: {query_id}, thread: {thread_key})...")
+    await reply(update, f"{verb} for project: {project_name} (query: {query_id}, thread: {thread_key})...")
 
-    output_file = f"/tmp/output_{query_id}.txt"
+    output_file = os.path.join(config.OUTPUT_DIR, f"output_{query_id}.txt")
 
     try:
-        prompt = f"""Project: {project_name}
-Repository: {project_repo}
-Working Directory: {worktree_path}
-
-Task: {user_prompt}
+        prompt = claude.build_project_prompt(project_name, project_repo, worktree_path, user_prompt, output_file)
 
-Write the output in {output_file}"""
-
-        logger.info(f"Running query {query_id} for project {project_name} in thread {thread_key}")
+        logger.info("Running query %s for project %s in thread %s", query_id, project_name, thread_key)
 
         duration_minutes, session_id = await claude.run_claude_query(
-            prompt, config.FIX_RULES, worktree_path,
-            project_name=project_name, command="fix", user_prompt=user_prompt,
+            prompt, rules, worktree_path,
+            project_name=project_name, command=command, user_prompt=user_prompt,
             worktree_path=worktree_path, project_workdir=project_workdir, query_id=query_id,
-            keep_worktree=True  # Keep worktree for potential feedback
+            keep_worktree=True,  # Keep worktree for potential feedback
+            thread_key=thread_key
         )
 
         # Store session for future /feedback commands
@@ -682,128 +587,34 @@ Write the output in {output_file}"""
             await process.spin_up_project(messenger, update, project_name, worktree_path, project_up, project_endpoint_url, project_ports)
 
     except asyncio.CancelledError:
-        logger.info(f"Query {query_id} for project {project_name} was cancelled")
+        logger.info("Query %s for project %s was cancelled", query_id, project_name)
         await reply(update, f"Query {query_id} for {project_name} was cancelled.")
-        cleanup_output_file(output_file)
     except Exception as e:
-        logger.error(f"Error running query: {e}")
+        logger.error("Error running query: %s", e)
         await reply(update, f"Error: {str(e)}")
+    finally:
         cleanup_output_file(output_file)
 
 
-async def cmd_plan(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle /plan command. Format: /plan project-name prompt"""
-    messenger = get_messenger()
-
-    if not update.message:
-        logger.info("Received /plan command with no message object")
-        return
-
-    if not is_authorized(update):
-        logger.info("Unauthorized user attempted to use /plan command")
-        authorized_list = ", ".join(config.AUTHORIZED_USERS)
-        await reply(update, f"I only respond to {authorized_list}")
-        return
-
-    logger.info("Received /plan command")
-
-    if not context.args or len(context.args) < 2:
-        await reply(update, "Usage: /plan project-name prompt")
-        return
-
-    project_name = context.args[0]
-    user_prompt = " ".join(context.args[1:])
-
-    project = config.get_project(project_name)
-    if not project:
-        await reply(update, f"Project '{project_name}' not found. Available projects: {config.get_available_projects()}")
-        return
-
-    project_repo = project['project_repo']
-    project_workdir = project['project_workdir']
-
-    if not await git.clone_repository_if_needed(messenger, update, project_repo, project_workdir):
-        return
-
-    if not await claude.initialize_claude_md(messenger, update, project_workdir):
-        return
-
-    # Clear existing session for this project (starting fresh)
-    claude.clear_session(project_name)
-
-    # Get and validate thread key BEFORE creating worktree
-    thread_key = get_thread_key(update)
-    is_valid, error = claude.validate_thread_key(thread_key)
-    if not is_valid:
-        logger.error(f"Invalid thread key for /plan: {error}")
-        await reply(update, f"Error: Cannot determine thread context. {error}")
-        return
-
-    # Generate query ID and create worktree (starts from origin/main)
-    query_id = str(uuid.uuid4())[:8]
-    worktree_path = await git.create_worktree(messenger, update, project_workdir, project_name, query_id)
-    if not worktree_path:
-        return
-
-    # Associate thread with worktree BEFORE calling Claude
-    try:
-        claude.set_thread_worktree(
-            thread_key, query_id, None,  # session_id is None initially
-            worktree_path, project_workdir, project_name, project_repo
-        )
-        logger.info(f"Pre-registered thread {thread_key} with worktree {query_id}")
-    except ValueError as e:
-        logger.error(f"Failed to associate thread with worktree: {e}")
-        await reply(update, f"Error: Failed to set up thread context. {str(e)}")
-        return
-
-    await reply(update, f"Planning for project: {project_name} (query: {query_id}, thread: {thread_key})...")
-
-    output_file = f"/tmp/output_{query_id}.txt"
-
-    try:
-        prompt = f"""Project: {project_name}
-Repository: {project_repo}
-Working Directory: {worktree_path}
-
-Task: {user_prompt}
-
-Write the output in {output_file}"""
-
-        logger.info(f"Running query {query_id} for project {project_name} in thread {thread_key}")
-
-        duration_minutes, session_id = await claude.run_claude_query(
-            prompt, config.PLAN_RULES, worktree_path,
-            project_name=project_name, command="plan", user_prompt=user_prompt,
-            worktree_path=worktree_path, project_workdir=project_workdir, query_id=query_id,
-            keep_worktree=True  # Keep worktree for potential feedback
-        )
-
-        # Store session for future /feedback commands
-        claude.set_session(project_name, session_id)
+@require_auth("feat")
+async def cmd_feat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle /feat command. Format: /feat project-name prompt"""
+    await _run_project_command(update, context, "feat", config.FEAT_RULES)
 
-        # Update thread-worktree association with session_id
-        claude.update_thread_session(thread_key, session_id)
 
-        await process_output_file(update, output_file, duration_minutes)
+@require_auth("fix")
+async def cmd_fix(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle /fix command. Format: /fix project-name prompt"""
+    await _run_project_command(update, context, "fix", config.FIX_RULES)
 
-        # Auto spin-up project on the current branch if configured
-        project_up = project.get('project_up')
-        if project_up:
-            project_endpoint_url = project.get('project_endpoint_url')
-            project_ports = project.get('project_ports')
-            await process.spin_up_project(messenger, update, project_name, worktree_path, project_up, project_endpoint_url, project_ports)
 
-    except asyncio.CancelledError:
-        logger.info(f"Query {query_id} for project {project_name} was cancelled")
-        await reply(update, f"Query {query_id} for {project_name} was cancelled.")
-        cleanup_output_file(output_file)
-    except Exception as e:
-        logger.error(f"Error running query: {e}")
-        await reply(update, f"Error: {str(e)}")
-        cleanup_output_file(output_file)
+@require_auth("plan")
+async def cmd_plan(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle /plan command. Format: /plan project-name prompt"""
+    await _run_project_command(update, context, "plan", config.PLAN_RULES, verb="Planning")
 
 
+@require_auth("feedback")
 async def cmd_feedback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /feedback command. Format: /feedback [project-name] [job-id] prompt
 
@@ -811,19 +622,11 @@ async def cmd_feedback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     """
     messenger = get_messenger()
 
-    if not update.message:
-        logger.info("Received /feedback command with no message object")
-        return
-
-    if not is_authorized(update):
-        logger.info("Unauthorized user attempted to use /feedback command")
-        authorized_list = ", ".join(config.AUTHORIZED_USERS)
-        await reply(update, f"I only respond to {authorized_list}")
-        return
-
     logger.info("Received /feedback command")
 
-    if not context.args or len(context.args) < 1:
+    args = context.args or ()
+
+    if not args:
         await reply(update, "Usage: /feedback [project-name] [job-id] prompt\n\nUse /status to see available job IDs.")
         return
 
@@ -837,10 +640,10 @@ async def cmd_feedback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     args_index = 0
 
     # Check if first arg is a project name
-    first_arg = context.args[0]
-    if config.get_project(first_arg):
+    first_arg = args[0]
+    project = config.get_project(first_arg)
+    if project:
         project_name = first_arg
-        project = config.get_project(project_name)
         args_index = 1
     elif worktree_info:
         # Use thread context for project
@@ -851,14 +654,14 @@ async def cmd_feedback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         return
 
     if not project:
-        await reply(update, f"Project '{project_name}' not found. Available projects: {config.get_available_projects()}")
+        await reply(update, config.project_not_found_message(project_name))
         return
 
     project_repo = project['project_repo']
     project_workdir = project['project_workdir']
 
     # Check remaining args for job-id and prompt
-    remaining_args = context.args[args_index:]
+    remaining_args = args[args_index:]
     if remaining_args:
         potential_job_id = remaining_args[0]
         if len(potential_job_id) == 8 and claude.get_completed_job(potential_job_id):
@@ -873,10 +676,7 @@ async def cmd_feedback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         await reply(update, "Usage: /feedback [project-name] [job-id] prompt\n\nPlease provide feedback text.")
         return
 
-    if not await git.clone_repository_if_needed(messenger, update, project_repo, project_workdir):
-        return
-
-    if not await claude.initialize_claude_md(messenger, update, project_workdir):
+    if not await claude.ensure_project_ready(messenger, update, project_repo, project_workdir):
         return
 
     # Determine worktree and session
@@ -895,8 +695,8 @@ async def cmd_feedback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         existing_session = job_info.get("session_id")
         query_id = job_id
 
-        logger.info(f"Resuming job {job_id} with session {existing_session} in worktree {worktree_path}")
-        await reply(update, f"Continuing job {job_id} for project: {project_name}...")
+        logger.info("Resuming job %s with session %s in worktree %s", job_id, existing_session, worktree_path)
+        startup_msg = f"Continuing job {job_id} for project: {project_name}..."
 
         del claude.COMPLETED_JOBS[job_id]
     elif worktree_info and worktree_info.get("project_name") == project_name:
@@ -905,44 +705,45 @@ async def cmd_feedback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         existing_session = worktree_info.get("session_id")
         query_id = worktree_info.get("query_id")
 
-        logger.info(f"Using thread worktree {query_id} with session {existing_session}")
-        await reply(update, f"Continuing with query {query_id} for project: {project_name}...")
+        logger.info("Using thread worktree %s with session %s", query_id, existing_session)
+        startup_msg = f"Continuing with query {query_id} for project: {project_name}..."
     else:
         # Create new worktree
         existing_session = claude.get_session(project_name)
         if existing_session:
-            logger.info(f"Resuming session {existing_session} for project {project_name}")
+            logger.info("Resuming session %s for project %s", existing_session, project_name)
         else:
-            logger.info(f"No existing session for project {project_name}, starting fresh")
+            logger.info("No existing session for project %s, starting fresh", project_name)
 
-        query_id = str(uuid.uuid4())[:8]
+        query_id = claude.new_query_id()
+        # Wait for a query slot first so a queued query does not hold a worktree
+        if not await claude.reserve_query_slot(messenger, update, query_id, thread_key, project_name, "feedback", user_prompt):
+            await reply(update, f"Query {query_id} for {project_name} was cancelled.")
+            return
         worktree_path = await git.create_worktree(messenger, update, project_workdir, project_name, query_id)
         if not worktree_path:
             return
 
         if existing_session:
-            await reply(update, f"Continuing session for project: {project_name} (query: {query_id})...")
+            startup_msg = f"Continuing session for project: {project_name} (query: {query_id})..."
         else:
-            await reply(update, f"No existing session found. Starting new session for project: {project_name} (query: {query_id})...")
-
-    output_file = f"/tmp/output_{query_id}.txt"
+            startup_msg = f"No existing session found. Starting new session for project: {project_name} (query: {query_id})..."
 
-    try:
-        prompt = f"""Project: {project_name}
-Repository: {project_repo}
-Working Directory: {worktree_path}
+    await reply(update, startup_msg)
 
-Task: {user_prompt}
+    output_file = os.path.join(config.OUTPUT_DIR, f"output_{query_id}.txt")
 
-Write the output in {output_file}"""
+    try:
+        prompt = claude.build_project_prompt(project_name, project_repo, worktree_path, user_prompt, output_file)
 
-        logger.info(f"Running query {query_id} for project {project_name}")
+        logger.info("Running query %s for project %s", query_id, project_name)
 
         duration_minutes, session_id = await claude.run_claude_query(
             prompt, config.FEEDBACK_RULES, worktree_path,
             resume=existing_session, project_name=project_name, command="feedback", user_prompt=user_prompt,
             worktree_path=worktree_path, project_workdir=project_workdir, query_id=query_id,
-            keep_worktree=True
+            keep_worktree=True,
+            thread_key=thread_key
         )
 
         # Update session for future commands
@@ -957,40 +758,33 @@ Write the output in {output_file}"""
         await process_output_file(update, output_file, duration_minutes)
 
     except asyncio.CancelledError:
-        logger.info(f"Query {query_id} for project {project_name} was cancelled")
+        logger.info("Query %s for project %s was cancelled", query_id, project_name)
         await reply(update, f"Query {query_id} for {project_name} was cancelled.")
-        cleanup_output_file(output_file)
     except Exception as e:
-        logger.error(f"Error running query: {e}")
+        logger.error("Error running query: %s", e)
         await reply(update, f"Error: {str(e)}")
+    finally:
         cleanup_output_file(output_file)
 
 
+@require_auth("init")
 async def cmd_init(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /init command. Format: /init project-name"""
     messenger = get_messenger()
 
-    if not update.message:
-        logger.info("Received /init command with no message object")
-        return
-
-    if not is_authorized(update):
-        logger.info("Unauthorized user attempted to use /init command")
-        authorized_list = ", ".join(config.AUTHORIZED_USERS)
-        await reply(update, f"I only respond to {authorized_list}")
-        return
-
     logger.info("Received /init command")
 
-    if not context.args or len(context.args) < 1:
+    args = context.args or ()
+
+    if not args:
         await reply(update, "Usage: /init project-name")
         return
 
-    project_name = context.args[0]
+    project_name = args[0]
 
     project = config.get_project(project_name)
     if not project:
-        await reply(update, f"Project '{project_name}' not found. Available projects: {config.get_available_projects()}")
+        await reply(update, config.project_not_found_message(project_name))
         return
 
     project_repo = project['project_repo']
@@ -999,10 +793,19 @@ async def cmd_init(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     project_endpoint_url = project.get('project_endpoint_url')
     project_ports = project.get('project_ports')
 
-    if not await git.clone_repository_if_needed(messenger, update, project_repo, project_workdir):
-        return
+    # /init always re-checks the project on disk
+    claude.invalidate_project(project_workdir)
 
-    init_success = await claude.initialize_claude_md(messenger, update, project_workdir)
+    # CLAUDE.md generation and the refresh below both reset and clean the main
+    # checkout, so they run one after the other rather than concurrently
+    async with git.checkout_lock(project_workdir):
+        if not await git.clone_repository_if_needed(messenger, update, project_repo, project_workdir):
+            return
+
+        init_success = await claude.initialize_claude_md(messenger, update, project_workdir)
+        if init_success:
+            # Spare the next command the clone and CLAUDE.md checks
+            claude.mark_project_ready(project_workdir)
 
     # Spin up the project regardless of CLAUDE.md initialization result
     if project_up:
@@ -1018,6 +821,7 @@ async def cmd_init(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     await reply(update, f"Successfully initialized CLAUDE.md for project: {project_name}")
 
 
+@require_auth("up")
 async def cmd_up(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /up command. Format: /up [project-name] [branch]
 
@@ -1026,32 +830,24 @@ async def cmd_up(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     messenger = get_messenger()
 
-    if not update.message:
-        logger.info("Received /up command with no message object")
-        return
-
-    if not is_authorized(update):
-        logger.info("Unauthorized user attempted to use /up command")
-        authorized_list = ", ".join(config.AUTHORIZED_USERS)
-        await reply(update, f"I only respond to {authorized_list}")
-        return
-
     logger.info("Received /up command")
 
+    args = context.args or ()
+
     # Get project name and branch from args or thread context
     project_name = None
     project = None
     branch = "main"  # Default branch
 
-    if context.args and len(context.args) >= 1:
-        project_name = context.args[0]
+    if args:
+        project_name = args[0]
         project = config.get_project(project_name)
         if not project:
-            await reply(update, f"Project '{project_name}' not found. Available projects: {config.get_available_projects()}")
+            await reply(update, config.project_not_found_message(project_name))
             return
         # Check for optional branch parameter
-        if len(context.args) >= 2:
-            branch = context.args[1]
+        if len(args) >= 2:
+            branch = args[1]
     else:
         # Try to get project from thread context with fallback
         thread_key, worktree_info = get_thread_key_with_fallback(update)
@@ -1078,10 +874,9 @@ async def cmd_up(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
     # Clear any existing thread associations for this project from other threads
     # This ensures only one thread is associated with the running project
-    for existing_key, info in list(claude.get_all_thread_worktrees().items()):
-        if info.get("project_name") == project_name and existing_key != thread_key:
-            claude.clear_thread_worktree(existing_key)
-            logger.info(f"Cleared old thread association {existing_key} for project {project_name}")
+    for existing_key in claude.get_thread_keys_for_project(project_name) - {thread_key}:
+        claude.clear_thread_worktree(existing_key)
+        logger.info("Cleared old thread association %s for project %s", existing_key, project_name)
 
     # Clean up workdir and pull from specified branch before spinning up
     await reply(update, f"Switching to branch: {branch}...")
@@ -1094,10 +889,12 @@ async def cmd_up(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     # Create a pseudo worktree entry for the project context
     claude.set_thread_worktree(
         thread_key, f"up-{project_name}", None,
-        project_workdir, project_workdir, project_name, project_repo
+        project_workdir, project_workdir, project_name, project_repo,
+        kind="up"
     )
 
 
+@require_auth("stop")
 async def cmd_stop(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /stop command. Format: /stop [project-name]
 
@@ -1105,26 +902,18 @@ async def cmd_stop(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     messenger = get_messenger()
 
-    if not update.message:
-        logger.info("Received /stop command with no message object")
-        return
-
-    if not is_authorized(update):
-        logger.info("Unauthorized user attempted to use /stop command")
-        authorized_list = ", ".join(config.AUTHORIZED_USERS)
-        await reply(update, f"I only respond to {authorized_list}")
-        return
-
     logger.info("Received /stop command")
 
+    args = context.args or ()
+
     # Get project name from args or thread context
     project_name = None
 
-    if context.args and len(context.args) >= 1:
-        project_name = context.args[0]
+    if args:
+        project_name = args[0]
         project = config.get_project(project_name)
         if not project:
-            await reply(update, f"Project '{project_name}' not found. Available projects: {config.get_available_projects()}")
+            await reply(update, config.project_not_found_message(project_name))
             return
     else:
         # Try to get project from thread context with fallback
@@ -1144,75 +933,67 @@ async def cmd_down(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     await cmd_stop(update, context)
 
 
-async def cmd_status(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle /status command. Shows running projects and completed jobs."""
-    if not update.message:
-        logger.info("Received /status command with no message object")
-        return
+def _format_query_row(project_name: str, query_id: str, info: dict, now) -> str:
+    """Format a running or queued Claude query as a /status line."""
+    cmd = info.get("command", "query")
+    prompt_full = info.get("prompt", "")
+    prompt = prompt_full[:50] + "..." if len(prompt_full) > 50 else prompt_full
+    started = info.get("started_at")
+    elapsed_str = f"{(now - started).total_seconds() / 60:.1f}m" if started else "?"
+    if info.get("queued"):
+        elapsed_str = f"queued {elapsed_str}"
+    return f"  [{query_id}] {project_name} /{cmd}: {prompt} ({elapsed_str})"
+
+
+def _format_job_row(job_id: str, info: dict, now) -> str:
+    """Format a completed job as a /status line."""
+    completed = info.get("completed_at")
+    if completed:
+        age = (now - completed).total_seconds() / 60
+        age_str = f"{age:.0f}m ago" if age < 60 else f"{age/60:.1f}h ago"
+    else:
+        age_str = "?"
+    return f"  [{job_id}] {info.get('project_name', '?')} /{info.get('command', '?')} ({age_str})"
 
-    if not is_authorized(update):
-        logger.info("Unauthorized user attempted to use /status command")
-        authorized_list = ", ".join(config.AUTHORIZED_USERS)
-        await reply(update, f"I only respond to {authorized_list}")
-        return
 
+def _format_process_row(project_name: str, entry: process.ProjectProcess) -> str:
+    """Format a background process started by /up as a /status line."""
+    is_running, pid, returncode = entry.status()
+    if is_running:
+        return f"  - {project_name} (PID: {pid})"
+    return f"  - {project_name} (PID: {pid}, exited with code {returncode})"
+
+
+@require_auth("status")
+async def cmd_status(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle /status command. Shows running projects and completed jobs."""
     logger.info("Received /status command")
 
-    from datetime import datetime as dt
     status_lines = []
+    append = status_lines.append
+    extend = status_lines.extend
+    now = dt.now()
 
     # Check running Claude queries
     running_queries = claude.get_all_running_queries()
     if running_queries:
-        status_lines.append("Running Claude queries:")
+        append("Running Claude queries:")
         for project_name, queries in running_queries.items():
-            for query_id, info in queries.items():
-                cmd = info.get("command", "query")
-                prompt = info.get("prompt", "")[:50]
-                if len(info.get("prompt", "")) > 50:
-                    prompt += "..."
-                started = info.get("started_at")
-                if started:
-                    elapsed = (dt.now() - started).total_seconds() / 60
-                    elapsed_str = f"{elapsed:.1f}m"
-                else:
-                    elapsed_str = "?"
-                status_lines.append(f"  [{query_id}] {project_name} /{cmd}: {prompt} ({elapsed_str})")
-
-        status_lines.append("")
-        status_lines.append("Use /cancel <project> [id] to cancel queries")
+            extend(_format_query_row(project_name, query_id, info, now) for query_id, info in queries.items())
+        extend(("", "Use /cancel <project> [id] to cancel queries"))
 
     # Check completed jobs available for feedback
     completed_jobs = claude.COMPLETED_JOBS
     if completed_jobs:
-        status_lines.append("\nCompleted jobs (available for /feedback):")
-        for job_id, info in completed_jobs.items():
-            project = info.get("project_name", "?")
-            cmd = info.get("command", "?")
-            completed = info.get("completed_at")
-            if completed:
-                age = (dt.now() - completed).total_seconds() / 60
-                if age < 60:
-                    age_str = f"{age:.0f}m ago"
-                else:
-                    age_str = f"{age/60:.1f}h ago"
-            else:
-                age_str = "?"
-            status_lines.append(f"  [{job_id}] {project} /{cmd} ({age_str})")
-
-        status_lines.append("")
-        status_lines.append("Use /feedback <project> <job-id> <prompt> to continue")
+        append("\nCompleted jobs (available for /feedback):")
+        extend(_format_job_row(job_id, info, now) for job_id, info in completed_jobs.items())
+        extend(("", "Use /feedback <project> <job-id> <prompt> to continue"))
 
     # Check running background processes (from /up)
     running_projects = process.get_running_projects()
     if running_projects:
-        status_lines.append("\nRunning background processes:")
-        for project_name, process_info in running_projects.items():
-            proc, log_path, _ = process_info
-            if proc.poll() is None:
-                status_lines.append(f"  - {project_name} (PID: {proc.pid})")
-            else:
-                status_lines.append(f"  - {project_name} (PID: {proc.pid}, exited with code {proc.returncode})")
+        append("\nRunning background processes:")
+        extend(_format_process_row(project_name, entry) for project_name, entry in running_projects.items())
 
     if not status_lines:
         await reply(update, "No running queries, completed jobs, or processes.")
@@ -1221,43 +1002,36 @@ async def cmd_status(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     await reply(update, "\n".join(status_lines))
 
 
+@require_auth("cancel")
 async def cmd_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /cancel command. Format: /cancel [project-name] [query-id]
 
     If no args and thread has context, cancel queries for that project.
     If no args and no thread context, cancel all running queries.
     """
-    if not update.message:
-        logger.info("Received /cancel command with no message object")
-        return
-
-    if not is_authorized(update):
-        logger.info("Unauthorized user attempted to use /cancel command")
-        authorized_list = ", ".join(config.AUTHORIZED_USERS)
-        await reply(update, f"I only respond to {authorized_list}")
-        return
-
     logger.info("Received /cancel command")
 
+    args = context.args or ()
+
     project_name = None
     query_id = None
 
     # Get thread context with fallback once
     thread_key, worktree_info = get_thread_key_with_fallback(update)
 
-    if context.args and len(context.args) >= 1:
+    if args:
         # Check if first arg is a project name or query ID
-        potential_project = context.args[0]
+        potential_project = args[0]
         if config.get_project(potential_project):
             project_name = potential_project
-            query_id = context.args[1] if len(context.args) > 1 else None
+            query_id = args[1] if len(args) > 1 else None
         else:
             # First arg might be a query ID if thread has context
             if worktree_info:
                 project_name = worktree_info.get("project_name")
                 query_id = potential_project  # Treat first arg as query ID
             else:
-                await reply(update, f"Project '{potential_project}' not found. Available projects: {config.get_available_projects()}")
+                await reply(update, config.project_not_found_message(potential_project))
                 return
     else:
         # No args - try thread context
@@ -1272,10 +1046,9 @@ async def cmd_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
             await reply(update, "No running queries to cancel.")
             return
 
-        all_cancelled = []
-        for pname in list(running.keys()):
-            cancelled = claude.cancel_query(pname)
-            all_cancelled.extend([f"{pname}:{qid}" for qid in cancelled])
+        # cancel_query removes worktrees with blocking git calls; run the projects in parallel threads
+        results = await asyncio.gather(*(asyncio.to_thread(claude.cancel_query, pname) for pname in running))
+        all_cancelled = [f"{pname}:{qid}" for pname, cancelled in zip(running, results) for qid in cancelled]
 
         if all_cancelled:
             await reply(update, f"Cancelled {len(all_cancelled)} queries: {', '.join(all_cancelled)}")
@@ -1295,48 +1068,43 @@ async def cmd_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
             await reply(update, f"Query ID '{query_id}' not found for project {project_name}. Running queries: {', '.join(queries.keys())}")
             return
 
-        cancelled = claude.cancel_query(project_name, query_id)
+        cancelled = await asyncio.to_thread(claude.cancel_query, project_name, query_id)
         if cancelled:
             await reply(update, f"Cancelled query {query_id} for project {project_name}.")
         else:
             await reply(update, f"Failed to cancel query {query_id} for project {project_name}.")
     else:
         # Cancel all queries for the project
-        cancelled = claude.cancel_query(project_name)
+        cancelled = await asyncio.to_thread(claude.cancel_query, project_name)
         if cancelled:
             await reply(update, f"Cancelled {len(cancelled)} queries for project {project_name}: {', '.join(cancelled)}")
         else:
             await reply(update, f"Failed to cancel queries for project {project_name}.")
 
 
+@require_auth("log")
 async def cmd_log(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /log command. Format: /log [project-name] [lines]
 
     If project-name is not provided, uses the project from thread context.
     """
-    if not update.message:
-        logger.info("Received /log command with no message object")
-        return
-
-    if not is_authorized(update):
-        logger.info("Unauthorized user attempted to use /log command")
-        authorized_list = ", ".join(config.AUTHORIZED_USERS)
-        await reply(update, f"I only respond to {authorized_list}")
-        return
-
     logger.info("Received /log command")
 
+    args = context.args or ()
+
     project_name = None
+    project = None
     lines = 50
 
-    if context.args and len(context.args) >= 1:
+    if args:
         # Check if first arg is a project name or number of lines
-        first_arg = context.args[0]
-        if config.get_project(first_arg):
+        first_arg = args[0]
+        project = config.get_project(first_arg)
+        if project:
             project_name = first_arg
-            if len(context.args) >= 2:
+            if len(args) >= 2:
                 try:
-                    lines = int(context.args[1])
+                    lines = int(args[1])
                     lines = min(max(lines, 1), 200)
                 except ValueError:
                     await reply(update, "Invalid number of lines. Using default (50).")
@@ -1346,7 +1114,7 @@ async def cmd_log(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
                 lines = int(first_arg)
                 lines = min(max(lines, 1), 200)
             except ValueError:
-                await reply(update, f"Project '{first_arg}' not found. Available projects: {config.get_available_projects()}")
+                await reply(update, config.project_not_found_message(first_arg))
                 return
 
     # If no project name, try thread context with fallback
@@ -1359,9 +1127,10 @@ async def cmd_log(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await reply(update, "Usage: /log [project-name] [lines]\n\nNo project specified and no project context in this thread.")
         return
 
-    project = config.get_project(project_name)
     if not project:
-        await reply(update, f"Project '{project_name}' not found. Available projects: {config.get_available_projects()}")
+        project = config.get_project(project_name)
+    if not project:
+        await reply(update, config.project_not_found_message(project_name))
         return
 
     # Check if project is running
@@ -1380,106 +1149,97 @@ async def cmd_log(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     status = "running" if is_running else f"exited"
     header = f"Logs for {project_name} (PID: {pid}, {status}) - last {lines} lines:\n\n"
 
-    output = header + logs
-    if len(output) > 4000:
-        output = output[:4000] + "\n\n[Output truncated...]"
+    await reply(update, clip_output(header + logs))
 
-    await reply(update, output)
 
+def _read_file_head(path: str, max_chars: int) -> str | None:
+    """Read at most the first max_chars characters of a file, or None if it does not exist."""
+    try:
+        with open(path, 'r', errors='replace') as f:
+            return f.read(max_chars)
+    except FileNotFoundError:
+        return None
 
+
+@require_auth("cost")
 async def cmd_cost(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /cost command. Displays Claude usage costs via claude-monitor."""
-    if not update.message:
-        logger.info("Received /cost command with no message object")
-        return
-
-    if not is_authorized(update):
-        logger.info("Unauthorized user attempted to use /cost command")
-        authorized_list = ", ".join(config.AUTHORIZED_USERS)
-        await reply(update, f"I only respond to {authorized_list}")
-        return
+    global _cost_cache
 
     logger.info("Received /cost command")
 
+    # Formatting the report takes a Claude query; reuse a recent one instead
+    if _cost_cache and time.monotonic() - _cost_cache[0] < COST_CACHE_TTL:
+        logger.info("Replying to /cost with cached report")
+        await reply(update, _cost_cache[1])
+        return
+
     await reply(update, "Fetching Claude usage costs...")
 
     log_file = "claude-monitor.log"
 
     try:
-        # Run the claude-monitor command
-        cmd = f"rm {log_file} || true && claude-monitor --view daily >{log_file} 2>&1 < /dev/null & sleep 3 && pkill -f \"claude-monitor --view\""
-
-        result = subprocess.run(
-            cmd,
-            shell=True,
-            capture_output=True,
-            text=True,
-            timeout=30
-        )
+        # Let claude-monitor render the daily view for a few seconds, then stop it
+        try:
+            os.unlink(log_file)
+        except FileNotFoundError:
+            pass
+
+        try:
+            with open(log_file, 'wb') as log_fd:
+                monitor = await asyncio.create_subprocess_exec(
+                    "claude-monitor", "--view", "daily",
+                    stdin=asyncio.subprocess.DEVNULL, stdout=log_fd, stderr=asyncio.subprocess.STDOUT
+                )
+        except FileNotFoundError:
+            await reply(update, "claude-monitor not found. Make sure claude-monitor is installed.")
+            return
 
-        logger.info(f"claude-monitor command completed with return code: {result.returncode}")
+        # Stop early if claude-monitor exits on its own (e.g. bad arguments)
+        try:
+            await asyncio.wait_for(monitor.wait(), timeout=3)
+        except asyncio.TimeoutError:
+            try:
+                monitor.terminate()
+            except ProcessLookupError:
+                pass
+            await monitor.wait()
+
+        logger.info("claude-monitor command completed with return code: %s", monitor.returncode)
 
         prompt = f"""
 Please edit the {log_file}, just take the Summary, remove everything else. Also remove the ASCII lines and make it chat message friendly.
 """
 
-        project_workdir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-        _, _ = await claude.run_claude_query(prompt, config.ASK_RULES, project_workdir)
+        _, _ = await claude.run_claude_query(prompt, config.ASK_RULES, config.BOT_DIR)
 
         # Read the log file instead of stdout
-        if os.path.exists(log_file):
-            with open(log_file, 'r') as f:
-                log_content = f.read()
-
+        # One character past the limit is enough for clip_output to see the cut
+        log_content = await asyncio.to_thread(_read_file_head, log_file, OUTPUT_LIMIT + 1)
+        if log_content is not None:
             if log_content:
-                if len(log_content) > 4000:
-                    await reply(update, log_content[:4000] + "\n\n[Output truncated...]")
-                else:
-                    await reply(update, log_content)
+                log_content = clip_output(log_content)
+                _cost_cache = (time.monotonic(), log_content)
+                await reply(update, log_content)
             else:
                 await reply(update, "No cost data available in log file.")
         else:
             await reply(update, "claude-monitor.log file not found. Make sure claude-monitor is installed.")
 
-    except subprocess.TimeoutExpired:
-        await reply(update, "Command timed out after 30 seconds")
     except Exception as e:
-        logger.error(f"Error running claude-monitor command: {e}")
+        logger.error("Error running claude-monitor command: %s", e)
         await reply(update, f"Error fetching cost data: {str(e)}")
 
 
+@require_auth("cleanup")
 async def cmd_cleanup(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /cleanup command. Clean up orphan worktrees."""
-    if not update.message:
-        logger.info("Received /cleanup command with no message object")
-        return
-
-    if not is_authorized(update):
-        logger.info("Unauthorized user attempted to use /cleanup command")
-        authorized_list = ", ".join(config.AUTHORIZED_USERS)
-        await reply(update, f"I only respond to {authorized_list}")
-        return
-
     logger.info("Received /cleanup command")
 
     # Get all active worktree IDs (running queries + completed jobs + thread worktrees)
-    active_ids = set()
+    active_ids = claude.get_active_query_ids()
 
-    # Add running query IDs
-    running_queries = claude.get_all_running_queries()
-    for project_name, queries in running_queries.items():
-        for query_id in queries.keys():
-            active_ids.add(query_id)
-
-    # Add completed job IDs
-    for job_id in claude.COMPLETED_JOBS.keys():
-        active_ids.add(job_id)
-
-    # Add thread-worktree IDs
-    for thread_key, info in claude.get_all_thread_worktrees().items():
-        active_ids.add(info.get("query_id"))
-
-    logger.info(f"Active worktree IDs to preserve: {active_ids}")
+    logger.info("Active worktree IDs to preserve: %s", active_ids)
 
     # Scan worktree base directory for orphan worktrees
     worktree_base = config.WORKTREE_BASE
@@ -1487,37 +1247,9 @@ async def cmd_cleanup(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         await reply(update, "No worktrees directory found. Nothing to clean up.")
         return
 
-    cleaned = []
-    errors = []
-
-    for project_dir in os.listdir(worktree_base):
-        project_path = os.path.join(worktree_base, project_dir)
-        if not os.path.isdir(project_path):
-            continue
-
-        # Get the project's main workdir for git worktree commands
-        project = config.get_project(project_dir)
-        project_workdir = project['project_workdir'] if project else None
-
-        for worktree_id in os.listdir(project_path):
-            worktree_path = os.path.join(project_path, worktree_id)
-            if not os.path.isdir(worktree_path):
-                continue
-
-            # Check if this worktree is active
-            if worktree_id not in active_ids:
-                logger.info(f"Cleaning up orphan worktree: {worktree_path}")
-                try:
-                    if project_workdir:
-                        git.cleanup_worktree(project_workdir, worktree_path)
-                    else:
-                        # Fallback: just remove the directory
-                        import shutil
-                        shutil.rmtree(worktree_path, ignore_errors=True)
-                    cleaned.append(f"{project_dir}/{worktree_id}")
-                except Exception as e:
-                    logger.error(f"Error cleaning up {worktree_path}: {e}")
-                    errors.append(f"{project_dir}/{worktree_id}: {str(e)[:50]}")
+    # Resolve project workdirs up front so the scan thread doesn't read config
+    project_workdirs = {p['project_name']: p['project_workdir'] for p in config.PROJECTS}
+    cleaned, errors = await git.cleanup_orphan_worktrees(worktree_base, active_ids, project_workdirs)
 
     # Build response
     lines = []
@@ -1536,18 +1268,9 @@ async def cmd_cleanup(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     await reply(update, "\n".join(lines))
 
 
+@require_auth("list")
 async def cmd_list(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /list command. Display registered projects."""
-    if not update.message:
-        logger.info("Received /list command with no message object")
-        return
-
-    if not is_authorized(update):
-        logger.info("Unauthorized user attempted to use /list command")
-        authorized_list = ", ".join(config.AUTHORIZED_USERS)
-        await reply(update, f"I only respond to {authorized_list}")
-        return
-
     logger.info("Received /list command")
 
     if not config.PROJECTS:
@@ -1555,28 +1278,18 @@ async def cmd_list(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         return
 
     lines = ["Registered projects:\n"]
-    for project in config.PROJECTS:
-        name = project.get('project_name', '?')
-        repo = project.get('project_repo', '?')
-        workdir = project.get('project_workdir', '?')
-        has_up = "Yes" if project.get('project_up') else "No"
-
-        lines.append(f"**{name}**")
-        lines.append(f"  Repo: {repo}")
-        lines.append(f"  Workdir: {workdir}")
-        lines.append(f"  Has project_up: {has_up}")
-        lines.append("")
+    lines.extend(
+        f"**{project.get('project_name', '?')}**\n"
+        f"  Repo: {project.get('project_repo', '?')}\n"
+        f"  Workdir: {project.get('project_workdir', '?')}\n"
+        f"  Has project_up: {'Yes' if project.get('project_up') else 'No'}\n"
+        for project in config.PROJECTS
+    )
 
     await reply(update, "\n".join(lines))
 
 
-async def cmd_help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle /help command. Display available commands."""
-    if not update.message:
-        logger.info("Received /help command with no message object")
-        return
-
-    help_text = """Available commands:
+_HELP_TEXT = """Available commands:
 
 /help
   Show this help message
@@ -1640,71 +1353,81 @@ async def cmd_help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 /selfupdate
   Update bot from GitHub and restart"""
 
-    await reply(update, help_text)
-
-
-async def cmd_selfupdate(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle /selfupdate command. Updates bot from GitHub and restarts."""
-    import sys
-    import shutil
 
+async def cmd_help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle /help command. Display available commands."""
     if not update.message:
-        logger.info("Received /selfupdate command with no message object")
+        logger.info("Received /help command with no message object")
         return
 
-    if not is_authorized(update):
-        logger.info("Unauthorized user attempted to use /selfupdate command")
-        authorized_list = ", ".join(config.AUTHORIZED_USERS)
-        await reply(update, f"I only respond to {authorized_list}")
-        return
+    await reply(update, _HELP_TEXT)
 
+
+# Files whose changes require reinstalling the bot package on selfupdate
+_DEPENDENCY_FILES = frozenset({"pyproject.toml", "setup.py", "setup.cfg", "requirements.txt", "uv.lock", "poetry.lock"})
+
+
+# Marker kept under .git (untouched by the reset) while a selfupdate reinstall has not succeeded
+_REINSTALL_PENDING_MARKER = "ccc_reinstall_pending"
+
+
+def _dependency_files_changed(changed_files: set[str]) -> bool:
+    """Check whether any changed path is a packaging or requirements file."""
+    return any(
+        path in _DEPENDENCY_FILES or (path.startswith("requirements") and path.endswith(".txt"))
+        for path in changed_files
+    )
+
+
+async def _reinstall_package(bot_dir: str) -> subprocess.CompletedProcess:
+    """Reinstall the bot package, preferring uv and falling back to pip."""
+    if shutil.which("uv"):
+        result = await process.run_command_tail(
+            ["uv", "pip", "install", "--python", sys.executable, "-e", "."], cwd=bot_dir, timeout=300
+        )
+        if result.returncode == 0:
+            return result
+        # e.g. an externally managed interpreter that uv refuses to install into
+        logger.warning("uv pip install failed, falling back to pip: %s", result.stdout[-500:])
+    return await process.run_command_tail([sys.executable, "-m", "pip", "install", "-e", "."], cwd=bot_dir, timeout=300)
+
+
+@require_auth("selfupdate")
+async def cmd_selfupdate(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle /selfupdate command. Updates bot from GitHub and restarts."""
     logger.info("Received /selfupdate command")
 
     # Get the bot's installation directory
-    bot_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    config_path = os.path.join(bot_dir, "config.yaml")
+    bot_dir = config.BOT_DIR
+    config_path = config.DEFAULT_CONFIG_PATH
     config_backup_path = os.path.join("/tmp", "ccc_config_backup.yaml")
 
     # Get current commit
-    current_commit_result = subprocess.run(
-        ["git", "log", "-1", "--format=%h %s"],
-        cwd=bot_dir,
-        capture_output=True,
-        text=True,
-        timeout=10
-    )
-    current_commit = current_commit_result.stdout.strip() if current_commit_result.returncode == 0 else "unknown"
+    current_commit = await git.get_head_commit(bot_dir)
 
     await reply(update, f"Starting self-update...\nCurrent: {current_commit}")
 
+    # Background tasks overlapped with progress messages; awaited on every exit path
+    tasks = []
     try:
         # Backup config.yaml
         if os.path.exists(config_path):
-            shutil.copy2(config_path, config_backup_path)
-            logger.info(f"Backed up config.yaml to {config_backup_path}")
+            # Keep the permission bits (the file holds tokens); timestamps don't matter
+            shutil.copy(config_path, config_backup_path)
+            logger.info("Backed up config.yaml to %s", config_backup_path)
 
-        # Fetch latest from origin
+        # Fetch latest from origin, overlapping the fetch with the progress message
+        fetch_task = asyncio.create_task(process.run_command_tail(["git", "fetch", "origin"], cwd=bot_dir, timeout=60))
+        tasks.append(fetch_task)
         await reply(update, "Fetching latest code from GitHub...")
-        fetch_result = subprocess.run(
-            ["git", "fetch", "origin"],
-            cwd=bot_dir,
-            capture_output=True,
-            text=True,
-            timeout=60
-        )
+        fetch_result = await fetch_task
 
         if fetch_result.returncode != 0:
-            await reply(update, f"Failed to fetch: {fetch_result.stderr[:500]}")
+            await reply(update, f"Failed to fetch: {fetch_result.stdout[-500:]}")
             return
 
         # Reset to origin/main
-        reset_result = subprocess.run(
-            ["git", "reset", "--hard", "origin/main"],
-            cwd=bot_dir,
-            capture_output=True,
-            text=True,
-            timeout=60
-        )
+        reset_result = await process.run_command(["git", "reset", "--hard", "origin/main"], cwd=bot_dir, timeout=60)
 
         if reset_result.returncode != 0:
             await reply(update, f"Failed to reset: {reset_result.stderr[:500]}")
@@ -1712,38 +1435,48 @@ async def cmd_selfupdate(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
         # Restore config.yaml
         if os.path.exists(config_backup_path):
-            shutil.copy2(config_backup_path, config_path)
-            logger.info(f"Restored config.yaml from backup")
-
-        # Reinstall package (in case dependencies changed)
-        await reply(update, "Reinstalling package...")
-        pip_result = subprocess.run(
-            [sys.executable, "-m", "pip", "install", "-e", "."],
-            cwd=bot_dir,
-            capture_output=True,
-            text=True,
-            timeout=300
-        )
+            try:
+                # Atomic rename when /tmp and the checkout share a filesystem
+                os.replace(config_backup_path, config_path)
+            except OSError:
+                shutil.copy(config_backup_path, config_path)
+            logger.info("Restored config.yaml from backup")
+
+        # HEAD is final after the reset, so read the new commit alongside the reinstall
+        new_commit_task = asyncio.create_task(git.get_head_commit(bot_dir))
+        tasks.append(new_commit_task)
+
+        # Reinstall package only if dependencies changed (ORIG_HEAD is the pre-reset commit)
+        # A previous reinstall that failed or was interrupted forces one even if dependencies are unchanged now
+        changed_files = await git.get_changed_files(bot_dir, "ORIG_HEAD")
+        reinstall_marker = os.path.join(bot_dir, ".git", _REINSTALL_PENDING_MARKER)
+        if changed_files is not None and not _dependency_files_changed(changed_files) and not os.path.exists(reinstall_marker):
+            await reply(update, "Dependencies unchanged, skipping reinstall")
+        else:
+            try:
+                open(reinstall_marker, "w").close()
+            except OSError as e:
+                logger.warning("Could not write %s: %s", reinstall_marker, e)
+            pip_task = asyncio.create_task(_reinstall_package(bot_dir))
+            tasks.append(pip_task)
+            await reply(update, "Reinstalling package...")
+            pip_result = await pip_task
+
+            if pip_result.returncode != 0:
+                await reply(update, f"Warning: pip install failed: {pip_result.stdout[-500:]}")
+                # Continue anyway, the code update might still work; the marker retries it next time
+            else:
+                try:
+                    os.remove(reinstall_marker)
+                except FileNotFoundError:
+                    pass
 
-        if pip_result.returncode != 0:
-            await reply(update, f"Warning: pip install failed: {pip_result.stderr[:500]}")
-            # Continue anyway, the code update might still work
-
-        # Get new commit
-        new_commit_result = subprocess.run(
-            ["git", "log", "-1", "--format=%h %s"],
-            cwd=bot_dir,
-            capture_output=True,
-            text=True,
-            timeout=10
-        )
-        new_commit = new_commit_result.stdout.strip() if new_commit_result.returncode == 0 else "unknown"
+        new_commit = await new_commit_task
 
         await reply(update, f"Update complete! Restarting bot...\nUpdated to: {new_commit}")
-        logger.info(f"Self-update complete ({current_commit} -> {new_commit}), restarting...")
+        logger.info("Self-update complete (%s -> %s), restarting...", current_commit, new_commit)
 
         # Give telegram time to send the message
-        import asyncio
         await asyncio.sleep(1)
 
         # Restart the process
@@ -1752,10 +1485,12 @@ async def cmd_selfupdate(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     except subprocess.TimeoutExpired:
         await reply(update, "Update timed out")
     except Exception as e:
-        logger.error(f"Error during self-update: {e}")
+        logger.error("Error during self-update: %s", e)
         await reply(update, f"Error during self-update: {str(e)}")
 
         # Try to restore config if something went wrong
         if os.path.exists(config_backup_path) and not os.path.exists(config_path):
-            shutil.copy2(config_backup_path, config_path)
+            shutil.copy(config_backup_path, config_path)
             logger.info("Restored config.yaml after error")
+    finally:
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -1,28 +1,104 @@
 """Telegram-specific messenger implementation."""
 
+import asyncio
+import time
 from typing import Optional
 
 from telegram import Update
+from telegram.error import RetryAfter
 
 from ccc.messenger import Messenger
 from ccc import config
 
+# Longest text sent in one message: Telegram's limit. Output clipped by
+# clip_output (OUTPUT_LIMIT plus TRUNCATED_SUFFIX) fits in a single message.
+MESSAGE_CHUNK_SIZE = 4096
+
+
+def split_message(text: str, limit: int = MESSAGE_CHUNK_SIZE) -> list[str]:
+    """Split text into chunks of at most limit characters, preferring line breaks."""
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            chunks.append(text[:limit])
+            text = text[limit:]
+        else:
+            chunks.append(text[:cut])
+            text = text[cut + 1:]
+    chunks.append(text)
+    return chunks
+
+
+class _TokenBucket:
+    """Token bucket that hands out send slots at a fixed average rate.
+
+    Callers reserve a token and sleep for the returned delay, so concurrent
+    senders queue up in reservation order without needing a lock.
+    """
+
+    def __init__(self, capacity: int, period: float):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def reserve(self) -> float:
+        """Take a token and return the seconds to wait before using it."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
 
 class TelegramMessenger(Messenger):
     """Telegram-specific messenger implementation."""
 
+    # Telegram allows about 30 messages per second per bot and 20 per minute per group
+    _global_bucket = _TokenBucket(30, 1.0)
+    _group_buckets = {}
+
+    async def _throttle(self, chat_id: str) -> None:
+        """Wait until a message may be sent to chat_id without hitting rate limits."""
+        delay = self._global_bucket.reserve()
+        # Group and supergroup ids are negative
+        if chat_id.startswith("-"):
+            bucket = self._group_buckets.get(chat_id)
+            if bucket is None:
+                bucket = self._group_buckets[chat_id] = _TokenBucket(20, 60.0)
+            delay = max(delay, bucket.reserve())
+        if delay:
+            await asyncio.sleep(delay)
+
     async def reply(self, update: Update, text: str) -> None:
         """Send a reply message via Telegram.
 
+        Text longer than MESSAGE_CHUNK_SIZE is sent as several messages.
+
         Args:
             update: Telegram Update object
             text: The text message to send
         """
-        if not update.message:
+        message = update.message
+        if not message:
             return
-        chat_id = str(update.message.chat.id)
+        chat_id = str(message.chat.id)
+        # Resolved once per reply, not per chunk
         thread_id = config.get_telegram_thread_id(chat_id)
-        await update.message.reply_text(text, message_thread_id=thread_id)
+        chunks = split_message(text) if len(text) > MESSAGE_CHUNK_SIZE else (text,)
+        for chunk in chunks:
+            await self._throttle(chat_id)
+            try:
+                await message.reply_text(chunk, message_thread_id=thread_id)
+            except RetryAfter as e:
+                # Flood control despite the buckets (e.g. limits shared with another
+                # client); wait as long as Telegram asks and try once more
+                retry_after = e.retry_after
+                if hasattr(retry_after, "total_seconds"):
+                    retry_after = retry_after.total_seconds()
+                await asyncio.sleep(retry_after)
+                await message.reply_text(chunk, message_thread_id=thread_id)
 
     def get_thread_context(self, update: Update) -> Optional[str]:
         """Get thread/conversation context from Telegram update.